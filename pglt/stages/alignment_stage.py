@@ -14,6 +14,7 @@ import shutil
 import numpy
 from Bio import SeqIO
 import pglt.tools.alignment_tools as atools
+import pglt.tools.store_tools as stools
 from pglt.tools.system_tools import MissingDepError
 
 
@@ -32,21 +33,35 @@ def readSequences(download_dir, namesdict, genedict, logger, wd):
     # add alignments key to namesdict
     for key in namesdict.keys():
         namesdict[key]['alignments'] = 0
-    genes = sorted(os.listdir(download_dir))
-    genes = [e for e in genes if not re.search("^\.|^log\.txt$", e)]
+    if stools.isStore(download_dir):
+        index = stools.readIndex(download_dir)
+        genes = sorted(index.keys())
+    else:
+        # folders of fasta files, as written by earlier versions
+        index = None
+        genes = sorted(os.listdir(download_dir))
+        genes = [e for e in genes if not re.search("^\.|^log\.txt$", e)]
     genekeys = {}
     for gene in genes:
         genekeys[gene] = re.sub('_cluster[0-9]+', '', gene)
     genestore = []
     for gene in genes:
-        gene_dir = os.path.join(download_dir, gene)
-        seq_files = os.listdir(gene_dir)
         maxfails = int(genedict[genekeys[gene]]["maxfails"])
         maxgaps = float(genedict[genekeys[gene]]["maxgaps"])
         minoverlap = int(genedict[genekeys[gene]]["minoverlap"])
-        seqstore = atools.SeqStore(gene_dir, seq_files, maxfails=maxfails,
-                                   maxgaps=maxgaps, minoverlap=minoverlap,
-                                   logger=logger, wd=wd)
+        if index is None:
+            gene_dir = os.path.join(download_dir, gene)
+            seqstore = atools.SeqStore(gene_dir, os.listdir(gene_dir),
+                                       maxfails=maxfails, maxgaps=maxgaps,
+                                       minoverlap=minoverlap, logger=logger,
+                                       wd=wd)
+        else:
+            seqstore = atools.SeqStore(download_dir, None, maxfails=maxfails,
+                                       maxgaps=maxgaps, minoverlap=minoverlap,
+                                       logger=logger, wd=wd,
+                                       locations=index[gene])
+        # overlaps between all sequences, found once for all alignments
+        seqstore.findOverlaps()
         genestore.append((gene, seqstore))
     return namesdict, genestore, genekeys
 
@@ -8,10 +8,13 @@ pglt Stage 2: Sequence Download
 # PACKAGES
 import os
 import pickle
+import shutil
 import logging
+from itertools import izip
+from multiprocessing.pool import ThreadPool
 import pglt.tools.download_tools as dtools
+import pglt.tools.store_tools as stools
 from pglt.tools.system_tools import TooFewSpeciesError
-from pglt.tools.system_tools import MissingDepError
 
 
 def run(wd=os.getcwd(), logger=logging.getLogger('')):
@@ -22,12 +25,12 @@ def run(wd=os.getcwd(), logger=logging.getLogger('')):
     # DIRS
     download_dir = os.path.join(wd, '2_download')
     temp_dir = os.path.join(wd, 'tempfiles')
+    # results are checkpointed per gene and name so a restart resumes
+    checkpoint_dir = os.path.join(temp_dir, 'download_checkpoints')
     if not os.path.isdir(download_dir):
         os.mkdir(download_dir)
-
-    # CHECK DEPS
-    if not dtools.atools.blastn:
-        raise MissingDepError('blastn')
+    if not os.path.isdir(checkpoint_dir):
+        os.mkdir(checkpoint_dir)
 
     # INPUT
     with open(os.path.join(temp_dir, "genedict.p"), "rb") as file:
@@ -38,9 +41,27 @@ def run(wd=os.getcwd(), logger=logging.getLogger('')):
         namesdict = pickle.load(file)
     with open(os.path.join(temp_dir, "allrankids.p"), "rb") as file:
         allrankids = pickle.load(file)
+    # checkpoints of a run with other inputs are not reused
+    key = dtools.checkpointKey(paradict, genedict, namesdict, allrankids)
+    key_path = os.path.join(checkpoint_dir, 'inputs.p')
+    if not os.path.isfile(key_path) or\
+            dtools.readCheckpoint(key_path) != key:
+        shutil.rmtree(checkpoint_dir)
+        os.mkdir(checkpoint_dir)
+        dtools.writeCheckpoint(key, key_path)
 
     # PARAMETERS
-    dtools.etools.Entrez.email = paradict["email"]
+    # names are downloaded by a pool of workers, all requests for this
+    #  folder go through its own client, which holds its own offline
+    #  databases and cassette as other folders run at the same time
+    nworkers = int(paradict.get('download_workers') or 1)
+    client = dtools.etools.Client(email=paradict["email"],
+                                  api_key=paradict.get("api_key"),
+                                  maxconnections=nworkers)
+    client.setUpTaxDump(paradict.get("taxdump"))
+    client.setUpSeqDB(paradict.get("seqdb"))
+    client.setUpCassette(temp_dir, paradict.get("cassette"),
+                         paradict.get("cassette_latency"))
     nseqs = int(paradict['nseqs'])
     thoroughness = int(paradict['thoroughness'])
     target = int(paradict['target_ngenes'])
@@ -49,15 +70,25 @@ def run(wd=os.getcwd(), logger=logging.getLogger('')):
     maxpn = float(paradict['maxpn'])
     votesize = int(paradict['votesize'])
     maxtrys = int(paradict['maxvotetrys'])
+    maxids = nseqs * int(paradict.get('sample_multiple') or 10)
     seqcounter = basecounter = 0
+    # search results of gene selection are reused by the downloads
+    searchstore = {}
 
     # PROCESS
-    logger.info('Determining best genes ....')
-    genes = dtools.findBestGenes(namesdict=namesdict, genedict=genedict,
-                                 thoroughness=thoroughness,
-                                 allrankids=allrankids, logger=logger,
-                                 minnseq=minnseq, target=target,
-                                 minnspp=minnspp)
+    genes_path = dtools.checkpointPath(checkpoint_dir, 'genes')
+    if os.path.isfile(genes_path):
+        logger.info('Resuming download ....')
+        genes = dtools.readCheckpoint(genes_path)
+    else:
+        logger.info('Determining best genes ....')
+        genes = dtools.findBestGenes(namesdict=namesdict, genedict=genedict,
+                                     thoroughness=thoroughness,
+                                     allrankids=allrankids, logger=logger,
+                                     minnseq=minnseq, target=target,
+                                     minnspp=minnspp, client=client,
+                                     searchstore=searchstore, maxids=maxids)
+        dtools.writeCheckpoint(genes, genes_path)
     if not genes:
         raise TooFewSpeciesError
     statement = 'Using genes:'
@@ -67,67 +98,110 @@ def run(wd=os.getcwd(), logger=logging.getLogger('')):
     # Add genes to namesdict
     for key in namesdict.keys():
         namesdict[key]['genes'] = 0
-    for gene in genes:
-        gene_sequences = []
-        seqcounter_gene = noseqcounter_gene = spcounter_gene = 0
-        gene_names = genedict[gene]["names"]
-        minlen = int(genedict[gene]["minlen"])
-        maxlen = int(genedict[gene]["maxlen"])
-        minoverlap = int(genedict[gene]['minoverlap'])
-        logger.info('Downloading and outputting for [{0}] ....'.format(gene))
-        for name in namesdict.keys():
-            logger.info("..... [{0}]".format(name))
-            taxids = namesdict[name]["txids"]
-            downloader = dtools.Downloader(gene_names=gene_names, nseqs=nseqs,
-                                           thoroughness=thoroughness,
-                                           maxpn=maxpn, votesize=votesize,
-                                           maxtrys=maxtrys,
-                                           minoverlap=minoverlap,
-                                           maxlen=maxlen, minlen=minlen,
-                                           logger=logger, wd=temp_dir)
-            sequences = downloader.run(taxids)
-            if not sequences:
-                noseqcounter_gene += 1
-                logger.info("........ no sequences found")
+    # genes finished, and counters after them
+    progress_path = dtools.checkpointPath(checkpoint_dir, 'progress')
+    genes_done = []
+    if os.path.isfile(progress_path):
+        genes_done, seqcounter, basecounter, ngenes =\
+            dtools.readCheckpoint(progress_path)
+        for key in ngenes.keys():
+            namesdict[key]['genes'] = ngenes[key]
+    else:
+        # nothing kept from an earlier run
+        stools.removeStore(download_dir)
+
+    def download(args):
+        # run downloader, unless its sequences were checkpointed
+        downloader, taxids, path = args
+        if os.path.isfile(path):
+            return dtools.readCheckpoint(path)
+        sequences = downloader.run(taxids)
+        dtools.writeCheckpoint(sequences, path)
+        return sequences
+
+    def finishGene(gene):
+        genes_done.append(gene)
+        ngenes = dict([(e, namesdict[e]['genes']) for e in namesdict.keys()])
+        dtools.writeCheckpoint((genes_done, seqcounter, basecounter, ngenes),
+                               progress_path)
+    pool = ThreadPool(nworkers)
+    try:
+        for gene in genes:
+            if gene in genes_done:
+                logger.info('Already downloaded [{0}]'.format(gene))
                 continue
-            logger.info("........ downloaded [{0}] sequences".
-                        format(len(sequences)))
-            gene_sequences.extend(zip([name] * len(sequences), sequences))
-        if noseqcounter_gene == len(namesdict.keys()):
-            logger.info("No sequences were downloaded for gene [{0}]".
+            gene_sequences = []
+            seqcounter_gene = noseqcounter_gene = spcounter_gene = 0
+            gene_names = genedict[gene]["names"]
+            minlen = int(genedict[gene]["minlen"])
+            maxlen = int(genedict[gene]["maxlen"])
+            minoverlap = int(genedict[gene]['minoverlap'])
+            logger.info('Downloading and outputting for [{0}] ....'.
                         format(gene))
-            continue
-        else:
-            seqcounter += seqcounter_gene
-        logger.info('Checking for distinct clusters ....')
-        gene_sequences = dtools.getClusters(gene_sequences, minoverlap,
-                                            logger, temp_dir)
-        if not gene_sequences:
-            logger.info('.... could not find any clustering sequences')
-            continue
-        logger.info('.... found [{0}] clusters'.format(len(gene_sequences)))
-        gene_dir = os.path.join(download_dir, str(gene))
-        for i in range(len(gene_sequences)):
-            outdir = '{0}_cluster{1}'.format(gene_dir, i)
-            if not os.path.isdir(outdir):
-                os.mkdir(outdir)
-            for name in namesdict.keys():
-                seqs = [e[1] for e in gene_sequences[i] if e[0] == name]
-                if not seqs:
+            # downloaders are created in order, run at once and their results
+            #  read back in order
+            names = namesdict.keys()
+            downloaders = []
+            for name in names:
+                downloaders.append((dtools.Downloader(
+                    gene_names=gene_names, nseqs=nseqs,
+                    thoroughness=thoroughness, maxpn=maxpn,
+                    votesize=votesize, maxtrys=maxtrys, minoverlap=minoverlap,
+                    maxlen=maxlen, minlen=minlen,
+                    logger=logger, wd=temp_dir, client=client,
+                    searchstore=searchstore, maxids=maxids),
+                    namesdict[name]["txids"],
+                    dtools.checkpointPath(checkpoint_dir, gene, name)))
+            results = pool.imap(download, downloaders)
+            for name, sequences in izip(names, results):
+                logger.info("..... [{0}]".format(name))
+                if not sequences:
+                    noseqcounter_gene += 1
+                    logger.info("........ no sequences found")
                     continue
-                seqs = [e.format('fasta') for e in seqs]
-                with open(os.path.join(outdir, "{0}.fasta".format(name)), 'wb')\
-                        as outfile:
-                    for seq in seqs:
-                        outfile.write("{0}\n".format(seq))
-                        seqcounter_gene += 1
-                        basecounter += len(seq)
-                namesdict[name]['genes'] += 1
-                spcounter_gene += 1
-        logger.info("Downloaded [{0}] sequences for gene [{1}] representing \
-[{2}] species".format(seqcounter_gene, gene, spcounter_gene))
+                logger.info("........ downloaded [{0}] sequences".
+                            format(len(sequences)))
+                gene_sequences.extend(zip([name] * len(sequences), sequences))
+            if noseqcounter_gene == len(namesdict.keys()):
+                logger.info("No sequences were downloaded for gene [{0}]".
+                            format(gene))
+                finishGene(gene)
+                continue
+            else:
+                seqcounter += seqcounter_gene
+            logger.info('Checking for distinct clusters ....')
+            gene_sequences = dtools.getClusters(gene_sequences, minoverlap,
+                                                logger, temp_dir)
+            if not gene_sequences:
+                logger.info('.... could not find any clustering sequences')
+                finishGene(gene)
+                continue
+            logger.info('.... found [{0}] clusters'.
+                        format(len(gene_sequences)))
+            # all clusters are written to one store in download_dir
+            for i in range(len(gene_sequences)):
+                cluster = '{0}_cluster{1}'.format(gene, i)
+                counts = stools.writeCluster(download_dir, cluster,
+                                             gene_sequences[i])
+                for name in counts.keys():
+                    seqcounter_gene += counts[name][0]
+                    basecounter += counts[name][1]
+                    namesdict[name]['genes'] += 1
+                    spcounter_gene += 1
+            logger.info("Downloaded [{0}] sequences for gene [{1}] \
+representing [{2}] species".format(seqcounter_gene, gene, spcounter_gene))
+            finishGene(gene)
+        pool.close()
+    except:
+        # queued downloads are dropped
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
     with open(os.path.join(temp_dir, "namesdict.p"), "wb") as file:
         pickle.dump(namesdict, file)
+    # finished: a new run starts again
+    shutil.rmtree(checkpoint_dir)
     logger.info('Stage finished. Downloaded [{0}] bases for [{1}] \
 sequences for [{2}] species.'.format(basecounter, seqcounter,
                                      sum([namesdict[e]['genes'] > 0 for e in
@@ -35,6 +35,11 @@ def run(wd=os.getcwd(), logger=logging.getLogger('')):
     # PARAMETERS
     outgroupid = paradict["outgroupid"]
     ntools.etools.Entrez.email = paradict["email"]
+    ntools.etools.setApiKey(paradict.get("api_key"))
+    ntools.etools.setUpTaxDump(paradict.get("taxdump"))
+    ntools.etools.setUpSeqDB(paradict.get("seqdb"))
+    ntools.etools.setUpCassette(temp_dir, paradict.get("cassette"),
+                               paradict.get("cassette_latency"))
     minspecies = int(paradict["minspecies"])
     taxonomy = paradict["taxonomic_constraint"]
     taxonomy = taxonomy.split('-')
@@ -7,6 +7,11 @@ pglt tools
 
 import names_tools
 import alignment_tools
+import taxonomy_tools
+import genbank_tools
+import cluster_tools
+import seqdb_tools
+import store_tools
 import entrez_tools
 import download_tools
 import phylogeny_tools
@@ -9,6 +9,12 @@ pglt alignment tools
 import os
 import re
 import random
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+from distutils.spawn import find_executable
 import numpy as np
 from Bio import SeqIO
 from Bio import AlignIO
@@ -17,8 +23,6 @@ from Bio.SeqRecord import SeqRecord
 from Bio.Align import MultipleSeqAlignment
 from Bio.Blast.Applications import NcbiblastnCommandline
 from Bio.Application import ApplicationError
-from Bio.Blast import NCBIXML
-from StringIO import StringIO
 from system_tools import TerminationPipe
 from system_tools import OutgroupError
 from system_tools import TooFewSpeciesError
@@ -26,19 +30,40 @@ from system_tools import MafftError
 from system_tools import TrysError
 from special_tools import timeit
 from special_tools import getThreads
+from special_tools import Cache
+from store_tools import readCluster
 from pglt import _MAFFT as mafft
 from pglt import _MAFFTQ as mafftq
 from pglt import _MAFFTX as mafftx
 from pglt import _BLASTN as blastn
 
+# GLOBALS
+# BLAST hits between pairs of sequences, by wd
+blast_caches = {}
+blast_caches_lock = threading.Lock()
+blast_cache_maxsize = 50 * 1024 ** 2  # bytes of hits kept in each wd
+# hits of a query: subject (by sequence), identities, query start and end
+hit_dtype = np.dtype([('subject', '<u8'), ('identities', '<i4'),
+                      ('query_start', '<i4'), ('query_end', '<i4')])
+# makeblastdb is installed with blastn
+makeblastdb = find_executable('makeblastdb', os.path.dirname(blastn) or
+                              None) if blastn else None
+tabular_format = '"6 qseqid sseqid nident qstart qend"'
+# characters dropped from tabular output, leaving its numbers
+nondigits = ''.join([chr(e) for e in range(256) if chr(e) not in
+                     '0123456789\t\n'])
+# hits of all pairs grow with the square of sequences: overlaps of larger
+#  clusters are found as sequences are added to alignments
+graph_maxseqs = 500
 
 # OBEJECTS
 class SeqStore(dict):
     """Store species' gene sequences with functions for pulling \
 sequences for alignments and adding penalties for sequences that did \
-not align"""
+not align. Sequences are read from the store in genedir at locations \
+({name: (offset, length)}), or else from the fasta seqfiles in genedir."""
     def __init__(self, genedir, seqfiles, maxfails, maxgaps, minoverlap,
-                 logger, wd=os.getcwd()):
+                 logger, wd=os.getcwd(), locations=None):
         self.wd = wd
         self.logger = logger
         self.threads = getThreads(wd)
@@ -48,20 +73,30 @@ not align"""
         self.blast_prop = 0.5  # the p sequences a sequence must overlap
         self.maxgaps = maxgaps
         self.minoverlap = minoverlap
-        for i, seqfile in enumerate(seqfiles):
-            name = re.sub('\.fasta$', '', seqfile)
-            seqdir = os.path.join(genedir, seqfile)
+        self.graph = None  # OverlapGraph of all sequences, if found
+        if locations is None:
+            records = self._readFiles(genedir, seqfiles)
+        else:
+            records = readCluster(genedir, locations)
+        for name, records in records:
             seqs = []
             lengths = []
-            with open(seqdir, "rU") as infile:
-                for record in SeqIO.parse(infile, "fasta"):
-                    record.id = name
-                    lengths.append(len(record))
-                    seqs.append([record, 0])  # seqrecord + nfails
-                    self.nseqs += 1
+            for record in records:
+                record.id = name
+                lengths.append(len(record))
+                # seqrecord + nfails + index in graph
+                seqs.append([record, 0, self.nseqs])
+                self.nseqs += 1
             if len(seqs) > 0:
                 self[name] = [seqs, np.min(lengths)]
 
+    def _readFiles(self, genedir, seqfiles):
+        """Yield name and SeqRecords of each fasta file"""
+        for seqfile in seqfiles:
+            name = re.sub('\.fasta$', '', seqfile)
+            with open(os.path.join(genedir, seqfile), "rU") as infile:
+                yield name, list(SeqIO.parse(infile, "fasta"))
+
     def _add(self, sequences=None, limit=None):
         """Return a random sequence for alignment"""
         # if there are sequences, use blast alignment
@@ -75,9 +110,12 @@ not align"""
                 random.shuffle(rand_ints)
             for i in rand_ints:
                 sp = self.sppool[i]
-                next_seqs = [e[0] for e in self[sp][0]]
-                # blast next_seqs against sequences in alignment
-                res = self._alignmentBlast(next_seqs, sequences)
+                if self.graph is None:
+                    next_seqs = [e[0] for e in self[sp][0]]
+                    # blast next_seqs against sequences in alignment
+                    res = self._alignmentBlast(next_seqs, sequences)
+                else:
+                    res = self._alignmentGraph(self[sp][0])
                 # if success break
                 if res:
                     break
@@ -104,16 +142,18 @@ not align"""
         """Return indexes and overlapping sequences for each sequence
 in query that overlaps with more than prop sequences in
 sequences_in_alignment given set parameters using NCBI's BLAST"""
+        # blast all prospective next sequences against all sequences
+        #  in alignment at once
+        hits = blastHits(query, sequences_in_alignment, self.logger,
+                         self.wd, self.threads)
+        if hits is None:
+            return None
         # loop through each sequence in query, if success, return
         #  overlapping sequence and its index
         # make sure indexes are randomised to avoid biased sampling
         indexes = random.sample(range(len(query)), len(query))
         for i in indexes:
-            # blast prospective next sequence against all sequences
-            #  in alignment
-            bools, positions = blast(query[i], sequences_in_alignment,
-                                     self.minoverlap, self.logger, self.wd,
-                                     self.threads)
+            bools, positions = overlapping(hits[i], self.minoverlap)
             # if more than prop overlap ...
             overlap = (float(sum(bools))/len(sequences_in_alignment)) >\
                 self.blast_prop
@@ -122,6 +162,35 @@ sequences_in_alignment given set parameters using NCBI's BLAST"""
                 #  overlapping sequence
                 return i, query[i][min(positions):max(positions)]
 
+    def _alignmentGraph(self, query):
+        """As _alignmentBlast but for sequences + nfails + index in query \
+against sequences_in_alignment, using the overlaps in graph"""
+        subjects = [e[2] for e in self.sequences_in_alignment]
+        indexes = random.sample(range(len(query)), len(query))
+        for i in indexes:
+            bools, positions = self.graph.overlaps(query[i][2], subjects,
+                                                   self.minoverlap)
+            overlap = (float(sum(bools))/len(subjects)) > self.blast_prop
+            if overlap:
+                return i, query[i][0][min(positions):max(positions)]
+
+    def findOverlaps(self):
+        """BLAST all sequences against each other once, so sequences \
+for alignments are chosen without running BLAST each time, unless there \
+are more than graph_maxseqs sequences"""
+        if self.nseqs > graph_maxseqs:
+            self.logger.debug('.... [{0}] sequences, overlaps found as \
+sequences are added'.format(self.nseqs))
+            return
+        records = [None] * self.nseqs
+        for sp in self.keys():
+            for record, _, index in self[sp][0]:
+                records[index] = record
+        hits = blastAll(records, self.minoverlap, self.logger, self.wd,
+                        self.threads)
+        if hits is not None:
+            self.graph = OverlapGraph(self.nseqs, hits)
+
     def start(self, n):
         """Return n starting random sp sequences, update sppool"""
         # pool starts with all species
@@ -187,6 +256,95 @@ species"""
             raise TooFewSpeciesError
 
 
+class OverlapGraph(object):
+    """OverlapGraph class : best BLAST hit of each overlapping pair of n \
+sequences, held as arrays of query, subject, identities, query start and query end \
+sorted by query"""
+    def __init__(self, n, hits):
+        order = np.lexsort((hits[1], hits[0]))
+        self.query, self.subject, self.identities, self.query_start,\
+            self.query_end = [e[order] for e in hits]
+        # hits of query i are at offsets[i]:offsets[i + 1]
+        self.offsets = np.searchsorted(self.query, np.arange(n + 1))
+
+    def overlaps(self, query, subjects, minoverlap):
+        """Return bool and positions, as blast, of query overlapping \
+each of subjects"""
+        start, end = self.offsets[query], self.offsets[query + 1]
+        hits = dict(zip(self.subject[start:end], range(start, end)))
+        bools = []
+        positions = []
+        for subject in subjects:
+            i = hits.get(subject)
+            if i is not None and self.identities[i] > minoverlap:
+                bools.append(True)
+                positions.append(int(self.query_start[i]))
+                positions.append(int(self.query_end[i]))
+                continue
+            bools.append(False)
+        return bools, positions
+
+
+class AlignmentChecker(object):
+    """AlignmentChecker class : checkAlignment for alignments built by \
+adding a sequence at a time. Gap counts of the last alignment passed are \
+kept so that only the added sequence is checked, unless the alignment \
+has new columns."""
+    def __init__(self, maxgaps, minoverlap, logger):
+        self.maxgaps = maxgaps
+        self.minoverlap = minoverlap
+        self.logger = logger
+        # matrix, gaps in columns, and nucs, sum of gaps in the columns
+        #  of nucs and runs of gaps in rows of last alignment passed
+        self.matrix = None
+        self.colgaps = None
+        self.nnucs = None
+        self.shared = None
+        self.ngaps = None
+
+    def _added(self, matrix):
+        """Return True if matrix is the last matrix plus a row"""
+        return self.matrix is not None and\
+            matrix.shape == (self.matrix.shape[0] + 1, self.matrix.shape[1])\
+            and np.array_equal(matrix[:-1], self.matrix)
+
+    def check(self, alignment, minlen):
+        """Return bool as checkAlignment"""
+        if alignment is None:
+            return False
+        if alignment.get_alignment_length() < minlen:
+            self.logger.debug('........ alignment too small')
+            return False
+        matrix = alignmentMatrix(alignment)
+        if self._added(matrix):
+            # update for the gaps and nucs of the new row only
+            gaps = matrix[-1] == ord('-')
+            nucs = ~gaps
+            colgaps = self.colgaps + gaps
+            shared = self.shared + (self.matrix[:, gaps] !=
+                                    ord('-')).sum(axis=1)
+            shared = np.append(shared, colgaps[nucs].sum())
+            nnucs = np.append(self.nnucs, nucs.sum())
+            ngaps = np.append(self.ngaps, countGapRuns(gaps))
+        else:
+            # new columns (or a new alignment): check every row
+            gaps = matrix == ord('-')
+            nucs = ~gaps
+            colgaps = gaps.sum(axis=0)
+            shared = nucs.dot(colgaps)
+            nnucs = nucs.sum(axis=1)
+            ngaps = countGapRuns(gaps)
+        if not _judgeAlignment(nnucs, shared, ngaps, self.maxgaps,
+                               self.minoverlap, self.logger):
+            return False
+        self.matrix = matrix
+        self.colgaps = colgaps
+        self.nnucs = nnucs
+        self.shared = shared
+        self.ngaps = ngaps
+        return True
+
+
 class Aligner(object):
     """Build alignments from seqstore"""
     def __init__(self, seqstore, maxgaps, minoverlap, minseedsize,
@@ -210,6 +368,8 @@ class Aligner(object):
         self.total_trys = 0  # counter for total number of trys
         self.type = gene_type
         self.outgroup = outgroup
+        # checks sequences added to alignments
+        self.checker = AlignmentChecker(maxgaps, minoverlap, logger)
 
     def _calcTimeout(self, seconds, alignment, align=True):
         """Calculate the timeout"""
@@ -353,7 +513,7 @@ if successful"""
             self.logger.debug('MAFFT error raised')
             success = False
         else:
-            success = self._check(new_alignment)
+            success = self.checker.check(new_alignment, self.minlen)
         if success:
             self._calcTimeout(seconds, alignment, align=False)
             self.store.append(new_alignment)
@@ -489,88 +649,241 @@ program)"""
     return res
 
 
+def getBlastCache(wd):
+    """Return Cache of BLAST hits between pairs of sequences kept in wd"""
+    with blast_caches_lock:
+        if wd not in blast_caches:
+            blast_caches[wd] = Cache(os.path.join(wd, 'blast_cache.db'),
+                                     maxsize=blast_cache_maxsize)
+        return blast_caches[wd]
+
+
+def _seqKey(record):
+    """Return cache key of a sequence, by its contents"""
+    return hashlib.md5(str(record.seq)).hexdigest()
+
+
+def _seqId(key):
+    """Return cache key of a sequence as a 64 bit integer, as kept in \
+hits"""
+    return int(key[:16], 16)
+
+
+def blastHits(queries, subjects, logger, wd, threads):
+    """Return hits (identities, query start, query end), or None, of each \
+query against each subject, None if BLAST fails"""
+    hits = blastSparse(queries, subjects, logger, wd, threads)
+    if hits is None:
+        return None
+    return [[row.get(j) for j in range(len(subjects))] for row in hits]
+
+
+def blastSparse(queries, subjects, logger, wd, threads):
+    """Return hits ({subject index: (identities, query start, query \
+end)}) of each query against subjects, None if BLAST fails. Hits are kept \
+in wd, and only queries not yet BLASTed against all subjects are BLASTed, \
+all at once."""
+    # each sequence is hashed once, identical sequences share hits
+    qkeys = [_seqKey(e) for e in queries]
+    bysubject = {}
+    for j, subject in enumerate(subjects):
+        bysubject.setdefault(_seqKey(subject), []).append(j)
+    skeys = sorted(bysubject.keys())
+    sids = np.array([_seqId(e) for e in skeys], dtype=np.uint64)
+    # one array per query of every subject it was BLASTed against, those
+    #  without hits with 0 identities
+    cache = getBlastCache(wd)
+    rows = cache.getMany(['hits:' + e for e in qkeys])
+    rows = dict([(k[5:], np.frombuffer(v, dtype=hit_dtype)) for k, v in
+                 rows.items()])
+    missing = [e for e in sorted(set(qkeys)) if e not in rows or not
+               np.in1d(sids, rows[e]['subject']).all()]
+    if missing:
+        byquery = dict(zip(qkeys, queries))
+        found = blastBatch([byquery[e] for e in missing],
+                           [subjects[bysubject[e][0]] for e in skeys],
+                           logger, wd, threads)
+        if found is None:
+            return None
+        query, subject, identities, query_start, query_end = found
+        new = {}
+        for i, qkey in enumerate(missing):
+            row = np.zeros(len(skeys), dtype=hit_dtype)
+            row['subject'] = sids
+            hits = query == i
+            row['identities'][subject[hits]] = identities[hits]
+            row['query_start'][subject[hits]] = query_start[hits]
+            row['query_end'][subject[hits]] = query_end[hits]
+            # hits of subjects BLASTed before are kept
+            if qkey in rows:
+                row = np.concatenate([rows[qkey][~np.in1d(
+                    rows[qkey]['subject'], sids)], row])
+            rows[qkey] = row
+            new['hits:' + qkey] = row.tostring()
+        cache.setMany(new)
+    bysid = dict([(_seqId(k), v) for k, v in bysubject.items()])
+    res = []
+    for qkey in qkeys:
+        row = rows[qkey]
+        row = row[(row['identities'] > 0) & np.in1d(row['subject'], sids)]
+        res.append(dict([(j, (int(e['identities']), int(e['query_start']),
+                              int(e['query_end']))) for e in row for j in
+                         bysid[int(e['subject'])]]))
+    return res
+
+
+def overlapping(hits, minoverlap):
+    """Return bool and positions of hits that overlapped by more than \
+minoverlap"""
+    # list of T or F for success of alignment between query and
+    #  subjects
+    bools = []
+    # record start and end position to avoid composite sequence
+    #  problems
+    positions = []
+    for hit in hits:
+        # if identities > minoverlap, keep
+        if hit and hit[0] > minoverlap:
+            bools.append(True)
+            positions.append(hit[1])
+            positions.append(hit[2])
+            continue
+        bools.append(False)
+    return bools, positions
+
+
 def blast(query, subj, minoverlap, logger, wd, threads):
     """Return bool and positions of query sequences that overlapped
 with subject given parameters."""
-    query_file = os.path.join(wd, 'query.fasta')
-    subj_file = os.path.join(wd, 'subj.fasta')
-    SeqIO.write(query, query_file, "fasta")
-    SeqIO.write(subj, subj_file, "fasta")
+    queries = [query] if isinstance(query, SeqRecord) else list(query)
+    subjects = [subj] if isinstance(subj, SeqRecord) else list(subj)
+    hits = blastHits(queries, subjects, logger, wd, threads)
+    if hits is None:
+        return [], []
+    return overlapping([e for row in hits for e in row], minoverlap)
+
+
+def blastBatch(queries, subjects, logger, wd, threads):
+    """Return arrays of query, subject, identities, query start and query \
+end (by index) of the best hit of each pair from one BLAST of all queries \
+against a database of subjects, None if BLAST fails"""
+    # unique file names: many downloads may BLAST in wd at once
+    blast_dir = tempfile.mkdtemp(prefix='blast', dir=wd)
+    query_file = os.path.join(blast_dir, 'query.fasta')
+    subj_file = os.path.join(blast_dir, 'subj.fasta')
+    # ids are indexes
+    SeqIO.write([SeqRecord(e.seq, id='q{0}'.format(i), description='') for
+                 i, e in enumerate(queries)], query_file, "fasta")
+    SeqIO.write([SeqRecord(e.seq, id='s{0}'.format(i), description='') for
+                 i, e in enumerate(subjects)], subj_file, "fasta")
     try:
         # options: http://www.ncbi.nlm.nih.gov/books/NBK1763/
-        cline = NcbiblastnCommandline(query=query_file, subject=subj_file,
-                                      outfmt=5, cmd=blastn, word_size=8,
-                                      num_threads=threads)
+        if makeblastdb:
+            database = os.path.join(blast_dir, 'subj')
+            subprocess.check_output([makeblastdb, '-in', subj_file,
+                                     '-dbtype', 'nucl', '-out', database],
+                                    stderr=subprocess.STDOUT)
+            cline = NcbiblastnCommandline(query=query_file, db=database,
+                                          max_target_seqs=len(subjects),
+                                          outfmt=tabular_format, cmd=blastn,
+                                          word_size=8, num_threads=threads)
+        else:
+            cline = NcbiblastnCommandline(query=query_file, subject=subj_file,
+                                          outfmt=tabular_format, cmd=blastn,
+                                          word_size=8, num_threads=threads)
         logger.debug(cline)
         output = cline()[0]
-    except ApplicationError:  # as error_msg:
-        # logger.debug(error_msg)
-        # logger.warn("---- BLAST Error ----")
+    except (ApplicationError, subprocess.CalledProcessError):
         # TODO: work out why this is happening, doesn't seem to affect
         #  results though, low priority
-        return [], []
+        return None
     finally:
-        os.remove(query_file)
-        os.remove(subj_file)
-    # list of T or F for success of alignment between queries and
-    #  subject
-    bools = []
-    # record start and end position to avoid composite sequence
-    #  problems
-    positions = []
-    # BLAST records for each query sequence matched against subj
-    bresults = NCBIXML.parse(StringIO(output))
-    for record in bresults:
-        if record.alignments:
-            res = record.alignments[0].hsps[0]
-            # if identities > minoverlap, keep
-            if res.identities > minoverlap:
-                bools.append(True)
-                positions.append(res.query_start)
-                positions.append(res.query_end)
-                continue
-        bools.append(False)
-    return bools, positions
+        shutil.rmtree(blast_dir)
+    return parseTabular(output)
+
+
+def blastAll(sequences, minoverlap, logger, wd, threads):
+    """Return arrays of query, subject, identities, query start and query \
+end of the best hit of each pair of sequences (by index) overlapping by \
+more than minoverlap, None if BLAST fails. Hits are kept in wd, as one \
+array for all sequences."""
+    # keyed by the sequences, in order, and minoverlap
+    key = 'graph:' + hashlib.md5(' '.join([str(minoverlap)] + [
+        _seqKey(e) for e in sequences])).hexdigest()
+    cache = getBlastCache(wd)
+    value = cache.get(key)
+    if value is not None:
+        return tuple(np.frombuffer(value, dtype=np.int32).reshape(5, -1))
+    hits = blastBatch(sequences, sequences, logger, wd, threads)
+    if hits is None:
+        return None
+    # only hits the alignments use are kept
+    keep = (hits[0] != hits[1]) & (hits[2] > minoverlap)
+    hits = np.array([e[keep] for e in hits], dtype=np.int32)
+    cache.set(key, hits.tostring())
+    return tuple(hits)
+
+
+def parseTabular(output):
+    """Return arrays of query, subject, identities, query start and query \
+end of the first (best) hit of each pair in BLAST tabular output of \
+sequences with indexes for ids"""
+    # ids may be given a prefix, e.g. lcl|, by BLAST: only the digits of
+    #  each field are read, straight into one array
+    hits = np.fromstring(output.translate(None, nondigits), dtype=np.int32,
+                         sep=' ').reshape(-1, 5)
+    nsubjects = int(hits[:, 1].max()) + 1 if len(hits) else 0
+    _, first = np.unique(hits[:, 0].astype(np.int64) * nsubjects + hits[:, 1],
+                         return_index=True)
+    hits = hits[np.sort(first)]
+    return tuple([hits[:, i] for i in range(5)])
+
+
+def alignmentMatrix(alignment):
+    """Return alignment as a matrix (sequences by columns) of characters \
+as uint8"""
+    matrix = np.frombuffer(''.join([str(e.seq) for e in alignment]),
+                           dtype=np.uint8)
+    return matrix.reshape(len(alignment), alignment.get_alignment_length())
 
 
 def checkAlignment(alignment, maxgaps, minoverlap, minlen, logger):
     """Determine if an alignment is good or not based on given \
 parameters. Return bool"""
-    # TODO: too complex, consider breaking up
-    # internals
-    def calcOverlap(columns):
-        if not columns:
-            return 0
-        # what proportion of columns have nucs in other seqs
-        pcolgaps = []
-        for i in columns:
-            ith = float(alignment[:, i].count("-"))/(len(alignment)-1)
-            pcolgaps.append(ith)
-        # overlap is the mean proportion of columns shared
-        overlap = len(columns) - (len(columns) * np.mean(pcolgaps))
-        return overlap
-
-    def calcNgap(sequence):
-        # count the number of gaps
-        gaps = re.subn('-+', '', sequence)[1]
-        return float(gaps)
-
-    # process
     if alignment is None:
         return False
     alen = alignment.get_alignment_length()
     if alen < minlen:
         logger.debug('........ alignment too small')
         return False
-    for each in alignment:
-        sequence = str(each.seq)
-        columns = [ei for ei, e in enumerate(sequence) if e != "-"]
-        overlap = calcOverlap(columns)
-        if overlap < minoverlap:
-            logger.debug('........ alignment too little overlap')
-            return False
-        ngap = calcNgap(sequence)
-        if ngap > maxgaps:
-            logger.debug('........ alignment too many gaps')
-            return False
-    return True
+    gaps = alignmentMatrix(alignment) == ord('-')
+    nucs = ~gaps
+    colgaps = gaps.sum(axis=0)
+    return _judgeAlignment(nucs.sum(axis=1), nucs.dot(colgaps),
+                           countGapRuns(gaps), maxgaps, minoverlap, logger)
+
+
+def countGapRuns(gaps):
+    """Return number of runs of gaps in each row of gaps (bools)"""
+    gaps = np.atleast_2d(gaps)
+    starts = gaps.copy()
+    starts[:, 1:] &= ~gaps[:, :-1]
+    return starts.sum(axis=1)
+
+
+def _judgeAlignment(nnucs, shared, ngaps, maxgaps, minoverlap, logger):
+    """Return True if all sequences of an alignment overlap and have few \
+enough runs of gaps, given arrays of number of nucs, sum of gaps in the \
+columns of their nucs and number of runs of gaps of each sequence"""
+    # overlap is the number of columns with nucs less the mean
+    #  proportion of other sequences with gaps in those columns
+    overlap = nnucs - shared / float(max(len(nnucs) - 1, 1))
+    # report the first sequence to fail, overlap before gaps
+    fails = np.flatnonzero((overlap < minoverlap) | (ngaps > maxgaps))
+    if len(fails) == 0:
+        return True
+    if overlap[fails[0]] < minoverlap:
+        logger.debug('........ alignment too little overlap')
+    else:
+        logger.debug('........ alignment too many gaps')
+    return False
@@ -0,0 +1,231 @@
+#! /bin/usr/env python
+# D.J. Bennett
+# 18/10/2026
+"""
+pglt sequence clustering tools
+"""
+
+# PACKAGES
+import numpy as np
+
+# GLOBALS
+# all k-mers are kept: words as long as blastn's (word_size 8) match often
+#  enough to find sequences up to ~35% divergent
+kmer_size = 8
+# k-mer matches within maxshift diagonals of each other are one alignment,
+#  allowing for indels
+maxshift = 20
+# alignments with fewer k-mer matches are not extended
+minmatches = 3
+# alignments are scored as blastn's: reward for identities, penalty for
+#  mismatches
+reward = 2
+penalty = -3
+chunksize = 2 ** 20  # most bases of alignments extended at once
+# 2 bit codes of bases, 4 for anything ambiguous
+codes = np.empty(256, dtype=np.uint8)
+codes.fill(4)
+for i, base in enumerate('ACGT'):
+    codes[ord(base)] = codes[ord(base.lower())] = i
+del i, base
+
+
+# CLASSES
+class Sketches(object):
+    """Sketches class : k-mers of many sequences, their positions and \
+strands, held in one sorted array, for finding all sequences that overlap \
+a sequence at once"""
+    def __init__(self, sequences):
+        self.n = len(sequences)
+        # sketch all at once: ambiguous bases between sequences stop
+        #  k-mers spanning two sequences
+        sequences = [str(e) for e in sequences]
+        self.lengths = np.array([len(e) for e in sequences], dtype=np.int64)
+        self.maxlen = int(self.lengths.max()) if self.n else 0
+        self.offsets = np.cumsum([0] + [len(e) + 1 for e in sequences])
+        sequence = 'N'.join(sequences)
+        self.bases = codes[np.frombuffer(sequence, dtype=np.uint8)]
+        kmers, positions, reverse = readKmers(sequence)
+        seqidx = np.searchsorted(self.offsets, positions, side='right') - 1
+        # sort by k-mer then sequence, counting each k-mer once per
+        #  sequence at its first position
+        keys, first = np.unique((kmers.astype(np.uint64) << np.uint64(32)) |
+                                seqidx.astype(np.uint64), return_index=True)
+        self.kmers = (keys >> np.uint64(32)).astype(np.uint32)
+        self.seqidx = (keys & np.uint64(0xFFFFFFFF)).astype(np.int64)
+        self.positions = positions[first] - self.offsets[self.seqidx]
+        self.reverse = reverse[first]
+
+    def shared(self, i):
+        """Return number of k-mers each sequence shares with sequence i"""
+        mask = np.in1d(self.kmers, self.kmers[self.seqidx == i])
+        return np.bincount(self.seqidx[mask], minlength=self.n)
+
+    def identities(self, i):
+        """Return identities of the best local alignment of each \
+sequence with sequence i, as blastn reports them, by extending k-mer \
+matches"""
+        res = np.zeros(self.n, dtype=np.int64)
+        # k-mers shared with sequence i, at positions in both
+        query = np.flatnonzero(self.seqidx == i)
+        lower = np.searchsorted(self.kmers, self.kmers[query], side='left')
+        sizes = np.searchsorted(self.kmers, self.kmers[query],
+                                side='right') - lower
+        matches = np.repeat(lower - np.cumsum(sizes) + sizes, sizes) +\
+            np.arange(sizes.sum())
+        query = np.repeat(query, sizes)
+        seqidx = self.seqidx[matches]
+        qpos = self.positions[query]
+        spos = self.positions[matches]
+        opposite = self.reverse[query] != self.reverse[matches]
+        if not len(seqidx):
+            return res
+        # matches of an alignment lie near one diagonal, qpos - spos on
+        #  the same strand and qpos + spos on opposite strands
+        diagonals = np.where(opposite, qpos + spos,
+                             qpos - spos + self.maxlen)
+        stride = 3 * self.maxlen + maxshift
+        keys = (seqidx * 2 + opposite) * stride + diagonals
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        # the window of maxshift diagonals with most matches of each
+        #  sequence, on either strand
+        ends = np.searchsorted(keys, keys + maxshift, side='right')
+        counts = ends - np.arange(len(keys))
+        best = _argmaxes(counts, np.flatnonzero(np.r_[True, np.diff(
+            keys // (2 * stride)) != 0]))
+        best = best[counts[best] >= minmatches]
+        if not len(best):
+            return res
+        sizes = counts[best]
+        window = order[np.repeat(best - np.cumsum(sizes) + sizes, sizes) +
+                       np.arange(sizes.sum())]
+        # its matches in order along sequence i
+        order = np.lexsort((qpos[window], seqidx[window]))
+        seqidx, qpos, spos, opposite = [e[window][order] for e in
+                                        (seqidx, qpos, spos, opposite)]
+        starts = np.flatnonzero(np.r_[True, np.diff(seqidx) != 0])
+        # extend alignments over all of sequence i, a chunk at a time
+        nrows = max(chunksize // max(self.lengths[i], 1), 1)
+        stops = np.r_[starts, len(seqidx)]
+        for lo in range(0, len(starts), nrows):
+            rows = starts[lo:lo + nrows]
+            chunk = slice(rows[0], stops[lo + len(rows)])
+            res[seqidx[rows]] = self._extend(
+                i, seqidx[chunk], qpos[chunk], spos[chunk], opposite[chunk],
+                rows - rows[0])
+        return res
+
+    def _extend(self, i, seqidx, qpos, spos, opposite, starts):
+        """Return identities of the best local alignment with sequence i \
+along matches (sorted by sequence and qpos) of each sequence starting at \
+starts"""
+        length = self.lengths[i]
+        x = np.tile(np.arange(length), len(starts))
+        # each base of sequence i is aligned by the match before it, or
+        #  the match after it
+        stride = self.maxlen + 1
+        sizes = np.diff(np.r_[starts, len(seqidx)])
+        matches = np.searchsorted(
+            np.repeat(np.arange(len(starts)), sizes) * stride + qpos,
+            np.repeat(np.arange(len(starts)), length) * stride + x,
+            side='right') - 1
+        matches = np.maximum(matches, np.repeat(starts, length))
+        nexts = np.minimum(matches + 1, np.repeat(starts + sizes - 1,
+                                                  length))
+        before, after = [self._identical(i, x, seqidx[e], qpos[e], spos[e],
+                                         opposite[e]) for e in
+                         (matches, nexts)]
+        # an indel between two matches is placed where most bases are
+        #  identical
+        gains = np.where(before, reward, penalty) -\
+            np.where(after, reward, penalty)
+        segments = np.flatnonzero(np.r_[True, np.diff(matches) != 0])
+        splits = _argmaxes(np.cumsum(gains) - gains, segments)
+        identical = np.where(np.arange(len(x)) >= np.repeat(
+            splits, np.diff(np.r_[segments, len(x)])), after, before)
+        identical = identical.reshape(len(starts), length)
+        # best local alignment: highest scoring run of bases, the score
+        #  up to each base less the lowest score before it
+        scores = np.where(identical, reward, penalty)
+        score = np.cumsum(scores, axis=1)
+        lowest = np.minimum.accumulate((score - scores) * length +
+                                       np.arange(length), axis=1) % length
+        rows = np.arange(len(starts))
+        ends = np.argmax(score - (score - scores)[rows[:, None], lowest],
+                         axis=1)
+        lowest = lowest[rows, ends]
+        counts = np.cumsum(identical, axis=1)
+        return counts[rows, ends] - counts[rows, lowest] +\
+            identical[rows, lowest]
+
+    def _identical(self, i, x, seqidx, qpos, spos, opposite):
+        """Return bools of bases of sequence i at x identical to the bases \
+of sequences aligned to them by matches"""
+        positions = np.where(opposite, qpos + spos + kmer_size - 1 - x,
+                             x - qpos + spos)
+        valid = (positions >= 0) & (positions < self.lengths[seqidx])
+        bases = self.bases[self.offsets[seqidx] + positions * valid]
+        # bases read on the opposite strand are complemented
+        bases = np.where(opposite & (bases < 4), 3 - bases, bases)
+        qbases = self.bases[self.offsets[i] + x]
+        return valid & (bases == qbases) & (qbases < 4)
+
+    def overlaps(self, i, minoverlap):
+        """Return bools of sequences overlapping sequence i by at least \
+minoverlap identical bases"""
+        return self.identities(i) >= minoverlap
+
+    def central(self, include, candidates):
+        """Return index of candidate sharing most k-mers with included \
+sequences (bool arrays)"""
+        mask = include[self.seqidx]
+        kmers = self.kmers[mask]
+        seqidx = self.seqidx[mask]
+        # number of included sequences with each k-mer
+        starts = np.flatnonzero(np.r_[True, kmers[1:] != kmers[:-1]])
+        sizes = np.diff(np.r_[starts, len(kmers)])
+        weights = np.repeat(sizes - 1, sizes)
+        scores = np.bincount(seqidx, weights=weights, minlength=self.n)
+        scores[~candidates] = -1
+        return int(np.argmax(scores))
+
+
+# FUNCTIONS
+def readKmers(sequence):
+    """Return canonical k-mers of sequence, as integers, their positions \
+and whether they were read from the reverse strand"""
+    bases = codes[np.frombuffer(str(sequence), dtype=np.uint8)]
+    nkmers = len(bases) - kmer_size + 1
+    if nkmers < 1:
+        return (np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=bool))
+    # k-mers and their reverse complements as 2 bit integers, built
+    #  from 2-, 4- and 8-mers
+    forward = (bases & 3).astype(np.uint32)
+    reverse = 3 - forward
+    size = 1
+    while size < kmer_size:
+        forward = (forward[:-size] << np.uint32(2 * size)) | forward[size:]
+        reverse = (reverse[size:] << np.uint32(2 * size)) | reverse[:-size]
+        size *= 2
+    kmers = np.minimum(forward, reverse)
+    # drop k-mers with ambiguous bases
+    ambiguous = np.r_[0, np.cumsum(bases == 4)]
+    keep = ambiguous[kmer_size:] == ambiguous[:nkmers]
+    return kmers[keep], np.flatnonzero(keep), (forward > reverse)[keep]
+
+
+def _argmaxes(values, starts):
+    """Return index of the first maximum of values in each run starting \
+at starts"""
+    lengths = np.diff(np.r_[starts, len(values)])
+    hits = np.flatnonzero(values == np.repeat(
+        np.maximum.reduceat(values, starts), lengths))
+    runs = np.searchsorted(starts, hits, side='right')
+    return hits[np.r_[True, np.diff(runs) != 0]]
+
+
+def sketch(sequence):
+    """Return sorted canonical k-mers of sequence"""
+    return np.unique(readKmers(sequence)[0])
@@ -7,24 +7,40 @@ pglt download tools
 
 # PACKAGES
 import os
-import re
 import random
+import pickle
+import hashlib
+import numpy as np
+from multiprocessing.pool import ThreadPool
 import entrez_tools as etools
 import alignment_tools as atools
-from special_tools import getThreads
+import cluster_tools as ctools
+from genbank_tools import countAmbiguous
 from Bio.SeqFeature import SeqFeature
 
+# GLOBALS
+nwindows = 4  # number of random windows of results sampled by a search
+nsubjects = 3  # number of random sequences filtered against
+
 
 # CLASSES
 class Downloader(object):
-    """Download sequences given taxids and gene_names"""
+    """Download sequences given taxids and gene_names (with client, an \
+etools.Client, if given). Search results are kept in searchstore, a dict \
+by search term that can be shared by all downloaders of a study. No more \
+than maxids (default 10 times nseqs) seqids are sampled per search."""
     def __init__(self, gene_names, nseqs, thoroughness, maxpn, votesize,
-                 maxtrys, minoverlap, maxlen, minlen, logger, wd=os.getcwd()):
+                 maxtrys, minoverlap, maxlen, minlen, logger, wd=os.getcwd(),
+                 client=None, searchstore=None, maxids=None):
         self.wd = wd
         self.logger = logger
-        self.threads = getThreads(wd=wd)
+        self.client = client
+        if searchstore is None:
+            searchstore = {}
+        self.searchstore = searchstore
         self.gene_names = gene_names
         self.nseqs = nseqs
+        self.maxids = maxids or nseqs * 10
         self.max_thoroughness = thoroughness
         self.maxpn = maxpn
         self.votesize = votesize
@@ -34,7 +50,12 @@ class Downloader(object):
         self.minlen = minlen
         self.thoroughness = 1
         self.deja_vues = []
-        self.pattern = re.compile("[ACTGactg]")
+        self.histories = []  # (webenv, query_key, seqids) of searches
+        # own random stream, seeded from the client's (or the random
+        #  module) when created, so downloaders running in parallel sample
+        #  the same sequences in every run
+        self.random = random.Random((client.random if client else
+                                     random).random())
 
     def _buildSearchTerm(self, taxids, thoroughness):
         """Generate NCBI GenBank query given taxids, gene_names and
@@ -92,27 +113,71 @@ fewer matches than target nseqs"""
                 #  found or until the max thoroughness has been hit
                 break
             search_term = self._buildSearchTerm(taxids, self.thoroughness)
-            seqcount = etools.eSearch(search_term, logger=self.logger)['Count']
-            if int(seqcount) >= 1:
-                # return ALL matching seqids if more than 0
-                seqids.extend(etools.eSearch(search_term, logger=self.logger,
-                                             retMax=seqcount)['IdList'])
+            # a search returns count and up to maxids seqids, unless
+            #  already made with as many seqids
+            res = self.searchstore.get(search_term)
+            if res is None or len(res.get('IdList', [])) <\
+                    min(int(res['Count']), self.maxids):
+                res = self._sampleSearch(search_term)
+                if res:
+                    self.searchstore[search_term] = res
+            if res and int(res['Count']) >= 1:
+                deja_vues = set(self.deja_vues)
+                found = [e for e in res['IdList'] if e not in deja_vues]
+                # record searches whose results are all new and complete
+                #  so they can be fetched from the history server
+                if 'WebEnv' in res.keys() and len(found) == int(res['Count']):
+                    self.histories.append((res['WebEnv'], res['QueryKey'],
+                                           found))
                 # filter those that have already been seen
-                seqids = [e for e in seqids if e not in self.deja_vues]
+                seqids.extend(found)
             self.thoroughness += 1
         self.deja_vues.extend(seqids)
         self.deja_vues = list(set(self.deja_vues))
         return list(set(seqids))
 
+    def _sampleSearch(self, search_term):
+        """Return search results with no more than maxids seqids, drawn \
+from random windows of the results if there are more matches"""
+        # posted to the history server: if all matches are returned they
+        #  can be fetched without sending seqids
+        res = etools.eSearch(search_term, logger=self.logger,
+                             retMax=self.maxids, usehistory='y',
+                             client=self.client)
+        if not res or int(res['Count']) <= self.maxids:
+            return res
+        # network and memory costs are bounded by maxids, not by the
+        #  number of matches: whole windows are drawn from the matches
+        #  after the first maxids ...
+        count = int(res['Count'])
+        size = (self.maxids + nwindows - 1) // nwindows
+        starts = range(self.maxids, count - size + 1, size)
+        starts = self.random.sample(starts, min(nwindows - 1, len(starts)))
+        seqids = []
+        for start in sorted(starts):
+            window = etools.eSearch(search_term, logger=self.logger,
+                                    retStart=start, retMax=size,
+                                    client=self.client)
+            if window:
+                seqids.extend(window['IdList'])
+        # ... and the rest, up to maxids, from the first search's
+        first = res['IdList']
+        nfirst = max(len(first) - len(starts) * size, 0)
+        start = self.random.randint(0, len(first) - nfirst)
+        seqids = first[start:start + nfirst] + seqids
+        return {'Count': res['Count'], 'IdList': seqids}
+
     def _filter(self, sequences):
-        """Filter sequences by BLASTing"""
-        # choose random species for query
-        randn = random.randint(0, len(sequences)-1)
-        query = sequences
-        subj = [sequences[randn]]
-        # blast rand seq against all other seqs
-        blast_bool, _ = atools.blast(query, subj, self.minoverlap, self.logger,
-                                     wd=self.wd, threads=self.threads)
+        """Filter sequences by their overlap with random sequences, \
+aligned from shared k-mers"""
+        # choose random sequences for subjects
+        subjects = self.random.sample(range(len(sequences)),
+                                      min(nsubjects, len(sequences)))
+        # overlaps of all sequences with each subject, keeping the
+        #  subject most sequences overlap
+        sketches = ctools.Sketches([e.seq for e in sequences])
+        blast_bool = max([sketches.overlaps(e, self.minoverlap) for e in
+                          subjects], key=lambda e: e.sum())
         # filtered are all sequences that are true
         filtered = [sequences[i] for i, e in enumerate(blast_bool) if e]
         # sequence pool are all sequences that are false
@@ -170,31 +235,134 @@ by searching features."""
         record = self._findGeneInSeq(record)
         if self.maxlen > len(record) > self.minlen:
             # find proportion of ambiguous bases
-            nn = len(self.pattern.findall(str(record.seq)))
-            pn = float(len(record)) - float(nn)
-            pn = pn/float(len(record))
+            pn = float(countAmbiguous(record.seq))/float(len(record))
             if pn < self.maxpn:
                 return record
         return None
 
-    def _download(self, seqids):
-        """Download records from GenBank given sequence ids"""
+    def _fetchHistories(self, seqids):
+        """Download records of whole searches from the history server,
+return records and seqids left to download"""
         records = []
-        i = 1
-        while i <= self.nseqs and len(seqids) > 0:
+        left = set(seqids)
+        for webenv, query_key, ids in self.histories:
+            if not left.issuperset(ids):
+                continue
+            # page through search in chunks of 100
+            fetched = []
+            for retstart in range(0, len(ids), 100):
+                res = etools.eFetch(None, logger=self.logger, webenv=webenv,
+                                    query_key=query_key, retStart=retstart,
+                                    retMax=100, client=self.client)
+                if not res:
+                    # e.g. session has expired, fetch by ids instead
+                    break
+                fetched.extend(res)
+            else:
+                records.extend(fetched)
+                left.difference_update(ids)
+        return records, [e for e in seqids if e in left]
+
+    def _prefilter(self, seqids):
+        """Use document summaries to drop seqids of sequences shorter \
+than minlen. Return seqids and seqids of sequences longer than maxlen \
+(e.g. whole genomes)."""
+        lengths = {}
+        for summary in etools.eSummary(seqids, logger=self.logger,
+                                       client=self.client):
+            lengths[str(summary['Id'])] = int(summary['Length'])
+            if 'AccessionVersion' in summary.keys():
+                lengths[str(summary['AccessionVersion'])] =\
+                    int(summary['Length'])
+        # seqids without summaries are kept
+        small = [e for e in seqids if lengths.get(e, self.minlen + 1) >
+                 self.minlen]
+        large = [e for e in small if lengths.get(e, 0) >= self.maxlen]
+        large_set = set(large)
+        return [e for e in small if e not in large_set], large
+
+    def _findGeneInTable(self, features):
+        """Return intervals of gene in a feature table, None if not \
+found"""
+        gene_names = set([e.lower() for e in self.gene_names])
+        for _, intervals, qualifiers in features:
+            feature_names = []
+            for key in ['gene', 'gene_synonym', 'product']:
+                feature_names.extend(qualifiers.get(key, []))
+            if gene_names & set([e.lower() for e in feature_names]):
+                return intervals
+        return None
+
+    def _fetchLarge(self, seqids, records):
+        """Download regions of the gene in records too long to be the \
+gene, until there are nseqs records"""
+        # feature tables are downloaded first, then only the gene in FASTA
+        while len(records) < self.nseqs and len(seqids) > 0:
+            seqs = seqids[-100:]
+            del seqids[-100:]
+            tables = etools.eFetchFeatures(seqs, logger=self.logger,
+                                           client=self.client)
+            for table in tables:
+                intervals = self._findGeneInTable(table['features'])
+                if not intervals:
+                    continue
+                # a gene in many parts is joined, as SeqFeature.extract
+                parts = [etools.eFetchRegion(table['accession'], start, stop,
+                                             logger=self.logger,
+                                             client=self.client) for start,
+                         stop in intervals]
+                if None in parts:
+                    continue
+                record = parts[0]
+                for part in parts[1:]:
+                    record += part
+                record = self._parse(record)
+                if record:
+                    records.append(record)
+                    if len(records) >= self.nseqs:
+                        break
+
+    def _fetch(self, seqids, records):
+        """Download records given seqids until there are nseqs \
+records"""
+        while len(records) < self.nseqs and len(seqids) > 0:
             if len(seqids) > 100:
                 n = 100  # Download in chunks of 100
             else:
                 n = len(seqids)
-            seqs = []
-            for _ in range(n):
-                randi = random.randint(0, len(seqids)-1)
-                seqs.append(seqids.pop(randi))
-            for record in etools.eFetch(seqs, logger=self.logger):
+            seqs = seqids[-n:]
+            del seqids[-n:]
+            # parse records as they stream in, stop once nseqs are found
+            stream = etools.eFetchIter(seqs, logger=self.logger,
+                                       client=self.client)
+            for record in stream:
                 record = self._parse(record)
                 if record:
                     records.append(record)
-                    i += 1
+                    if len(records) >= self.nseqs:
+                        stream.close()
+                        break
+
+    def _download(self, seqids):
+        """Download records from GenBank given sequence ids"""
+        records = []
+        # summaries are downloaded first: records too short are not
+        #  downloaded, records too long only if there are too few others
+        seqids, large = self._prefilter(seqids)
+        # seqids are drawn at random by popping a shuffled list
+        self.random.shuffle(seqids)
+        if len(seqids) <= self.nseqs and not large:
+            # all seqids will be downloaded: avoid sending lists of
+            #  ids by using the history server where possible
+            fetched, seqids = self._fetchHistories(seqids)
+            for record in fetched:
+                record = self._parse(record)
+                if record:
+                    records.append(record)
+        self._fetch(seqids, records)
+        if len(records) < self.nseqs and large:
+            self.random.shuffle(large)
+            self._fetchLarge(large, records)
         return records
 
     def run(self, taxids):
@@ -203,8 +371,9 @@ by searching features."""
         sequences = []
         while self.thoroughness < self.max_thoroughness:
             seqids = self._search(taxids)
-            # filter if there are 10 times target nseqs
-            if len(seqids) >= self.nseqs*10:
+            # filter if there are 10 times target nseqs (or as many
+            #  as can be sampled)
+            if len(seqids) >= min(self.nseqs*10, self.maxids):
                 self.logger.info("........ filtering")
                 downloaded = []
                 lower = 0
@@ -227,10 +396,45 @@ by searching features."""
 
 
 # FUNCTIONS
+def checkpointPath(directory, *keys):
+    """Return path of checkpoint file in directory for keys (e.g. gene \
+and name)"""
+    key = hashlib.md5(repr(keys)).hexdigest()
+    return os.path.join(directory, '{0}.p'.format(key))
+
+
+def checkpointKey(*objs):
+    """Return hash of objs (e.g. parameters), alike for equal dicts \
+whatever their order, to tell checkpoints of other runs"""
+    def canonical(obj):
+        if isinstance(obj, dict):
+            return sorted([(k, canonical(v)) for k, v in obj.items()])
+        if isinstance(obj, (list, tuple)):
+            return [canonical(e) for e in obj]
+        return obj
+    return hashlib.md5(repr(canonical(objs))).hexdigest()
+
+
+def writeCheckpoint(obj, path):
+    """Pickle obj to path, never leaving a partly written file"""
+    with open(path + '.temp', 'wb') as file:
+        pickle.dump(obj, file, -1)
+    os.rename(path + '.temp', path)
+
+
+def readCheckpoint(path):
+    """Return object pickled at path"""
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+
 def findBestGenes(namesdict, genedict, thoroughness, allrankids, logger,
-                  minnseq=1, target='all', minnspp=5):
+                  minnseq=1, target='all', minnspp=5, client=None,
+                  searchstore=None, maxids=None):
     """Return suitable genes for phylogeny by searching for \
-matches in GenBank"""
+matches in GenBank. Searches are made concurrently, as many at once as \
+client (an etools.Client) has connections, and kept in searchstore for \
+the downloaders of the chosen genes (sampling up to maxids seqids)."""
     # TODO: too complex, consider breaking up
     def nextBest(searchlist, types):
         # return best genes based on n and types
@@ -258,42 +462,64 @@ matches in GenBank"""
         # return gene, shrunk searchlist and types
         gene = searchlist.pop(gene_i)
         return gene[0], searchlist, types
+
+    def countSeqs(args):
+        # return number of sequences found by downloader for tipids
+        gene, first, downloader, tipids = args
+        if first:
+            logger.info('.... checking [{0}]'.format(gene))
+        return len(downloader._search(tipids))
     alltipids = [namesdict[e]["txids"] for e in namesdict.keys()]
     outgroupids = namesdict['outgroup']['txids']
     searchlist = []
     # list of bools for number of genes w/o outgroup seqs
     outgroup_bool = []
-    for gene in genedict.keys():
-        logger.info('.... checking [{0}]'.format(gene))
-        # first check if its suitable for this taxonomic group
-        taxid = genedict[gene]["taxid"]
+    # only search genes suitable for this taxonomic group
+    genes = [e for e in genedict.keys() if int(genedict[e]["taxid"]) in
+             allrankids]
+    # search genbank for every gene and name at once, downloaders are
+    #  created in order so they sample the same seqids in every run
+    searches = []
+    for gene in genes:
+        for i, tipids in enumerate(alltipids):
+            searches.append((gene, i == 0, Downloader(
+                gene_names=genedict[gene]["names"], nseqs=minnseq + 1,
+                thoroughness=thoroughness, maxpn=0, votesize=0, maxtrys=0,
+                minoverlap=0, maxlen=0, minlen=0, logger=logger,
+                client=client, searchstore=searchstore, maxids=maxids),
+                tipids))
+    pool = ThreadPool(client.maxconnections if client else 1)
+    try:
+        counts = pool.map(countSeqs, searches)
+        pool.close()
+    except:
+        # queued searches are dropped
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    counts = iter(counts)
+    for gene in genes:
         gene_type = genedict[gene]["type"]
-        if int(taxid) in allrankids:
-            # if it is search genbank
-            gene_bool = []
-            for tipids in alltipids:
-                downloader = Downloader(gene_names=genedict[gene]["names"],
-                                        nseqs=minnseq + 1,
-                                        thoroughness=thoroughness, maxpn=0,
-                                        votesize=0, maxtrys=0, minoverlap=0,
-                                        maxlen=0, minlen=0, logger=logger)
-                res = downloader._search(tipids)
-                # if gene is deep or both, then make sure it has
-                #  outgroup
-                if gene_type != 'shallow':
-                    # if outgroupids do not have sequences, move to
-                    #  next genes
-                    if tipids == outgroupids:
-                        if len(res) < minnseq:
-                            outgroup_bool.append(False)
-                            continue
-                        else:
-                            outgroup_bool.append(True)
-                gene_bool.append(len(res) >= minnseq)
-            nspp = sum(gene_bool)
-            if nspp > minnspp:
-                # if more than minnspp species, add it to searchlist
-                searchlist.append((gene, nspp))
+        gene_bool = []
+        for tipids in alltipids:
+            nseqs = counts.next()
+            # if gene is deep or both, then make sure it has
+            #  outgroup
+            if gene_type != 'shallow':
+                # if outgroupids do not have sequences, move to
+                #  next genes
+                if tipids == outgroupids:
+                    if nseqs < minnseq:
+                        outgroup_bool.append(False)
+                        continue
+                    else:
+                        outgroup_bool.append(True)
+            gene_bool.append(nseqs >= minnseq)
+        nspp = sum(gene_bool)
+        if nspp > minnspp:
+            # if more than minnspp species, add it to searchlist
+            searchlist.append((gene, nspp))
     # if all outgroup_bool are false, raise error
     if not any(outgroup_bool):
         # TODO: allow the program to run without an outgroup?
@@ -314,35 +540,39 @@ matches in GenBank"""
 
 
 def getClusters(gene_sequences, minoverlap, logger, wd):
-    """Identify clusters in sequences"""
-    def findClusters(gene_sequences):
-        # blast all against 1
-        sequences = [e[1] for e in gene_sequences]
-        randi = random.randint(0, len(sequences)-1)
-        bools, _ = atools.blast(sequences, sequences[randi], minoverlap,
-                                logger, wd, threads)
+    """Identify clusters in sequences: each of sequences overlapping a \
+seed sequence by at least minoverlap identical bases"""
+    def findClusters(remaining):
+        # all remaining against the most central untried sequence
+        seed = sketches.central(remaining, untried)
+        untried[seed] = False
+        bools = sketches.overlaps(seed, minoverlap) & remaining
         # how many species had sequences in the cluster?
-        cluster_sequences = [gene_sequences[i] for i, e in enumerate(bools)
-                             if e]
+        cluster_sequences = [gene_sequences[i] for i in np.flatnonzero(bools)]
         nspp = len(set([e[0] for e in cluster_sequences]))
         pspp = float(nspp)/tot_nspp
         # if more than 50% and 5 species ...
         if pspp > 0.5 and nspp > 5:
-            # return cluster, remove those sequences from gene_sequences
-            gene_sequences = [gene_sequences[i] for i, e in enumerate(bools)
-                              if not e]
-            return cluster_sequences, gene_sequences
-        return None, gene_sequences
-    threads = getThreads(wd=wd)
+            # return cluster, remove those sequences from remaining
+            untried[bools] = False
+            return cluster_sequences, remaining & ~bools
+        return None, remaining
+    # k-mers of all sequences: finding a cluster is one pass over them
+    sketches = ctools.Sketches([e[1].seq for e in gene_sequences])
+    remaining = np.ones(len(gene_sequences), dtype=bool)
+    untried = remaining.copy()
     res = []
     tot_nspp = len(set([e[0] for e in gene_sequences]))
-    # try max 5 times to get a cluster from randomly selecting a seq
+    # try max 5 times to get a cluster from a seed sequence
     for i in range(5):
-        cluster_sequences, gene_sequences = findClusters(gene_sequences)
+        if not untried.any():
+            break
+        cluster_sequences, remaining = findClusters(remaining)
         if cluster_sequences:
             res.append(cluster_sequences)
         # if gene sequences has not enough seqs left, break
-        pspp = float(len(set([e[0] for e in gene_sequences])))/tot_nspp
+        pspp = float(len(set([gene_sequences[j][0] for j in
+                              np.flatnonzero(remaining)])))/tot_nspp
         if pspp < 0.5:
             break
     return res
@@ -6,50 +6,651 @@ pglt Entrez tools
 """
 
 # PACKAGES
+import os
+import re
+import sys
 import time
 import random
+import socket
+import urllib
+import hashlib
+import httplib
+import urlparse
+import threading
+from Queue import LifoQueue
+from Queue import Empty
+from cStringIO import StringIO
 from Bio import Entrez
 from Bio import SeqIO
+from special_tools import Cache
+from special_tools import Cassette
+from genbank_tools import parseGenBank
+from taxonomy_tools import TaxDump
+from seqdb_tools import SeqDB
 
 # GLOBALS
 Entrez.tool = 'pglt'
+cache = None  # set at run_pglt.py, shared by all folders
+cache_ttl = 60 * 60 * 24 * 30  # cached responses expire after 30 days
+cache_maxsize = 2 * 1024 ** 3  # max 2GB of cached responses
+# requests made without a Client use the following, set at stage 1
+api_key = None
+taxdump = None  # offline taxonomy
+seqdb = None  # offline nucleotide database
+cassette = None  # recorded responses
+replaying = False  # if True, responses only come from cassette
+latency = None  # seconds to wait per replayed response, 'recorded' or None
+maxwait = 60  # longest wait in seconds between retries
+maxids = 100000  # most IDs returned by a single search
+fetchsize = 200  # most taxonomy records fetched in a single request
+nextsize = 20  # most taxonomy records whose children are searched at once
+summarysize = 500  # most document summaries fetched in a single request
+eutils_url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+# history server session of a search, expires within hours
+history_pattern = re.compile(r'<(WebEnv|QueryKey)>[^<]*</\1>')
+
+
+# CLASSES
+class RateLimiter(object):
+    """Token bucket limiting requests per second across all threads"""
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until a request can be made"""
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens +
+                                  (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class TeeHandle(object):
+    """Wrap a handle, keeping a copy of every line read (if keep)"""
+    def __init__(self, handle, keep=True):
+        self.handle = handle
+        self.keep = keep
+        self.lines = []
+
+    def readline(self):
+        line = self.handle.readline()
+        if self.keep:
+            self.lines.append(line)
+        return line
+
+    def read(self, size=-1):
+        data = self.handle.read(size)
+        if self.keep:
+            self.lines.append(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def getvalue(self):
+        return ''.join(self.lines)
+
+    def close(self):
+        self.handle.close()
+
+
+class ClientResponse(object):
+    """Handle to the body of a Client response, returning its connection \
+to the pool once closed"""
+    def __init__(self, client, conn, response, blocksize=8192):
+        self.client = client
+        self.conn = conn
+        self.response = response
+        self.blocksize = blocksize
+        self.buffer = ''
+
+    def _fill(self):
+        # httplib errors (e.g. IncompleteRead) are IOErrors to safeConnect
+        try:
+            block = self.response.read(self.blocksize)
+        except (httplib.HTTPException, socket.error) as errmsg:
+            raise IOError(errmsg)
+        # httplib does not raise for bodies cut short when read in blocks
+        if not block and self.response.length:
+            raise IOError(httplib.IncompleteRead(self.buffer,
+                                                 self.response.length))
+        self.buffer += block
+        return bool(block)
+
+    def readline(self):
+        while '\n' not in self.buffer and self._fill():
+            pass
+        i = self.buffer.find('\n') + 1 or len(self.buffer)
+        line, self.buffer = self.buffer[:i], self.buffer[i:]
+        return line
+
+    def read(self, size=-1):
+        while (size < 0 or len(self.buffer) < size) and self._fill():
+            pass
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def close(self):
+        if self.conn is None:
+            return
+        # a connection can only be reused once its response is read
+        if not self.response.isclosed():
+            self.conn.close()
+        self.client._release(self.conn)
+        self.conn = None
+
+
+class Client(object):
+    """Client class : Entrez E-utilities client for a single study, \
+holding its own configuration (email, API key) and a pool of keep-alive \
+connections that can be shared by many threads. Use in place of \
+Biopython's module-wide Entrez configuration by passing it to eSearch, \
+eFetch and eFetchIter. A client also holds the study's own taxdump, \
+seqdb, cassette and random stream, so studies can run at once."""
+    def __init__(self, email, api_key=None, tool='pglt', url=eutils_url,
+                 maxconnections=10):
+        self.email = email
+        self.api_key = api_key or None
+        self.tool = tool
+        self.url = urlparse.urlparse(url)
+        self.maxconnections = maxconnections
+        self.limiter = getLimiter(self.api_key)
+        self.connections = LifoQueue()
+        self.nconnections = 0
+        self.lock = threading.Lock()
+        self.taxdump = None
+        self.seqdb = None
+        self.cassette = None
+        self.replaying = False
+        self.latency = None
+        self.random = random.Random()
+
+    def setUpTaxDump(self, directory):
+        """Answer taxonomy requests from NCBI taxdump files in \
+directory, no taxdump if directory is empty"""
+        self.taxdump = TaxDump(directory) if directory else None
+        return self.taxdump
+
+    def setUpSeqDB(self, directory):
+        """Answer nucleotide requests from GenBank flatfiles in \
+directory, no local database if directory is empty. Needs a taxdump."""
+        self.seqdb = SeqDB(directory, self.taxdump) if directory else None
+        return self.seqdb
+
+    def setUpCassette(self, directory, mode=None, wait=None, seed=0):
+        """Record responses to, or replay them from, a cassette in \
+directory, as setUpCassette. The client's random stream is seeded."""
+        self.cassette, self.replaying, self.latency =\
+            _cassetteSettings(directory, mode, wait)
+        if self.cassette is not None:
+            self.random.seed(seed)
+        return self.cassette
+
+    def _connect(self):
+        """Return an idle connection, or a new one"""
+        try:
+            return self.connections.get_nowait()
+        except Empty:
+            pass
+        with self.lock:
+            if self.nconnections < self.maxconnections:
+                self.nconnections += 1
+                if self.url.scheme == 'https':
+                    return httplib.HTTPSConnection(self.url.netloc,
+                                                   timeout=maxwait)
+                return httplib.HTTPConnection(self.url.netloc,
+                                              timeout=maxwait)
+        # wait for a connection to be released
+        return self.connections.get()
+
+    def _release(self, conn):
+        self.connections.put(conn)
+
+    def _request(self, cgi, params):
+        """Return ClientResponse for request to E-utility cgi"""
+        params = dict([(k, v) for k, v in params.items() if v is not None])
+        for key, value in params.items():
+            if isinstance(value, (list, tuple)):
+                params[key] = ','.join([str(e) for e in value])
+        params['tool'] = self.tool
+        params['email'] = self.email
+        if self.api_key:
+            params['api_key'] = self.api_key
+        options = urllib.urlencode(sorted(params.items()))
+        path = self.url.path + cgi
+        self.limiter.wait()
+        conn = self._connect()
+        # an idle connection may have been closed by the server, so
+        #  requests are tried twice
+        for i in range(2):
+            try:
+                # long requests (e.g. many IDs) are posted
+                if len(options) > 1000:
+                    conn.request('POST', path, options, {
+                        'Content-Type': 'application/x-www-form-urlencoded'})
+                else:
+                    conn.request('GET', path + '?' + options)
+                response = conn.getresponse()
+                break
+            except (httplib.HTTPException, socket.error) as errmsg:
+                conn.close()
+                if i == 1:
+                    self._release(conn)
+                    raise IOError(errmsg)
+        if response.status != 200:
+            # read the body so the connection can be reused
+            try:
+                response.read()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+            finally:
+                self._release(conn)
+            raise IOError('HTTP Error {0}: {1}'.format(response.status,
+                                                        response.reason))
+        return ClientResponse(self, conn, response)
+
+    def esearch(self, **kwargs):
+        """Return handle to esearch results (arguments as Entrez)"""
+        return self._request('esearch.fcgi', kwargs)
+
+    def efetch(self, **kwargs):
+        """Return handle to efetch results (arguments as Entrez)"""
+        return self._request('efetch.fcgi', kwargs)
+
+    def esummary(self, **kwargs):
+        """Return handle to esummary results (arguments as Entrez)"""
+        return self._request('esummary.fcgi', kwargs)
+
+
+class Flight(object):
+    """Request in progress: others making it wait for event, then read \
+response"""
+    def __init__(self):
+        self.event = threading.Event()
+        self.response = None
+
+
+# NCBI allow 3 requests per second, 10 with an API key
+# http://www.ncbi.nlm.nih.gov/books/NBK25497/
+# limiters by API key, shared by all requests made with the same key
+limiters = {None: RateLimiter(3)}
+limiter = limiters[None]  # of requests made without a Client
+# Biopython's Entrez functions wait 1/3s between all requests, so with an
+#  API key requests made without a Client are made by key_client instead
+entrez_funcs = (Entrez.esearch, Entrez.efetch, Entrez.esummary)
+key_client = None
+limiters_lock = threading.Lock()
+inflight = {}  # Flights by request key
+inflight_lock = threading.Lock()
 
 
 # FUNCTIONS
-def safeConnect(efunc, logger, max_check=100, waittime=1, power=2,
-                **kwargs):
-    '''Return Entrez results safely'''
-    # waitime should be min 1/3 second
-    # no more than 3 URL requests per second
+def setApiKey(key):
+    '''Set NCBI API key of requests made without a Client, raising their
+    rate limit'''
+    global api_key
+    global limiter
+    global key_client
+    api_key = key or None
+    # limiters are shared, so are swapped rather than changed
+    limiter = getLimiter(api_key)
+    # set after Entrez.email
+    key_client = Client(Entrez.email, api_key) if api_key else None
+
+
+def getLimiter(key=None):
+    '''Return rate limiter shared by all requests made with API key'''
+    with limiters_lock:
+        if key not in limiters:
+            limiters[key] = RateLimiter(10)
+        return limiters[key]
+
+
+def setUpCache(directory, ttl=cache_ttl, maxsize=cache_maxsize):
+    '''Set up a persistent cache of Entrez responses in directory'''
+    global cache
+    cache = Cache(os.path.join(directory, 'entrez_cache.db'), ttl=ttl,
+                  maxsize=maxsize)
+    return cache
+
+
+def setUpTaxDump(directory):
+    '''Answer taxonomy requests from NCBI taxdump files in directory,
+    no taxdump if directory is empty'''
+    global taxdump
+    if directory:
+        taxdump = TaxDump(directory)
+    else:
+        taxdump = None
+    return taxdump
+
+
+def setUpSeqDB(directory):
+    '''Answer nucleotide requests from GenBank flatfiles in directory,
+    no local database if directory is empty. Needs a taxdump (see
+    setUpTaxDump).'''
+    global seqdb
+    if directory:
+        seqdb = SeqDB(directory, taxdump=taxdump)
+    else:
+        seqdb = None
+    return seqdb
+
+
+def setUpCassette(directory, mode=None, wait=None, seed=0):
+    '''Record Entrez responses to, or replay them from, a cassette in
+    directory (mode 'record' or 'replay', no cassette if empty). Replayed
+    responses wait for wait seconds, or as long as recorded if 'recorded'.
+    The random module is seeded so requests are the same in both modes.
+    Raises IOError if replaying a cassette that was never recorded.'''
+    global cassette
+    global replaying
+    global latency
+    cassette, replaying, latency = _cassetteSettings(directory, mode, wait)
+    if cassette is not None:
+        random.seed(seed)
+    return cassette
+
+
+def _cassetteSettings(directory, mode, wait):
+    '''Return cassette, whether replaying and latency for setUpCassette'''
+    if mode not in ['record', 'replay']:
+        return None, False, None
+    if wait == 'recorded' or not wait:
+        latency = wait or None
+    else:
+        latency = float(wait)
+    path = os.path.join(directory, 'entrez_cassette.p.gz')
+    # replaying nothing would look like finding nothing
+    if mode == 'replay' and not os.path.isfile(path):
+        raise IOError('No cassette to replay [{0}]'.format(path))
+    return Cassette(path), mode == 'replay', latency
+
+
+def _settings(client):
+    '''Return what holds the taxdump, seqdb and cassette used by requests
+    made with client: the client itself, or this module if None'''
+    return client or sys.modules[__name__]
+
+
+def _replay(key, logger, settings):
+    '''Return response for key from cassette, None if not recorded'''
+    entry = settings.cassette.get(key)
+    if entry is None:
+        logger.info(" ---- request missing from cassette [{0}] ----".
+                    format(key))
+        return None
+    response, elapsed = entry
+    if settings.latency == 'recorded':
+        time.sleep(elapsed)
+    elif settings.latency:
+        time.sleep(settings.latency)
+    return response
+
+
+def _keyClient(efunc, client):
+    '''Return client to make request with: key_client, if set, in place
+    of Biopython's Entrez functions'''
+    if client is None and key_client and efunc in entrez_funcs:
+        return key_client
+    return client
+
+
+def _cacheKey(efunc, kwargs):
+    '''Return key for an Entrez request given function and arguments'''
+    # lists of IDs are sorted so the same IDs in a different order
+    #  return the same key
+    items = []
+    for key in sorted(kwargs.keys()):
+        value = kwargs[key]
+        if isinstance(value, (list, tuple)):
+            value = sorted([str(e) for e in value])
+        items.append((key.lower(), value))
+    return hashlib.sha1(repr((efunc.__name__, items))).hexdigest()
+
+
+def _parseResponse(response, kwargs):
+    '''Parse a raw Entrez response'''
+    # if rettype is GenBank (or FASTA), read each seq into a list
+    rettype = kwargs.get('rettype')
+    if rettype == 'gb':
+        return [x for x in parseGenBank(StringIO(response))]
+    if rettype == 'fasta':
+        return [x for x in SeqIO.parse(StringIO(response), 'fasta')]
+    if rettype == 'ft':
+        return readFeatureTable(StringIO(response))
+    return Entrez.read(StringIO(response))
+
+
+def readFeatureTable(handle):
+    '''Return list of dictionaries (accession and features) of records in
+    an NCBI feature table. Features are tuples of type, intervals (1-based
+    start and end, end before start if on the minus strand) and dictionary
+    of qualifiers.'''
+    # http://www.ncbi.nlm.nih.gov/Sequin/table.html
+    records = []
+    feature = None
+    for line in handle:
+        line = line.rstrip('\r\n')
+        if line.startswith('>Feature'):
+            # e.g. >Feature gb|AM711897.1|
+            accession = line.split()[1].strip('|').split('|')[-1]
+            records.append({'accession': accession, 'features': []})
+            feature = None
+            continue
+        fields = line.split('\t')
+        if not records or len(fields) < 2:
+            continue
+        if fields[0] and fields[1]:
+            # location line, the first of a feature has its type
+            interval = (int(fields[0].strip('<>')),
+                        int(fields[1].strip('<>')))
+            if len(fields) > 2 and fields[2]:
+                feature = (fields[2], [interval], {})
+                records[-1]['features'].append(feature)
+            elif feature:
+                feature[1].append(interval)
+        elif feature and len(fields) > 3:
+            # qualifier line: three tabs, key, tab, value
+            feature[2].setdefault(fields[3], []).append(
+                '\t'.join(fields[4:]))
+    return records
+
+
+def safeConnect(efunc, logger, max_check=10, waittime=1, power=2,
+                client=None, **kwargs):
+    '''Return Entrez results safely, requested with client if given'''
+    # all requests pass through limiter: no more than 3 URL requests
+    #  per second (10 with an API key) for all threads
     # http://www.ncbi.nlm.nih.gov/books/NBK25497/
+    # raw responses are stored in cache, if set, so repeated requests
+    #  (by any folder, in any run) are read locally
+    # requests against the history server are bound to a session and are
+    #  never cached, searches posted to it are cached without their session
+    # if a cassette is set, responses are recorded to it or, if replaying,
+    #  only read from it
+    key = _cacheKey(efunc, kwargs)
+    settings = _settings(client)
+    if settings.cassette is not None and settings.replaying:
+        response = _replay(key, logger, settings)
+        if response is None:
+            return ()
+        return _parseResponse(response, kwargs)
+    # identical requests made at the same time (e.g. by folders sharing
+    #  taxa) wait for the first and parse its response
+    with inflight_lock:
+        flight = inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = inflight[key] = Flight()
+    if not leader:
+        start = time.time()
+        flight.event.wait()
+        if flight.response is None:
+            return ()
+        # the leader records to its own cassette only
+        if settings.cassette is not None:
+            settings.cassette.set(key, flight.response, time.time() - start)
+        return _parseResponse(flight.response, kwargs)
+    try:
+        results, flight.response = _connect(efunc, logger, max_check,
+                                            waittime, power, client, key,
+                                            kwargs, settings)
+    finally:
+        with inflight_lock:
+            del inflight[key]
+        flight.event.set()
+    return results
+
+
+def _connect(efunc, logger, max_check, waittime, power, client, key,
+             kwargs, settings):
+    '''Return Entrez results and raw response (None if failed) for
+    safeConnect'''
+    cacheable = cache and 'WebEnv' not in kwargs.keys()
+    response = cache.get(key) if cacheable else None
+    cached = response is not None
+    start = time.time()
+    # a client adds its own API key and waits on its own limiter
+    client = _keyClient(efunc, client)
+    if client:
+        efunc = getattr(client, efunc.__name__)
+        wait = lambda: None
+    else:
+        wait = limiter.wait
+        if api_key:
+            kwargs['api_key'] = api_key
     i = 0
     results = ()
     while i < max_check:
         try:
-            # open handle with Entrez function
-            handle = efunc(**kwargs)
-            # print(handle.url)
-            # if rettype is GenBank, read each seq into a list
-            if 'rettype' in kwargs.keys() and 'gb' == kwargs['rettype']:
-                results_iter = SeqIO.parse(handle, 'gb')
-                results = [x for x in results_iter]
-            else:
-                results = Entrez.read(handle)
-            handle.close()
+            if response is None:
+                # open handle with Entrez function
+                wait()
+                handle = efunc(**kwargs)
+                # print(handle.url)
+                # a client's connection is released even if the read fails
+                try:
+                    response = handle.read()
+                finally:
+                    handle.close()
+            results = _parseResponse(response, kwargs)
             i = max_check
         # catch IOErrors and RuntimeErrors; servers turns down occasionally
         except (IOError, RuntimeError) as errmsg:
             logger.debug(" ---- server error [{0}]: retrying in [{1}s]----".
                          format(errmsg, waittime))
-            if i == max_check:
+            if i + 1 == max_check:
                 logger.debug(" ----- max attempts: no records retrieved ----")
-            time.sleep(waittime)
-            waittime = waittime * power
+            # never parse the same bad response twice
+            response = None
+            cached = False
+            # jitter waits so threads do not retry in step, cap at maxwait
+            time.sleep(random.uniform(waittime/2., waittime))
+            waittime = min(waittime * power, maxwait)
             i += 1
-    return results
+    if cacheable and results and not cached:
+        if kwargs.get('usehistory') == 'y':
+            cache.set(key, history_pattern.sub('', response))
+        else:
+            cache.set(key, response)
+    if settings.cassette is not None and results:
+        settings.cassette.set(key, response, time.time() - start)
+    if not results:
+        response = None
+    return results, response
+
+
+def safeStream(efunc, logger, max_check=10, waittime=1, power=2,
+               client=None, **kwargs):
+    '''Yield GenBank records safely while the response is downloading'''
+    # as safeConnect, but records are parsed and yielded as they arrive
+    #  so a caller can stop early; only complete responses are cached
+    key = _cacheKey(efunc, kwargs)
+    cacheable = cache and 'WebEnv' not in kwargs.keys()
+    settings = _settings(client)
+    cassette = settings.cassette
+    if cassette is not None and settings.replaying:
+        response = _replay(key, logger, settings)
+        if response is None:
+            return
+    else:
+        response = cache.get(key) if cacheable else None
+        if response is not None and cassette is not None:
+            cassette.set(key, response)
+    if response is not None:
+        for record in parseGenBank(StringIO(response)):
+            yield record
+        return
+    # responses are kept if they are to be cached or recorded
+    keep = bool(cacheable) or cassette is not None
+    start = time.time()
+    # a client adds its own API key and waits on its own limiter
+    client = _keyClient(efunc, client)
+    if client:
+        efunc = getattr(client, efunc.__name__)
+        wait = lambda: None
+    else:
+        wait = limiter.wait
+        if api_key:
+            kwargs['api_key'] = api_key
+    i = 0
+    nyielded = 0
+    while i < max_check:
+        try:
+            wait()
+            handle = TeeHandle(efunc(**kwargs), keep=keep)
+            try:
+                nparsed = 0
+                for record in parseGenBank(handle):
+                    nparsed += 1
+                    # skip records already yielded before a retry
+                    if nparsed > nyielded:
+                        nyielded += 1
+                        yield record
+            except GeneratorExit:
+                # a response cut short by the caller is recorded as read
+                #  so a replay stops at the same record
+                if cassette is not None:
+                    cassette.set(key, handle.getvalue(), time.time() - start)
+                raise
+            finally:
+                # run when complete or when the caller stops early
+                handle.close()
+            i = max_check
+        # catch IOErrors and RuntimeErrors; servers turns down occasionally
+        except (IOError, RuntimeError) as errmsg:
+            logger.debug(" ---- server error [{0}]: retrying in [{1}s]----".
+                         format(errmsg, waittime))
+            if i + 1 == max_check:
+                logger.debug(" ----- max attempts: no records retrieved ----")
+            time.sleep(random.uniform(waittime/2., waittime))
+            waittime = min(waittime * power, maxwait)
+            i += 1
+            continue
+        if cacheable and nyielded:
+            cache.set(key, handle.getvalue())
+        if cassette is not None and nyielded:
+            cassette.set(key, handle.getvalue(), time.time() - start)
 
 
-def eSearch(term, logger, retStart=0, retMax=1, db="nucleotide"):
+def eSearch(term, logger, retStart=0, retMax=1, usehistory="n",
+            db="nucleotide", client=None):
     """Use Entrez.esearch to search a term in an NCBI database.
 
     Arguments:
@@ -57,28 +658,41 @@ def eSearch(term, logger, retStart=0, retMax=1, db="nucleotide"):
      logger = logging object
      retStart = minimum returned ID of matching sequences IDs
      retMax = maximum returned ID of matching sequences IDs
+     usehistory = 'y' to post results to the history server
      db = NCBI database
+     client = Client to make requests with (default Biopython's Entrez)
 
     Return:
-     dictionary
+     dictionary (with WebEnv and QueryKey if usehistory)
 
     Adapted pG code written by W.D. Pearse."""
     if db not in ['nucleotide', 'taxonomy']:
         raise(ValueError('Invalid db argument!'))
+    seqdb = _settings(client).seqdb
+    if db == 'nucleotide' and seqdb:
+        return seqdb.search(term, retStart=retStart, retMax=retMax)
     results = ()
     results = safeConnect(efunc=Entrez.esearch, logger=logger, db=db,
-                          term=term, usehistory='n', retStart=retStart,
-                          retMax=retMax, retmode="text")
+                          term=term, usehistory=usehistory,
+                          retStart=retStart, retMax=retMax, retmode="text",
+                          client=client)
     return results
 
 
-def eFetch(ncbi_id, logger, db="nucleotide"):
-    """Download NCBI record(s) using ID number(s).
+def eFetch(ncbi_id, logger, db="nucleotide", webenv=None, query_key=None,
+           retStart=0, retMax=100, client=None):
+    """Download NCBI record(s) using ID number(s) or a search on the
+    history server.
 
     Arguments:
-     ncbi_id = sequence identifier (list or string)
+     ncbi_id = sequence identifier (list or string), ignored if webenv
      logger = logging object
      db = NCBI database (default is nucleotide)
+     webenv = WebEnv of a search posted with usehistory
+     query_key = QueryKey of a search posted with usehistory
+     retStart = first record of search to return (if webenv)
+     retMax = number of records of search to return (if webenv)
+     client = Client to make requests with (default Biopython's Entrez)
 
     Return:
      List of SeqRecords (db = 'nucleotide')
@@ -87,16 +701,122 @@ def eFetch(ncbi_id, logger, db="nucleotide"):
     Adapted pG code written by W.D. Pearse."""
     if db not in ['nucleotide', 'taxonomy']:
         raise(ValueError('Invalid db argument!'))
+    if webenv:
+        ids = {'WebEnv': webenv, 'query_key': query_key,
+               'retstart': retStart, 'retmax': retMax}
+    else:
+        ids = {'id': ncbi_id}
+    taxdump = _settings(client).taxdump
+    seqdb = _settings(client).seqdb
     results = ()
-    if db == 'taxonomy':
+    if db == 'taxonomy' and taxdump and not webenv:
+        if not isinstance(ncbi_id, (list, tuple)):
+            ncbi_id = str(ncbi_id).split(',')
+        results = [taxdump.record(e) for e in ncbi_id if e in taxdump]
+        # taxa newer than the taxdump files are fetched online
+        missing = [e for e in ncbi_id if e not in taxdump]
+        if missing:
+            results.extend(safeConnect(efunc=Entrez.efetch, logger=logger,
+                                       db=db, retmode='xml', id=missing,
+                                       client=client))
+    elif db == 'taxonomy':
         results = safeConnect(efunc=Entrez.efetch, logger=logger, db=db,
-                              retmode='xml', id=ncbi_id)
+                              retmode='xml', client=client, **ids)
+    elif seqdb and not webenv:
+        results = seqdb.fetch(ncbi_id)
     else:
         results = safeConnect(efunc=Entrez.efetch, logger=logger, db=db,
-                              rettype='gb', retmode='text', id=ncbi_id)
+                              rettype='gb', retmode='text', client=client,
+                              **ids)
     return results
 
 
+def eSummary(ncbi_id, logger, client=None):
+    """Download NCBI nucleotide document summaries (title, length, etc.)
+    using ID number(s), in requests of up to summarysize IDs.
+
+    Arguments:
+     ncbi_id = sequence identifier (list or string)
+     logger = logging object
+     client = Client to make requests with (default Biopython's Entrez)
+
+    Return:
+     List of dictionaries (empty if a local seqdb is used)"""
+    # local records are cheap to read in full
+    if _settings(client).seqdb:
+        return []
+    if not isinstance(ncbi_id, (list, tuple)):
+        ncbi_id = str(ncbi_id).split(',')
+    results = []
+    for i in range(0, len(ncbi_id), summarysize):
+        results.extend(safeConnect(efunc=Entrez.esummary, logger=logger,
+                                   db='nucleotide',
+                                   id=ncbi_id[i:i + summarysize],
+                                   client=client))
+    return results
+
+
+def eFetchFeatures(ncbi_id, logger, client=None):
+    """Download feature tables of NCBI nucleotide record(s) using ID
+    number(s), without their sequences.
+
+    Arguments:
+     ncbi_id = sequence identifier (list or string)
+     logger = logging object
+     client = Client to make requests with (default Biopython's Entrez)
+
+    Return:
+     List of dictionaries (see readFeatureTable)"""
+    return safeConnect(efunc=Entrez.efetch, logger=logger, db='nucleotide',
+                       rettype='ft', retmode='text', id=ncbi_id,
+                       client=client)
+
+
+def eFetchRegion(ncbi_id, start, stop, logger, client=None):
+    """Download a region of an NCBI nucleotide record in FASTA.
+
+    Arguments:
+     ncbi_id = sequence identifier
+     start, stop = 1-based positions of region, stop before start if the
+      region is on the minus strand (as in feature tables)
+     logger = logging object
+     client = Client to make requests with (default Biopython's Entrez)
+
+    Return:
+     SeqRecord (None if failed)"""
+    strand = 1 if start <= stop else 2
+    results = safeConnect(efunc=Entrez.efetch, logger=logger,
+                          db='nucleotide', rettype='fasta', retmode='text',
+                          id=ncbi_id, seq_start=min(start, stop),
+                          seq_stop=max(start, stop), strand=strand,
+                          client=client)
+    if not results:
+        return None
+    return results[0]
+
+
+def eFetchIter(ncbi_id, logger, webenv=None, query_key=None, retStart=0,
+               retMax=100, client=None):
+    """Stream NCBI nucleotide record(s) using ID number(s) or a search on
+    the history server.
+
+    Arguments:
+     as eFetch (db is always nucleotide)
+
+    Return:
+     Generator of SeqRecords"""
+    seqdb = _settings(client).seqdb
+    if seqdb and not webenv:
+        return seqdb.iterFetch(ncbi_id)
+    if webenv:
+        ids = {'WebEnv': webenv, 'query_key': query_key,
+               'retstart': retStart, 'retmax': retMax}
+    else:
+        ids = {'id': ncbi_id}
+    return safeStream(efunc=Entrez.efetch, logger=logger, db='nucleotide',
+                      rettype='gb', retmode='text', client=client, **ids)
+
+
 def findChildren(taxid, logger, target=100, next=False):
     """
     Return all decendant genera (or below) of a taxonmic ID.
@@ -111,12 +831,25 @@ def findChildren(taxid, logger, target=100, next=False):
      taxid
     """
     # internals
-    def findNext(frecord):
-        term = "{0}[Next Level] AND {1}[Division]".\
-            format(frecord[0]['ScientificName'], frecord[0]['Division'])
-        count = eSearch(term, logger=logger, db="taxonomy")["Count"]
-        srecord = eSearch(term, logger=logger, db="taxonomy", retMax=count)
-        return srecord['IdList']
+    def findNext(frecords):
+        res = []
+        if taxdump:
+            for frecord in frecords:
+                res.extend([str(e) for e in
+                            taxdump.children(frecord['TaxId'])])
+            # taxa newer than the taxdump files are searched online
+            frecords = [e for e in frecords if e['TaxId'] not in taxdump]
+        # children of many records are found with a single search for
+        #  every group of nextsize records
+        for i in range(0, len(frecords), nextsize):
+            terms = ["({0}[Next Level] AND {1}[Division])".
+                     format(e['ScientificName'], e['Division']) for e in
+                     frecords[i:i + nextsize]]
+            # a single search returns count and IDs
+            srecord = eSearch(' OR '.join(terms), logger=logger,
+                              db="taxonomy", retMax=maxids)
+            res.extend(srecord['IdList'])
+        return res
 
     def findTillTarget(taxids):
         res = []
@@ -124,12 +857,20 @@ def findChildren(taxid, logger, target=100, next=False):
         while len(taxids) > 0:
             if len(res) > target:
                 break
-            taxid = taxids.pop()
-            frecord = eFetch(taxid, logger=logger, db="taxonomy")
-            if frecord[0]['Rank'] in target_ranks:
-                res.append(taxid)
-            else:
-                res.extend(findTillTarget(findNext(frecord)))
+            # fetch records for up to fetchsize taxids in one request
+            batch = taxids[-fetchsize:]
+            del taxids[-fetchsize:]
+            frecords = eFetch(batch, logger=logger, db="taxonomy")
+            nexts = []
+            for frecord in frecords:
+                if frecord['Rank'] in target_ranks:
+                    res.append(frecord['TaxId'])
+                else:
+                    nexts.append(frecord)
+            if nexts:
+                children = findNext(nexts)
+                # search children next, in random order
+                taxids.extend(random.sample(children, len(children)))
         return res
 
     # process
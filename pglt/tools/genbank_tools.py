@@ -0,0 +1,162 @@
+#! /bin/usr/env python
+# D.J. Bennett
+# 18/10/2026
+"""
+pglt GenBank tools
+"""
+
+# PACKAGES
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from Bio.SeqFeature import SeqFeature
+from Bio.SeqFeature import FeatureLocation
+from Bio.SeqFeature import CompoundLocation
+from Bio.Alphabet import generic_dna
+
+# GLOBALS
+# only qualifiers used to find genes in records are kept
+qualifier_keys = ('gene', 'gene_synonym', 'product')
+unambiguous = 'ACGTacgt'
+
+
+# FUNCTIONS
+def countAmbiguous(sequence):
+    """Return number of bases in sequence that are not A, C, G or T"""
+    return len(str(sequence).translate(None, unambiguous))
+
+
+def _splitParts(text):
+    """Split text at commas outside brackets"""
+    parts = []
+    depth = start = 0
+    for i, char in enumerate(text):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def _parseParts(text, strand):
+    """Return list of FeatureLocations of a location string"""
+    if text.startswith('complement(') and text.endswith(')'):
+        return _parseParts(text[11:-1], -strand)[::-1]
+    for operator in ('join(', 'order('):
+        if text.startswith(operator) and text.endswith(')'):
+            res = []
+            for part in _splitParts(text[len(operator):-1]):
+                res.extend(_parseParts(part, strand))
+            return res
+    # positions in other records and between bases cannot be extracted
+    if ':' in text or '^' in text:
+        raise ValueError(text)
+    positions = text.replace('<', '').replace('>', '').split('..')
+    start = int(positions[0])
+    end = int(positions[-1])
+    return [FeatureLocation(start - 1, end, strand=strand)]
+
+
+def parseLocation(text):
+    """Return location (FeatureLocation or CompoundLocation) of a GenBank \
+location string, None if it cannot be extracted"""
+    try:
+        parts = _parseParts(text.replace(' ', ''), 1)
+    except ValueError:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    return CompoundLocation(parts)
+
+
+def _buildFeature(key, location, qualifiers):
+    """Return SeqFeature, None if it has no kept qualifiers or its \
+location cannot be extracted"""
+    if not qualifiers:
+        return None
+    location = parseLocation(location)
+    if location is None:
+        return None
+    # qualifier values are lists of the lines they were written over
+    qualifiers = dict([(k, [' '.join(e) for e in v]) for k, v in
+                       qualifiers.items()])
+    return SeqFeature(location, type=key, qualifiers=qualifiers)
+
+
+def parseGenBank(handle):
+    """Yield compact SeqRecords of GenBank records read from handle as \
+they arrive. Only features with gene, gene_synonym or product qualifiers \
+are read, and only those qualifiers."""
+    # GenBank flatfiles have 12 characters of keyword and features have
+    #  21 characters of feature key
+    # http://www.ncbi.nlm.nih.gov/Sitemap/samplerecord.html
+    def endFeature():
+        if feature:
+            built = _buildFeature(*feature)
+            if built:
+                features.append(built)
+        return None
+    section = feature = None
+    inlocation = inquote = False
+    for line in handle:
+        if line.startswith('LOCUS'):
+            name = line[12:].split()[0]
+            accession = description = ''
+            features = []
+            sequence = []
+            feature = None
+            section = 'LOCUS'
+            continue
+        if section is None:
+            continue
+        if section == 'ORIGIN' and not line.startswith('//'):
+            sequence.append(line[10:].replace(' ', '').rstrip())
+        elif section == 'FEATURES' and line.startswith(' ' * 5):
+            key = line[5:21].strip()
+            value = line[21:].rstrip()
+            if key:
+                endFeature()
+                # feature: key, location, qualifiers
+                feature = [key, value, {}]
+                qualifier = None
+                inlocation = True
+                inquote = False
+            elif value.startswith('/') and not inquote:
+                qualifier = None
+                inlocation = False
+                key, _, value = value[1:].partition('=')
+                # quoted values can continue over lines
+                inquote = value.count('"') % 2 == 1
+                if key in qualifier_keys:
+                    qualifier = [value.strip('"')]
+                    feature[2].setdefault(key, []).append(qualifier)
+            elif inlocation:
+                # location continues over lines
+                feature[1] += value
+            else:
+                if value.count('"') % 2 == 1:
+                    inquote = not inquote
+                if qualifier is not None:
+                    qualifier.append(value.strip('"'))
+        elif line.startswith('//'):
+            feature = endFeature()
+            record = SeqRecord(Seq(''.join(sequence).upper(), generic_dna),
+                               id=accession or name, name=name,
+                               description=description)
+            record.features = features
+            section = None
+            yield record
+        elif not line[:12].strip():
+            # continuation of a keyword
+            if section == 'DEFINITION':
+                description += ' ' + line[12:].strip()
+        else:
+            feature = endFeature()
+            section = line[:12].split()[0]
+            if section == 'DEFINITION':
+                description = line[12:].strip()
+            elif section == 'VERSION':
+                accession = line[12:].split()[0]
@@ -115,7 +115,8 @@ def genNamesDict(resolver, logger, parentid=None):
     return namesdict, allrankids, parentid
 
 
-def getOutgroup(namesdict, parentid, logger, outgroupid=None, minrecords=1000):
+def getOutgroup(namesdict, parentid, logger, outgroupid=None, minrecords=1000,
+                groupsize=100):
     """Return namesdict with suitable outgroup"""
     # TODO: too complex, consider breaking up
     def findParent(parentid):
@@ -132,6 +133,27 @@ def getOutgroup(namesdict, parentid, logger, outgroupid=None, minrecords=1000):
         if etal_bool:
             metadata = [e + ' et al.' for e in metadata]
         return metadata[0], metadata[1]
+
+    def countRecords(candidates):
+        term = ' OR '.join(['txid{0}[PORGN]'.format(e) for e in candidates])
+        return int(etools.eSearch(term, logger=logger)['Count'])
+
+    def findRecords(candidates, count=None):
+        # return candidates with more than minrecords nuc records
+        # sister taxa share no records so the counts of groups add up:
+        #  a group with too few records in total is dropped with one
+        #  search and the count of the second half of a group is the
+        #  group's count less that of the first half
+        if count is None:
+            count = countRecords(candidates)
+        if count <= minrecords:
+            return []
+        if len(candidates) == 1:
+            return candidates
+        half = len(candidates) // 2
+        first_count = countRecords(candidates[:half])
+        return findRecords(candidates[:half], first_count) +\
+            findRecords(candidates[half:], count - first_count)
     # loop until a suitable outgroup is found. Criteria are:
     #  1. ids returned must belong to a sister group of all ids of
     #   names given
@@ -154,13 +176,9 @@ def getOutgroup(namesdict, parentid, logger, outgroupid=None, minrecords=1000):
                                              next=True)
             # filter out children that are in ingroup
             candidates = [e for e in candidates if e != parentid]
-            # search genbank for nuc records
-            for candidate in candidates:
-                term = 'txid' + str(candidate) + '[PORGN]'
-                nuc_record = etools.eSearch(term, logger=logger)
-                # there must be more than 1000 nuc records
-                if int(nuc_record['Count']) > minrecords:
-                    outgroup_ids.append(candidate)
+            # search genbank for nuc records, in groups
+            for i in range(0, len(candidates), groupsize):
+                outgroup_ids.extend(findRecords(candidates[i:i + groupsize]))
             # make grandparentid the new parentid
             parentid = grandparentid
     else:
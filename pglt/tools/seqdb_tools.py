@@ -0,0 +1,266 @@
+#! /bin/usr/env python
+# D.J. Bennett
+# 18/10/2026
+"""
+pglt local sequence database tools
+"""
+
+# PACKAGES
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+from cStringIO import StringIO
+from genbank_tools import parseGenBank
+
+# GLOBALS
+gb_extensions = ('.gb', '.gbk', '.gbff', '.seq')
+# Entrez query tokens: brackets, operators and terms with optional field
+token_pattern = re.compile('\\(|\\)|(?:"[^"]*"|[^\\s()\\[\\]]+)\
+(?:\\[[^\\]]+\\])?')
+# a qualifier value left open by a quote continues on the next lines
+qualifier_pattern = re.compile('^\\s+/(gene|gene_synonym|product|db_xref)=\
+("?)([^"]*)("?)$')
+
+
+# CLASSES
+class SeqDB(object):
+    """SeqDB class : local mirror of GenBank flatfiles in a directory, \
+indexed with an inverted index on organism taxid and gene qualifiers in an \
+SQLite database, answering the nucleotide Entrez queries made by pglt. \
+A TaxDump is needed for queries for txid[PORGN] to include descendant \
+taxa."""
+    def __init__(self, directory, taxdump):
+        # without descendants, searches of genera or higher taxa would
+        #  quietly find nothing
+        if taxdump is None:
+            raise ValueError('A local seqdb needs a taxdump')
+        self.directory = directory
+        self.taxdump = taxdump
+        self.path = os.path.abspath(os.path.join(directory,
+                                                 'seqdb_index.db'))
+        self.lock = threading.Lock()
+        if not os.path.isfile(self.path):
+            buildIndex(directory, self.path)
+        with self.lock:
+            conn = self._connect()
+            try:
+                self.files = dict(conn.execute('SELECT id, path FROM files'))
+            finally:
+                conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def _descendants(self, taxid):
+        """Return taxid and all taxids below it"""
+        if taxid not in self.taxdump:
+            return [taxid]
+        res = []
+        taxids = [taxid]
+        while taxids:
+            taxid = taxids.pop()
+            res.append(taxid)
+            taxids.extend(self.taxdump.children(taxid))
+        return res
+
+    def _term(self, conn, term):
+        """Return uids matching a single term"""
+        match = re.match('^(.*?)(?:\\[([^\\]]+)\\])?$', term)
+        value = match.group(1).strip('"').lower()
+        field = (match.group(2) or '').upper()
+        if field == 'PORGN':
+            taxids = self._descendants(int(re.sub('^txid', '', value)))
+            res = set()
+            for i in range(0, len(taxids), 500):
+                chunk = taxids[i:i + 500]
+                res.update([e[0] for e in conn.execute(
+                    'SELECT uid FROM taxa WHERE taxid IN ({0})'.
+                    format(','.join(['?'] * len(chunk))), chunk)])
+            return res
+        res = set()
+        if field in ('GENE', ''):
+            res.update([e[0] for e in conn.execute(
+                'SELECT uid FROM genes WHERE name = ?', (value,))])
+        if field in ('TI', ''):
+            res.update([e[0] for e in conn.execute(
+                'SELECT uid FROM records WHERE title LIKE ?',
+                ('%' + value + '%',))])
+        return res
+
+    def _evaluate(self, conn, tokens):
+        """Evaluate tokens of a query left to right, as Entrez does"""
+        def operand():
+            token = tokens.pop(0)
+            if token == '(':
+                res = expression()
+                tokens.pop(0)  # closing bracket
+                return res
+            return self._term(conn, token)
+
+        def expression():
+            res = operand()
+            while tokens and tokens[0] != ')':
+                operator = tokens.pop(0).upper()
+                other = operand()
+                if operator == 'AND':
+                    res = res & other
+                elif operator == 'OR':
+                    res = res | other
+                elif operator == 'NOT':
+                    res = res - other
+                else:
+                    raise ValueError('Unrecognised operator [{0}]'.
+                                     format(operator))
+            return res
+        return expression()
+
+    def search(self, term, retStart=0, retMax=1):
+        """Return Entrez esearch like results for term"""
+        tokens = token_pattern.findall(term)
+        with self.lock:
+            conn = self._connect()
+            try:
+                uids = sorted(self._evaluate(conn, tokens))
+                ids = [e[0] for e in conn.execute(
+                    'SELECT accession FROM records WHERE uid IN ({0})'.
+                    format(','.join([str(e) for e in
+                                     uids[retStart:retStart + retMax]])))]
+            finally:
+                conn.close()
+        return {'Count': str(len(uids)), 'IdList': ids,
+                'RetStart': str(retStart), 'RetMax': str(len(ids))}
+
+    def iterFetch(self, ids):
+        """Yield SeqRecords for accessions"""
+        if not isinstance(ids, (list, tuple)):
+            ids = str(ids).split(',')
+        with self.lock:
+            conn = self._connect()
+            try:
+                locations = []
+                for each in ids:
+                    row = conn.execute('SELECT file, offset, length FROM \
+records WHERE accession = ?', (each,)).fetchone()
+                    if row:
+                        locations.append(row)
+            finally:
+                conn.close()
+        for fileid, offset, length in locations:
+            with open(self.files[fileid], 'r') as file:
+                file.seek(offset)
+                record = file.read(length)
+            yield parseGenBank(StringIO(record)).next()
+
+    def fetch(self, ids):
+        """Return list of SeqRecords for accessions"""
+        return list(self.iterFetch(ids))
+
+
+# FUNCTIONS
+def scanGenBank(filepath):
+    """Yield offset, length, accession, title, taxids and gene names of \
+each record in a GenBank flatfile without parsing whole records"""
+    with open(filepath, 'r') as file:
+        offset = 0
+        start = 0
+        accession = title = None
+        taxids = set()
+        names = set()
+        in_title = False
+        qualifier = None  # key and value of a qualifier left open
+
+        def addQualifier(key, value):
+            if key == 'db_xref':
+                if value.startswith('taxon:'):
+                    taxids.add(int(value[6:]))
+            else:
+                names.add(value.lower())
+        for line in iter(file.readline, ''):
+            if qualifier and line.startswith(' ' * 21) and\
+                    not line.lstrip().startswith('/'):
+                key, value = qualifier
+                value += ' ' + line.strip()
+                if value.endswith('"'):
+                    addQualifier(key, value[:-1])
+                    qualifier = None
+                else:
+                    qualifier = key, value
+                offset += len(line)
+                continue
+            qualifier = None
+            if line.startswith('LOCUS'):
+                start = offset
+                accession = title = None
+                taxids = set()
+                names = set()
+            elif line.startswith('DEFINITION'):
+                title = line[12:].strip()
+                in_title = True
+            elif in_title and line.startswith(' ' * 12):
+                title += ' ' + line.strip()
+            elif line.startswith('VERSION'):
+                accession = line[12:].split()[0]
+            elif line.startswith('//'):
+                yield start, offset + len(line) - start, accession, title,\
+                    taxids, names
+            else:
+                match = qualifier_pattern.match(line.rstrip('\n'))
+                if match:
+                    key, opening, value, closing = match.groups()
+                    if opening and not closing:
+                        qualifier = key, value
+                    else:
+                        addQualifier(key, value)
+            if not line.startswith(' ' * 12) and\
+                    not line.startswith('DEFINITION'):
+                in_title = False
+            offset += len(line)
+
+
+def buildIndex(directory, path):
+    """Index GenBank flatfiles in directory into an SQLite database"""
+    # built in a tempfile and moved into place once complete, so an
+    #  interrupted build never leaves a partial index
+    handle, temppath = tempfile.mkstemp(suffix='.db', dir=directory)
+    os.close(handle)
+    try:
+        _buildIndex(directory, temppath)
+        os.rename(temppath, path)
+    finally:
+        if os.path.isfile(temppath):
+            os.remove(temppath)
+
+
+def _buildIndex(directory, path):
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute('CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT)')
+        conn.execute('CREATE TABLE records (uid INTEGER PRIMARY KEY, \
+accession TEXT, file INTEGER, offset INTEGER, length INTEGER, title TEXT)')
+        conn.execute('CREATE TABLE taxa (taxid INTEGER, uid INTEGER)')
+        conn.execute('CREATE TABLE genes (name TEXT, uid INTEGER)')
+        filenames = sorted([e for e in os.listdir(directory) if
+                            e.endswith(gb_extensions)])
+        uid = 0
+        for fileid, filename in enumerate(filenames):
+            # absolute, as the index may be read from another cwd
+            filepath = os.path.abspath(os.path.join(directory, filename))
+            conn.execute('INSERT INTO files VALUES (?, ?)',
+                         (fileid, filepath))
+            for offset, length, accession, title, taxids, names in\
+                    scanGenBank(filepath):
+                uid += 1
+                conn.execute('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)',
+                             (uid, accession, fileid, offset, length, title))
+                conn.executemany('INSERT INTO taxa VALUES (?, ?)',
+                                 [(e, uid) for e in taxids])
+                conn.executemany('INSERT INTO genes VALUES (?, ?)',
+                                 [(e, uid) for e in names])
+        conn.execute('CREATE INDEX records_accession ON records (accession)')
+        conn.execute('CREATE INDEX taxa_taxid ON taxa (taxid)')
+        conn.execute('CREATE INDEX genes_name ON genes (name)')
+        conn.commit()
+    finally:
+        conn.close()
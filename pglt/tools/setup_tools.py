@@ -408,7 +408,9 @@ def readInPars(pars_file):
                 'minspecies': None, 'minspecies_gene': None,
                 'minnseqs_gene': None, 'target_ngenes': None, 'maxpn': None,
                 'votesize': None, 'maxvotetrys': None, 'taxonomic_constraint':
-                None}
+                None, 'api_key': None, 'taxdump': None, 'seqdb': None,
+                'cassette': None, 'cassette_latency': None,
+                'download_workers': None, 'sample_multiple': None}
     # open file, read each row, extract value
     paradict = _read(pars_file, paradict)
     # if Nones remain, use default
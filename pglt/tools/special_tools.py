@@ -13,9 +13,200 @@ import sys
 import subprocess
 import shutil
 import pickle
+import gzip
+import sqlite3
+import threading
 from tabulate import tabulate
 
 
+# CLASSES
+class Cache(object):
+    """Cache class : persistent key-value store in an SQLite database \
+with time-to-live and size-bounded (least recently used) eviction"""
+    def __init__(self, path, ttl=None, maxsize=None, evict_every=100):
+        self.path = path
+        self.ttl = ttl  # seconds before an entry expires, None to keep
+        self.maxsize = maxsize  # max total bytes of entries, None for no max
+        self.evict_every = evict_every  # check size every n sets
+        self.counter = 0
+        self.added = 0  # bytes set since size was last checked
+        self.lock = threading.Lock()
+        with self.lock:
+            conn = self._connect()
+            try:
+                # pages of dropped entries are given back, so the file
+                #  stays near maxsize
+                conn.execute('PRAGMA auto_vacuum = FULL')
+                conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT \
+PRIMARY KEY, value BLOB, size INTEGER, created REAL, used REAL)')
+                conn.execute('CREATE INDEX IF NOT EXISTS cache_used ON \
+cache (used)')
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _connect(self):
+        # a new connection every call: connections cannot be shared
+        #  across threads and the file is shared across processes
+        return sqlite3.connect(self.path, timeout=60)
+
+    def get(self, key):
+        """Return value for key, None if missing or expired"""
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            try:
+                row = conn.execute('SELECT value, created FROM cache WHERE \
+key = ?', (key,)).fetchone()
+                if row is None:
+                    return None
+                if self.ttl is not None and (now - row[1]) > self.ttl:
+                    conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+                    conn.commit()
+                    return None
+                conn.execute('UPDATE cache SET used = ? WHERE key = ?',
+                             (now, key))
+                conn.commit()
+            finally:
+                conn.close()
+        return str(row[0])
+
+    def set(self, key, value):
+        """Store value (a string) for key"""
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            try:
+                conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, \
+?, ?)', (key, sqlite3.Binary(value), len(key) + len(value), now, now))
+                conn.commit()
+                self._added(conn, now, 1, len(key) + len(value))
+            finally:
+                conn.close()
+
+    def getMany(self, keys):
+        """Return dict of values for keys, without those missing or \
+expired"""
+        now = time.time()
+        keys = list(set(keys))
+        res = {}
+        with self.lock:
+            conn = self._connect()
+            try:
+                # SQLite limits the number of parameters of a statement
+                for i in range(0, len(keys), 500):
+                    chunk = keys[i:i + 500]
+                    marks = ','.join(['?'] * len(chunk))
+                    for key, value, created in conn.execute(
+                            'SELECT key, value, created FROM cache WHERE key \
+IN ({0})'.format(marks), chunk):
+                        if self.ttl is None or (now - created) <= self.ttl:
+                            res[key] = str(value)
+                    conn.execute('UPDATE cache SET used = ? WHERE key IN \
+({0})'.format(marks), [now] + chunk)
+                conn.commit()
+            finally:
+                conn.close()
+        return res
+
+    def setMany(self, items):
+        """Store values (strings) for keys of dict items"""
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            try:
+                conn.executemany('INSERT OR REPLACE INTO cache VALUES (?, ?, \
+?, ?, ?)', [(k, sqlite3.Binary(v), len(k) + len(v), now, now) for k, v
+                            in items.items()])
+                conn.commit()
+                self._added(conn, now, len(items), sum(
+                    [len(k) + len(v) for k, v in items.items()]))
+            finally:
+                conn.close()
+
+    def _added(self, conn, now, n, size):
+        """Count n entries of size bytes set, evict every evict_every \
+entries or every tenth of maxsize"""
+        self.counter += n
+        self.added += size
+        if self.counter >= self.evict_every or (
+                self.maxsize is not None and self.added * 10 >= self.maxsize):
+            self.counter = 0
+            self.added = 0
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        """Drop expired entries, then least recently used entries \
+until below maxsize"""
+        if self.ttl is not None:
+            conn.execute('DELETE FROM cache WHERE created < ?',
+                         (now - self.ttl,))
+        if self.maxsize is not None:
+            total = conn.execute('SELECT SUM(size) FROM cache').fetchone()[0]
+            if total and total > self.maxsize:
+                # drop oldest used entries till below 90% of maxsize
+                excess = total - (self.maxsize * 0.9)
+                dropped = 0
+                keys = []
+                for key, size in conn.execute('SELECT key, size FROM cache \
+ORDER BY used'):
+                    if dropped >= excess:
+                        break
+                    keys.append((key,))
+                    dropped += size
+                conn.executemany('DELETE FROM cache WHERE key = ?', keys)
+        conn.commit()
+
+    def clear(self):
+        """Remove all entries"""
+        with self.lock:
+            conn = self._connect()
+            try:
+                conn.execute('DELETE FROM cache')
+                conn.commit()
+            finally:
+                conn.close()
+
+
+class Cassette(object):
+    """Cassette class : append-only gzipped file of pickled (key, value, \
+elapsed) entries, for recording responses and replaying them later"""
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        if os.path.isfile(path):
+            with gzip.open(path, 'rb') as file:
+                while True:
+                    try:
+                        key, value, elapsed = pickle.load(file)
+                    # end of file, or an entry cut short by an interruption
+                    except (EOFError, IOError):
+                        break
+                    self.entries[key] = (value, elapsed)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Return value and seconds taken to record it, None if missing"""
+        return self.entries.get(key)
+
+    def set(self, key, value, elapsed=0.):
+        """Record value (a string) for key, unless already recorded"""
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = (value, elapsed)
+            # each entry is a gzip member of its own so an interrupted
+            #  recording keeps all entries written before
+            with gzip.open(self.path, 'ab') as file:
+                pickle.dump((key, value, elapsed), file, -1)
+
+
 # FUNCTIONS
 def timeit(func, **kwargs):
     """Time a function (platform independent)"""
@@ -0,0 +1,88 @@
+#! /bin/usr/env python
+# D.J. Bennett
+# 18/10/2026
+"""
+pglt sequence store tools
+"""
+
+# PACKAGES
+import os
+from cStringIO import StringIO
+from Bio import SeqIO
+
+# GLOBALS
+# all downloaded sequences in one FASTA file, with an index of where
+#  the sequences of each cluster and name are
+fasta_file = 'sequences.fasta'
+index_file = 'sequences.idx'
+
+
+# FUNCTIONS
+def isStore(directory):
+    """Return True if directory has a sequence store"""
+    return os.path.isfile(os.path.join(directory, index_file))
+
+
+def removeStore(directory):
+    """Remove sequence store in directory, if any"""
+    for each in (fasta_file, index_file):
+        try:
+            os.remove(os.path.join(directory, each))
+        except OSError:
+            pass
+
+
+def writeCluster(directory, cluster, sequences):
+    """Append sequences ([(name, SeqRecord), ...]) of cluster to the \
+store in directory. Return dict of number of sequences and bases by name."""
+    bynames = {}
+    for name, record in sequences:
+        bynames.setdefault(name, []).append(record)
+    counts = {}
+    lines = []
+    with open(os.path.join(directory, fasta_file), 'ab') as file:
+        # file position is not set by append mode till first write
+        file.seek(0, 2)
+        # where the write starts tells it from other writes of cluster
+        start = file.tell()
+        for name in sorted(bynames.keys()):
+            offset = file.tell()
+            for record in bynames[name]:
+                file.write("{0}\n".format(record.format('fasta')))
+            lines.append('{0}\t{1}\t{2}\t{3}\t{4}\n'.format(
+                cluster, name, offset, file.tell() - offset, start))
+            counts[name] = (len(bynames[name]),
+                            sum([len(e) for e in bynames[name]]))
+    # index only once the sequences are written: sequences of a cluster
+    #  cut short by an interruption are never read
+    with open(os.path.join(directory, index_file), 'a') as file:
+        file.write(''.join(lines))
+    return counts
+
+
+def readIndex(directory):
+    """Return {cluster: {name: (offset, length)}} of store in directory"""
+    index = {}
+    writes = {}
+    with open(os.path.join(directory, index_file), 'r') as file:
+        for line in file:
+            cluster, name, offset, length, start =\
+                line.rstrip('\n').split('\t')
+            # a cluster written again (e.g. on a restart) replaces all
+            #  of the earlier
+            if writes.get(cluster) != start:
+                writes[cluster] = start
+                index[cluster] = {}
+            index[cluster][name] = (int(offset), int(length))
+    return index
+
+
+def readCluster(directory, locations):
+    """Yield name and SeqRecords for each name in locations ({name: \
+(offset, length)}) of a cluster in the store in directory"""
+    with open(os.path.join(directory, fasta_file), 'rb') as file:
+        for name in sorted(locations.keys()):
+            offset, length = locations[name]
+            file.seek(offset)
+            yield name, list(SeqIO.parse(StringIO(file.read(length)),
+                                         "fasta"))
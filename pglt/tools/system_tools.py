@@ -226,7 +226,9 @@ class Runner(object):
 
     def _runstage(self, folders, stage):
         """Run stage across folders"""
-        if stage in ['3', '4']:
+        # stage 1 writes resolved names to the parent folder, run one at
+        #  a time; stage 2 requests are rate limited across workers
+        if stage in ['2', '3', '4']:
             nworkers = self.nworkers
         else:
             nworkers = 1
@@ -0,0 +1,173 @@
+#! /bin/usr/env python
+# D.J. Bennett
+# 18/10/2026
+"""
+pglt taxonomy tools
+"""
+
+# PACKAGES
+import os
+import numpy as np
+
+# GLOBALS
+# index files written next to the NCBI taxdump files
+index_files = ['parents', 'ranks', 'divisions', 'children', 'child_offsets',
+               'names', 'name_offsets']
+# taxdump files, the index is rebuilt if any is updated
+dmp_files = ['nodes.dmp', 'names.dmp', 'division.dmp']
+
+
+# CLASSES
+class TaxDump(object):
+    """TaxDump class : offline NCBI taxonomy read from the taxdump files \
+(nodes.dmp, names.dmp and, optionally, division.dmp) of a directory. \
+On first use the files are indexed into numpy arrays, indexed by taxid, \
+that are then memory-mapped."""
+    def __init__(self, directory):
+        self.directory = directory
+        if not self._indexed():
+            buildIndex(directory)
+        for each in index_files:
+            setattr(self, '_' + each, np.load(self._path(each),
+                                              mmap_mode='r'))
+        with open(os.path.join(directory, 'taxdump_ranks.txt'), 'r') as file:
+            self.rank_names = file.read().split('\n')
+        with open(os.path.join(directory, 'taxdump_divisions.txt'), 'r') as\
+                file:
+            self.division_names = file.read().split('\n')
+
+    def _path(self, name):
+        return os.path.join(self.directory, 'taxdump_{0}.npy'.format(name))
+
+    def _indexed(self):
+        """Return True if index files exist and are newer than the \
+taxdump files"""
+        paths = [self._path(e) for e in index_files]
+        if not all([os.path.isfile(e) for e in paths]):
+            return False
+        built = min([os.path.getmtime(e) for e in paths])
+        for each in dmp_files:
+            path = os.path.join(self.directory, each)
+            if os.path.isfile(path) and os.path.getmtime(path) > built:
+                return False
+        return True
+
+    def __contains__(self, taxid):
+        taxid = int(taxid)
+        return 0 < taxid < len(self._parents) and self._parents[taxid] > 0
+
+    def parent(self, taxid):
+        """Return parent taxid"""
+        return int(self._parents[int(taxid)])
+
+    def children(self, taxid):
+        """Return taxids of the rank below taxid, [] if taxid is not in \
+the taxdump"""
+        taxid = int(taxid)
+        if taxid not in self:
+            return []
+        start = self._child_offsets[taxid]
+        end = self._child_offsets[taxid + 1]
+        return [int(e) for e in self._children[start:end]]
+
+    def rank(self, taxid):
+        """Return rank"""
+        return self.rank_names[self._ranks[int(taxid)]]
+
+    def division(self, taxid):
+        """Return division name"""
+        return self.division_names[self._divisions[int(taxid)]]
+
+    def name(self, taxid):
+        """Return scientific name"""
+        taxid = int(taxid)
+        start = self._name_offsets[taxid]
+        end = self._name_offsets[taxid + 1]
+        return self._names[start:end].tostring()
+
+    def lineage(self, taxid):
+        """Return taxids from root to taxid, [] if taxid (or one of its \
+parents) is not in the taxdump"""
+        taxid = int(taxid)
+        res = [taxid]
+        # root (1) is its own parent
+        while taxid != 1:
+            if taxid not in self:
+                return []
+            taxid = int(self._parents[taxid])
+            res.append(taxid)
+        return res[::-1]
+
+    def record(self, taxid):
+        """Return record like those returned by Entrez efetch"""
+        return {'TaxId': str(taxid), 'ScientificName': self.name(taxid),
+                'Rank': self.rank(taxid),
+                'ParentTaxId': str(self.parent(taxid)),
+                'Division': self.division(taxid)}
+
+
+# FUNCTIONS
+def readDmp(filepath):
+    """Yield fields of each row of an NCBI .dmp file"""
+    with open(filepath, 'r') as file:
+        for line in file:
+            yield line.rstrip('\t|\n').split('\t|\t')
+
+
+def buildIndex(directory):
+    """Index taxdump files in directory into numpy arrays"""
+    # read nodes
+    taxids = []
+    parentids = []
+    rank_codes = {}
+    ranks = []
+    divisionids = []
+    for row in readDmp(os.path.join(directory, 'nodes.dmp')):
+        taxids.append(int(row[0]))
+        parentids.append(int(row[1]))
+        ranks.append(rank_codes.setdefault(row[2], len(rank_codes)))
+        divisionids.append(int(row[4]))
+    taxids = np.array(taxids, dtype=np.int32)
+    size = taxids.max() + 1
+    parents = np.zeros(size, dtype=np.int32)
+    parents[taxids] = parentids
+    rank_array = np.zeros(size, dtype=np.uint8)
+    rank_array[taxids] = ranks
+    divisions = np.zeros(size, dtype=np.uint8)
+    divisions[taxids] = divisionids
+    # division names, if available
+    division_names = [''] * (max(divisionids) + 1)
+    division_file = os.path.join(directory, 'division.dmp')
+    if os.path.isfile(division_file):
+        for row in readDmp(division_file):
+            division_names[int(row[0])] = row[2]
+    # children as a compressed sparse row: children of taxid are
+    #  children[child_offsets[taxid]:child_offsets[taxid + 1]]
+    # root is its own parent but not its own child
+    notroot = taxids[taxids != parents[taxids]]
+    order = np.argsort(parents[notroot], kind='mergesort')
+    children = notroot[order]
+    counts = np.bincount(parents[notroot], minlength=size)
+    child_offsets = np.zeros(size + 1, dtype=np.int64)
+    child_offsets[1:] = np.cumsum(counts)
+    # scientific names as one block of bytes
+    names = [''] * size
+    for row in readDmp(os.path.join(directory, 'names.dmp')):
+        if row[3] == 'scientific name':
+            names[int(row[0])] = row[1]
+    name_offsets = np.zeros(size + 1, dtype=np.int64)
+    name_offsets[1:] = np.cumsum([len(e) for e in names])
+    names = np.frombuffer(''.join(names), dtype=np.uint8)
+    # write out
+    arrays = {'parents': parents, 'ranks': rank_array,
+              'divisions': divisions, 'children': children,
+              'child_offsets': child_offsets, 'names': names,
+              'name_offsets': name_offsets}
+    for each in index_files:
+        np.save(os.path.join(directory, 'taxdump_{0}.npy'.format(each)),
+                arrays[each])
+    rank_names = sorted(rank_codes.keys(), key=lambda e: rank_codes[e])
+    with open(os.path.join(directory, 'taxdump_ranks.txt'), 'w') as file:
+        file.write('\n'.join(rank_names))
+    with open(os.path.join(directory, 'taxdump_divisions.txt'), 'w') as file:
+        file.write('\n'.join(division_names))
@@ -13,6 +13,7 @@ from pglt import _MAFFT as mafft
 from pglt import _BLASTN as blastn
 from pglt import _BLASTN as raxml
 import pglt.tools.setup_tools as stools
+import pglt.tools.entrez_tools as etools
 from pglt.tools.system_tools import Runner
 
 
@@ -28,6 +29,8 @@ def main(restart, retry, email, threads, verbose, debug, stages, base_logger):
     temp_dir = os.path.join(os.getcwd(), 'tempfiles')
     if not os.path.isdir(temp_dir):
         os.mkdir(temp_dir)
+    # Entrez responses are cached in the parent tempfiles for all folders
+    etools.setUpCache(temp_dir)
     argspath = os.path.join(temp_dir, 'arguments.p')
     if restart:
         if not os.path.isfile(argspath):
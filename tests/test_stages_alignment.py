@@ -20,7 +20,10 @@ working_dir = os.path.dirname(__file__)
 # DUMMIES
 class Dummy_SeqStore(object):
     def __init__(self, gene_dir, seq_files, maxfails, maxgaps, minoverlap,
-                 logger, wd):
+                 logger, wd, locations=None):
+        pass
+
+    def findOverlaps(self):
         pass
 
     def __len__(self):
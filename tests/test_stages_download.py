@@ -12,22 +12,34 @@ import shutil
 from pglt.stages import download_stage
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
-from pglt.tools.alignment_tools import blastn
 
 
 # DUMMIES
+class Dummy_Error(Exception):
+    pass
+
+
 def dummy_findBestGenes(namesdict, genedict, thoroughness, allrankids, logger,
-                        minnseq, target, minnspp):
+                        minnseq, target, minnspp, client=None,
+                        searchstore=None, maxids=None):
     # return a list of genes
     return ['rbcl', 'COI']
 
 
 class Dummy_Downloader(object):
+    # (gene, taxids) of runs, and the one to fail at
+    calls = []
+    fail = None
+
     def __init__(self, gene_names, nseqs, thoroughness, maxpn, votesize,
-                 maxtrys, minoverlap, maxlen, minlen, logger, wd):
-        pass
+                 maxtrys, minoverlap, maxlen, minlen, logger, wd,
+                 client=None, searchstore=None, maxids=None):
+        self.gene = gene_names[0]
 
     def run(self, taxids):
+        if (self.gene, taxids) == self.fail:
+            raise Dummy_Error
+        self.calls.append((self.gene, taxids))
         seq = 'A' * 500
         seq = SeqRecord(Seq(seq), id='testseq')
         return [seq]
@@ -49,7 +61,6 @@ namesdict['outgroup'] = {"txids": [3], "unique_name": 'outgroup',
 allrankids = []
 
 
-@unittest.skipIf(not blastn, "Requires BLASTN")
 class DownloadStageTestSuite(unittest.TestCase):
 
     def setUp(self):
@@ -88,5 +99,46 @@ class DownloadStageTestSuite(unittest.TestCase):
         # remove files and folders
         self.assertIsNone(res)
 
+    def test_download_stage_resume(self):
+        # interrupted at the last name of the second gene ...
+        names = namesdict.keys()
+        Dummy_Downloader.calls = []
+        Dummy_Downloader.fail = ('COI', namesdict[names[-1]]['txids'])
+        try:
+            self.assertRaises(Dummy_Error, download_stage.run)
+            # ... a restart downloads only that name, without choosing
+            #  genes again
+            Dummy_Downloader.calls = []
+            Dummy_Downloader.fail = None
+            download_stage.dtools.findBestGenes = None
+            download_stage.run()
+            calls = Dummy_Downloader.calls
+        finally:
+            Dummy_Downloader.calls = []
+        self.assertEqual(calls, [('COI', namesdict[names[-1]]['txids'])])
+        # checkpoints are removed once finished
+        self.assertFalse(os.path.isdir(os.path.join(
+            'tempfiles', 'download_checkpoints')))
+
+    def test_download_stage_resume_changed(self):
+        # checkpoints are not reused once parameters change
+        names = namesdict.keys()
+        Dummy_Downloader.calls = []
+        Dummy_Downloader.fail = ('COI', namesdict[names[-1]]['txids'])
+        changed = dict(paradict)
+        changed['nseqs'] = '50'
+        try:
+            self.assertRaises(Dummy_Error, download_stage.run)
+            with open(os.path.join('tempfiles', "paradict.p"), "wb") as\
+                    file:
+                pickle.dump(changed, file)
+            Dummy_Downloader.calls = []
+            Dummy_Downloader.fail = None
+            download_stage.run()
+            calls = Dummy_Downloader.calls
+        finally:
+            Dummy_Downloader.calls = []
+        self.assertEqual(len(calls), 2 * len(names))
+
 if __name__ == '__main__':
     unittest.main()
@@ -11,7 +11,13 @@ import re
 import copy
 import pickle
 import random
+import shutil
+import sqlite3
+import time
+import numpy as np
+import tempfile
 import pglt.tools.alignment_tools as atools
+import pglt.tools.store_tools as stools
 from pglt import _MAFFT as mafft
 from pglt import _MAFFTQ as mafftq
 from pglt import _MAFFTX as mafftx
@@ -41,6 +47,11 @@ with open(os.path.join(working_dir, 'data', 'test_sequences.faa'),
           "rU") as infile:
         test_alignment = AlignIO.read(infile, "fasta")
 
+# distinct sequences
+rng = random.Random(0)
+memo_seqs = [SeqRecord(Seq(''.join([rng.choice('ACGT') for j in range(100)])),
+                       id='memoseq{0}'.format(i)) for i in range(4)]
+
 with open(os.path.join(working_dir, "data", "test_alignment.p"),
           "r") as file:
     real_alignment = pickle.load(file)
@@ -60,13 +71,18 @@ class dummy_Logger(object):
         pass
 
 
-def dummy_blast(query, subj, minoverlap, logger, wd, threads):
-    # should return bools and positions
-    bools = [True for e in query]
-    positions = [0 for e in subj]
-    max_positions = [len(e) for e in subj]
-    positions.extend(max_positions)
-    return bools, positions
+def dummy_blastHits(queries, subjects, logger, wd, threads):
+    # should return hits of each query against each subject
+    # pretend all queries overlap all subjects along their length
+    return [[(1000, 0, len(q)) for s in subjects] for q in queries]
+
+
+def dummy_blastAll(sequences, minoverlap, logger, wd, threads):
+    # every sequence overlaps every other from 1 to 100
+    pairs = [(i, j) for i in range(len(sequences)) for j in
+             range(len(sequences)) if i != j]
+    return tuple([np.array(e) for e in zip(*[(i, j, 100, 1, 100) for i, j in
+                                             pairs])])
 
 
 def dummy_align(command, sequences, timeout, logger, wd, threads):
@@ -89,8 +105,8 @@ class AlignmentTestSuite(unittest.TestCase):
         self.true_align = atools.align
         self.true_add = atools.add
         self.true_check_alignment = atools.checkAlignment
-        self.true_blast = atools.blast
-        atools.blast = dummy_blast
+        self.true_blastHits = atools.blastHits
+        atools.blastHits = dummy_blastHits
         genedir = os.path.join(working_dir, 'data', 'test_sequences')
         seqfiles = sorted(os.listdir(genedir))
         seqfiles = [e for e in seqfiles if not re.search("^\.|^log\.txt$", e)]
@@ -104,7 +120,7 @@ class AlignmentTestSuite(unittest.TestCase):
                                       logger=self.logger)
 
     def tearDown(self):
-        atools.blast = self.true_blast
+        atools.blastHits = self.true_blastHits
         atools.align = self.true_align
         atools.add = self.true_add
         atools.checkAlignment = self.true_check_alignment
@@ -158,11 +174,18 @@ class AlignmentTestSuite(unittest.TestCase):
         # choose sample of real seqs for speed
         queryseqs = random.sample(real_seqs, 5)
         subjseq = random.sample(real_seqs, 1)
-        res, _ = self.true_blast(query=queryseqs, subj=subjseq, minoverlap=50,
-                                 logger=self.logger, wd=self.wd, threads=2)
+        atools.blastHits = self.true_blastHits
+        res, _ = atools.blast(query=queryseqs, subj=subjseq, minoverlap=50,
+                              logger=self.logger, wd=self.wd, threads=2)
         # all true
         self.assertTrue(all(res))
 
+    def test_alignmentmatrix(self):
+        res = atools.alignmentMatrix(test_alignment)
+        self.assertEqual(res.shape, (len(test_alignment),
+                                     test_alignment.get_alignment_length()))
+        self.assertEqual(res[0].tostring(), str(test_alignment[0].seq))
+
     def test_checkalignment_arg_maxgaps(self):
         # check maxgaps argument (proportion of internal gaps)
         # check with good alignment
@@ -193,6 +216,29 @@ class AlignmentTestSuite(unittest.TestCase):
                                     minlen=1, logger=self.logger)
         self.assertFalse(res)
 
+    def test_alignmentchecker(self):
+        checker = atools.AlignmentChecker(maxgaps=0.5, minoverlap=50,
+                                          logger=self.logger)
+        self.assertTrue(checker.check(test_alignment, minlen=1))
+        # an added sequence is checked against kept gap counts
+        added = test_alignment[:]
+        added.append(SeqRecord(Seq('A' * 100), id='added'))
+        self.assertTrue(checker._added(atools.alignmentMatrix(added)))
+        self.assertTrue(checker.check(added, minlen=1))
+        self.assertEqual(len(checker.nnucs), len(added))
+        # as checkAlignment, a bad sequence fails and is not kept
+        bad_alignment = added[:]
+        bad_alignment.append(SeqRecord(Seq('-' * 51 + 'A' * 49), id='bad'))
+        self.assertFalse(checker.check(bad_alignment, minlen=1))
+        self.assertEqual(len(checker.nnucs), len(added))
+        # new columns: all sequences are checked again
+        longer = atools.MultipleSeqAlignment(
+            [SeqRecord(e.seq + 'A', id=e.id) for e in added])
+        self.assertFalse(checker._added(atools.alignmentMatrix(longer)))
+        self.assertEqual(checker.check(longer, minlen=1),
+                         atools.checkAlignment(longer, 0.5, 50, 1,
+                                               self.logger))
+
     def test_checkalignment_arg_minlen(self):
         # check minlen argument
         res = atools.checkAlignment(test_alignment, maxgaps=0.5, minoverlap=1,
@@ -202,7 +248,7 @@ class AlignmentTestSuite(unittest.TestCase):
     @unittest.skipIf(not atools.blastn, "Requires BLASTN")
     def test_seqstore_private_alignmentblast(self):
         # use real blast
-        atools.blast = self.true_blast
+        atools.blastHits = self.true_blastHits
         real_seqs = [e for e in real_alignment]
         next_seqs = random.sample(real_seqs, 5)
         alignment = random.sample(real_seqs, 1)
@@ -230,7 +276,162 @@ class AlignmentTestSuite(unittest.TestCase):
         # and its returned sequence shouldn't have the bad sequence
         self.assertTrue(str(res[1].seq) != str(corrected_seq.seq))
         # switch back to dummy blast
-        atools.blast = dummy_blast
+        atools.blastHits = dummy_blastHits
+
+    def test_parsetabular(self):
+        output = '0\t0\t300\t1\t300\n0\t1\t250\t20\t280\n\
+0\t1\t30\t400\t430\n1\t0\t250\t1\t260\n'
+        res = atools.parseTabular(output)
+        self.assertEqual([e.tolist() for e in res], [[0, 0, 1], [0, 1, 0],
+                                                     [300, 250, 250],
+                                                     [1, 20, 1],
+                                                     [300, 280, 260]])
+        # ids with prefixes
+        res = atools.parseTabular('lcl|q2\tgnl|BL_ORD_ID|3\t50\t1\t50\n')
+        self.assertEqual([e.tolist() for e in res], [[2], [3], [50], [1],
+                                                     [50]])
+        self.assertEqual(len(atools.parseTabular('')[0]), 0)
+
+    def test_overlapgraph(self):
+        hits = atools.parseTabular('0\t1\t250\t20\t280\n\
+0\t2\t100\t1\t110\n2\t0\t100\t5\t105\n')
+        graph = atools.OverlapGraph(3, hits)
+        res = graph.overlaps(0, [1, 2], 200)
+        self.assertEqual(res, ([True, False], [20, 280]))
+        res = graph.overlaps(1, [0, 2], 50)
+        self.assertEqual(res, ([False, False], []))
+
+    def test_blast_memo(self):
+        # pairs are only BLASTed once
+        calls = []
+
+        def dummy_blastBatch(queries, subjects, logger, wd, threads):
+            calls.append(len(queries))
+            return atools.parseTabular(''.join([
+                '{0}\t{1}\t{2}\t1\t{2}\n'.format(i, j, len(q)) for i, q in
+                enumerate(queries) for j, s in enumerate(subjects) if
+                str(q.seq) == str(s.seq)]))
+        true_blastBatch = atools.blastBatch
+        atools.blastBatch = dummy_blastBatch
+        atools.blastHits = self.true_blastHits
+        wd = tempfile.mkdtemp()
+        try:
+            query = memo_seqs[:3]
+            res = atools.blast(query, memo_seqs[0], 50, self.logger, wd, 1)
+            self.assertEqual(res[0], [True, False, False])
+            self.assertEqual(calls, [3])
+            res = atools.blast(memo_seqs[:4], memo_seqs[0], 50, self.logger,
+                               wd, 1)
+            self.assertEqual(res, ([True, False, False, False],
+                                   [1, len(memo_seqs[0])]))
+            # only the unseen query is BLASTed
+            self.assertEqual(calls, [3, 1])
+            # pairs are remembered whichever other subjects they were
+            #  BLASTed with
+            atools.blast(memo_seqs[0], memo_seqs[:2], 50, self.logger, wd, 1)
+            self.assertEqual(calls, [3, 1, 1])
+            res = atools.blast(memo_seqs[0], memo_seqs[1], 50, self.logger,
+                               wd, 1)
+            self.assertEqual(res, ([False], []))
+            self.assertEqual(calls, [3, 1, 1])
+        finally:
+            atools.blastBatch = true_blastBatch
+            shutil.rmtree(wd)
+
+    def test_blastall(self):
+        # hits of sequences to themselves and hits too short are dropped
+        output = '0\t0\t100\t1\t100\n0\t1\t90\t1\t100\n\
+0\t2\t40\t1\t40\n1\t0\t90\t11\t110\n1\t1\t100\t1\t100\n2\t2\t100\t1\t100\n'
+        true_blastBatch = atools.blastBatch
+        atools.blastBatch = lambda queries, subjects, logger, wd, threads:\
+            atools.parseTabular(output)
+        wd = tempfile.mkdtemp()
+        try:
+            res = atools.blastAll(memo_seqs[:3], 50, self.logger, wd, 1)
+        finally:
+            atools.blastBatch = true_blastBatch
+            shutil.rmtree(wd)
+        self.assertEqual([e.tolist() for e in res],
+                         [[0, 1], [1, 0], [90, 90], [1, 11], [100, 110]])
+
+    def test_blastall_memo(self):
+        # a dense cluster: every pair of sequences overlaps
+        n = atools.graph_maxseqs
+        sequences = [SeqRecord(Seq(''.join([rng.choice('ACGT') for j in
+                                            range(100)])), id=str(i)) for i
+                     in range(n)]
+        output = ''.join(['q{0}\ts{1}\t90\t1\t100\n'.format(i, j) for i in
+                          range(n) for j in range(n)])
+        calls = []
+
+        def dummy_blastBatch(queries, subjects, logger, wd, threads):
+            calls.append(len(queries))
+            return atools.parseTabular(output)
+        true_blastBatch = atools.blastBatch
+        atools.blastBatch = dummy_blastBatch
+        wd = tempfile.mkdtemp()
+        try:
+            start = time.time()
+            res = atools.blastAll(sequences, 50, self.logger, wd, 1)
+            blasted = time.time() - start
+            start = time.time()
+            cached = atools.blastAll(sequences, 50, self.logger, wd, 1)
+            remembered = time.time() - start
+            self.assertEqual(calls, [n])
+            self.assertEqual(len(res[0]), n * (n - 1))
+            self.assertEqual([e.tolist() for e in cached],
+                             [e.tolist() for e in res])
+            self.assertLess(remembered, blasted)
+            # one entry for all sequences, under the cap
+            conn = sqlite3.connect(os.path.join(wd, 'blast_cache.db'))
+            try:
+                self.assertEqual(conn.execute(
+                    'SELECT COUNT(*) FROM cache').fetchone()[0], 1)
+            finally:
+                conn.close()
+            self.assertLess(os.path.getsize(os.path.join(
+                wd, 'blast_cache.db')), atools.blast_cache_maxsize)
+            # hits are found again for another minoverlap
+            atools.blastAll(sequences, 95, self.logger, wd, 1)
+            self.assertEqual(calls, [n, n])
+        finally:
+            atools.blastBatch = true_blastBatch
+            shutil.rmtree(wd)
+
+    def test_seqstore_findoverlaps(self):
+        store = copy.deepcopy(self.store)
+        true_blastAll = atools.blastAll
+        atools.blastAll = dummy_blastAll
+        try:
+            store.findOverlaps()
+        finally:
+            atools.blastAll = true_blastAll
+        self.assertEqual(len(store.graph.query), store.nseqs *
+                         (store.nseqs - 1))
+        # sequences chosen from the graph, without blast
+        atools.blastHits = None
+        try:
+            seqs = store.start(3)
+        finally:
+            atools.blastHits = dummy_blastHits
+        self.assertEqual(len(set([e.id for e in seqs])), 3)
+        self.assertTrue(all([len(e) == 99 for e in seqs[1:]]))
+
+    def test_seqstore_findoverlaps_large(self):
+        # overlaps of clusters with too many sequences are found as needed
+        store = copy.deepcopy(self.store)
+        true_graph_maxseqs = atools.graph_maxseqs
+        atools.graph_maxseqs = store.nseqs - 1
+        true_blastAll = atools.blastAll
+        atools.blastAll = None
+        try:
+            store.findOverlaps()
+            seqs = store.start(3)
+        finally:
+            atools.graph_maxseqs = true_graph_maxseqs
+            atools.blastAll = true_blastAll
+        self.assertIsNone(store.graph)
+        self.assertEqual(len(set([e.id for e in seqs])), 3)
 
     def test_seqstore_private_add(self):
         store = copy.deepcopy(self.store)
@@ -242,6 +443,24 @@ class AlignmentTestSuite(unittest.TestCase):
         # the species should no longer be in the pool
         self.assertFalse(res[0].id in store.sppool)
 
+    def test_seqstore_locations(self):
+        # same sequences read from a store as from fasta files
+        store_dir = tempfile.mkdtemp()
+        try:
+            sequences = [(name, e[0]) for name in sorted(self.store.keys())
+                         for e in self.store[name][0]]
+            stools.writeCluster(store_dir, 'gene_cluster0', sequences)
+            locations = stools.readIndex(store_dir)['gene_cluster0']
+            store = atools.SeqStore(store_dir, None, maxfails=10,
+                                    maxgaps=0.5, minoverlap=50,
+                                    logger=self.logger, locations=locations)
+        finally:
+            shutil.rmtree(store_dir)
+        self.assertEqual(sorted(store.keys()), sorted(self.store.keys()))
+        self.assertEqual(store.nseqs, self.store.nseqs)
+        self.assertEqual([str(e[0].seq) for e in store['sp1'][0]],
+                         [str(e[0].seq) for e in self.store['sp1'][0]])
+
     def test_seqstore_start(self):
         store = copy.deepcopy(self.store)
         seqs = store.start(3)
@@ -0,0 +1,90 @@
+#! /bin/usr/env python
+# D.J. Bennett
+# 18/10/2026
+"""
+Tests for cluster tools.
+"""
+
+# PACKAGES
+import random
+import unittest
+from string import maketrans
+import numpy as np
+import pglt.tools.cluster_tools as ctools
+
+# TEST DATA
+rng = random.Random(0)
+gene = ''.join([rng.choice('ACGT') for i in range(2000)])
+other = ''.join([rng.choice('ACGT') for i in range(2000)])
+
+
+def reverseComplement(sequence):
+    return sequence.translate(maketrans('ACGT', 'TGCA'))[::-1]
+
+
+def mutate(sequence, divergence, rng):
+    # substitute a proportion of bases
+    bases = list(sequence)
+    for i in rng.sample(range(len(bases)), int(len(bases) * divergence)):
+        bases[i] = rng.choice([e for e in 'ACGT' if e != bases[i]])
+    return ''.join(bases)
+
+
+class ClusterTestSuite(unittest.TestCase):
+
+    def test_sketch(self):
+        # k-mers are the same whichever strand is read
+        res = ctools.sketch(gene)
+        self.assertTrue(len(res) > 0)
+        self.assertTrue(np.array_equal(res,
+                                       ctools.sketch(reverseComplement(gene))))
+        # k-mers with ambiguous bases are dropped
+        self.assertEqual(len(ctools.sketch('N' * 100)), 0)
+        self.assertEqual(len(ctools.sketch('ACGT')), 0)
+
+    def test_sketches(self):
+        sequences = [gene[:1000], reverseComplement(gene[500:1500]),
+                     gene[1500:], other, gene[600:]]
+        sketches = ctools.Sketches(sequences)
+        res = sketches.overlaps(0, 200)
+        self.assertEqual(res.tolist(), [True, True, False, False, True])
+        # the sequence overlapping most others is central
+        include = np.ones(len(sequences), dtype=bool)
+        self.assertEqual(sketches.central(include, include), 4)
+        candidates = include.copy()
+        candidates[4] = False
+        self.assertEqual(sketches.central(include, candidates), 1)
+
+    def test_sketches_short_overlap(self):
+        # identical but overlapping by fewer than minoverlap bases
+        sequences = [other[:500] + gene[:60], gene[:60] + other[500:1000],
+                     other[1000:1500] + gene[:400],
+                     gene[:400] + other[1500:]]
+        sketches = ctools.Sketches(sequences)
+        self.assertEqual(sketches.overlaps(0, 300).tolist(),
+                         [True, False, False, False])
+        self.assertEqual(sketches.overlaps(2, 300).tolist(),
+                         [False, False, True, True])
+        # sequences shorter than minoverlap overlap nothing
+        self.assertFalse(sketches.overlaps(0, 600).any())
+
+    def test_sketches_divergent(self):
+        # copies 20% divergent from a 650 bp gene share ~520 identical
+        #  bases with it, on either strand and with indels
+        mutate_rng = random.Random(1)
+        copies = [mutate(gene[:650], 0.2, mutate_rng) for i in range(20)]
+        copies = [e if i % 2 else reverseComplement(e) for i, e in
+                  enumerate(copies)]
+        indels = mutate(gene[:650], 0.2, mutate_rng)
+        indels = indels[:200] + indels[203:400] + 'AC' + indels[400:]
+        sequences = [gene[:650]] + copies + [indels, other[:650]]
+        sketches = ctools.Sketches(sequences)
+        self.assertEqual(sketches.overlaps(0, 300).tolist(),
+                         [True] * 22 + [False])
+        res = sketches.identities(0)
+        self.assertEqual(res[0], 650)
+        self.assertTrue(all([450 < e < 560 for e in res[1:22]]))
+        self.assertTrue(res[22] < 100)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,6 +9,11 @@ import unittest
 import pickle
 import logging
 import os
+import time
+import random
+import threading
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
 import pglt.tools.download_tools as dtools
 
 # DIRS
@@ -57,6 +62,9 @@ class dummy_SeqRecord(object):
     def __len__(self):
         return self.length
 
+    def __add__(self, other):
+        return dummy_SeqRecord(self.description, self.length + other.length)
+
 seq1 = dummy_SeqRecord(description="A sequence of NAME1")
 seq2 = dummy_SeqRecord(description="A sequence of NAME2")
 seq3 = [dummy_SeqRecord(description="A sequence of NAME3"),
@@ -65,14 +73,38 @@ seq3 = [dummy_SeqRecord(description="A sequence of NAME3"),
         dummy_SeqRecord(description="A sequence of NAME1")]
 
 
-# Sequences -- just Ts and Fs -- for testing filter
-sequences = [True for i in range(80)]
-sequences.extend([False for i in range(20)])
+# Sequences for filtering and clustering: 80 overlapping parts of a gene
+#  with a few differences and 20 unrelated sequences
+def randomSequence(length, rng):
+    return ''.join([rng.choice('ACGT') for i in range(length)])
+rng = random.Random(0)
+gene = randomSequence(1500, rng)
+cluster_sequences = []
+for i in range(100):
+    if i < 80:
+        start = rng.randint(0, 500)
+        bases = list(gene[start:start + 1000])
+        for j in rng.sample(range(1000), 50):
+            bases[j] = rng.choice('ACGT')
+        bases = ''.join(bases)
+    else:
+        bases = randomSequence(1000, rng)
+    cluster_sequences.append(SeqRecord(Seq(bases), id='seq{0}'.format(i)))
+# 60 copies of the gene's first 650 bp, each 10% divergent from it (so ~20%
+#  from each other), and the 20 unrelated sequences
+divergent_sequences = []
+for i in range(60):
+    bases = list(gene[:650])
+    for j in rng.sample(range(650), 65):
+        bases[j] = rng.choice([e for e in 'ACGT' if e != bases[j]])
+    divergent_sequences.append(SeqRecord(Seq(''.join(bases)),
+                                         id='divergent{0}'.format(i)))
+divergent_sequences.extend(cluster_sequences[80:])
 
 
 # Dependent stubs
 def dummy_eSearch(term, logger, retStart=0, retMax=1, usehistory="n",
-                  db="nucleotide"):
+                  db="nucleotide", client=None):
     if term == t1_term:
         return t1_search_res
     if term == t2_term:
@@ -95,10 +127,45 @@ def dummy_eFetch(ncbi_id, logger, db="nucleotide"):
         return [seq1, seq2, seq3]
 
 
-def dummy_blast(query, subj, minoverlap, logger, wd, threads):
-    # should return bools and positions
-    # pretend they've matched from 0-100 base positions
-    return query, [0, 100]
+def dummy_eFetchIter(ncbi_id, logger, webenv=None, query_key=None,
+                     retStart=0, retMax=100, client=None):
+    for record in dummy_eFetch(ncbi_id, logger):
+        yield record
+
+
+def dummy_eSummary(ncbi_id, logger, client=None):
+    return [{'Id': e, 'Length': summary_lengths.get(e, 500)} for e in
+            ncbi_id]
+summary_lengths = {}
+
+
+def dummy_eFetchFeatures(ncbi_id, logger, client=None):
+    return [{'accession': e, 'features': [
+        ('source', [(1, 16000)], {}),
+        ('gene', [(1000, 1200), (1301, 1500)], {'gene': ['NAME1']})]}
+        for e in ncbi_id]
+
+
+def dummy_eFetchRegion(ncbi_id, start, stop, logger, client=None):
+    dummy_eFetchRegion.calls.append((ncbi_id, start, stop))
+    return dummy_SeqRecord(description=ncbi_id, length=stop - start + 1)
+dummy_eFetchRegion.calls = []
+
+
+def dummy_history_eSearch(term, logger, retStart=0, retMax=1, usehistory="n",
+                          db="nucleotide", client=None):
+    res = {'Count': 2, 'IdList': ['seq1', 'seq2']}
+    if usehistory == 'y':
+        res['WebEnv'] = 'webenv'
+        res['QueryKey'] = '1'
+    return res
+
+
+def dummy_history_eFetch(ncbi_id, logger, db="nucleotide", webenv=None,
+                         query_key=None, retStart=0, retMax=100, client=None):
+    dummy_history_eFetch.calls.append(webenv)
+    return [seq1, seq2]
+dummy_history_eFetch.calls = []
 
 
 def dummy_checkAlignment(alignment, maxgaps, minoverlap, minlen, logger):
@@ -131,11 +198,13 @@ class DownloadTestSuite(unittest.TestCase):
         self.wd = os.getcwd()
         self.true_eSearch = dtools.etools.eSearch
         self.true_eFetch = dtools.etools.eFetch
-        self.true_blast = dtools.atools.blast
+        self.true_eFetchIter = dtools.etools.eFetchIter
+        self.true_eSummary = dtools.etools.eSummary
         self.true_checkAlignment = dtools.atools.checkAlignment
         dtools.etools.eSearch = dummy_eSearch
         dtools.etools.eFetch = dummy_eFetch
-        dtools.atools.blast = dummy_blast
+        dtools.etools.eFetchIter = dummy_eFetchIter
+        dtools.etools.eSummary = dummy_eSummary
         dtools.atools.checkAlignment = dummy_checkAlignment
         # mock Downloader instance
         self.downloader = dtools.Downloader(gene_names=gene_names,
@@ -154,7 +223,6 @@ class DownloadTestSuite(unittest.TestCase):
         self.seq1 = seq1
         self.seq2 = seq2
         self.seq3 = seq3
-        self.sequences = sequences
         self.taxids = taxids
         self.record = sequence
         self.namesdict = namesdict
@@ -165,7 +233,8 @@ class DownloadTestSuite(unittest.TestCase):
         # repatch
         dtools.etools.eSearch = self.true_eSearch
         dtools.etools.eFetch = self.true_eFetch
-        dtools.atools.blast = self.true_blast
+        dtools.etools.eFetchIter = self.true_eFetchIter
+        dtools.etools.eSummary = self.true_eSummary
         dtools.atools.checkAlignment = self.true_checkAlignment
 
     def test_downloader_private_buildsearchterm_thoroughness1(self):
@@ -191,13 +260,53 @@ class DownloadTestSuite(unittest.TestCase):
         res3 = self.downloader._search(self.taxids)
         self.assertEqual([len(res1), len(res2), len(res3)], [2, 1, 0])
 
+    def test_downloader_private_samplesearch(self):
+        # 1000 matches: 4 windows of 5 sampled for 20 maxids, one from the
+        #  first search
+        calls = []
+
+        def large_eSearch(term, logger, retStart=0, retMax=1,
+                          usehistory="n", db="nucleotide", client=None):
+            calls.append((retStart, retMax))
+            ids = ['seq{0}'.format(e) for e in range(count)]
+            return {'Count': str(count),
+                    'IdList': ids[retStart:retStart+retMax]}
+        dtools.etools.eSearch = large_eSearch
+        self.downloader.maxids = 20
+        count = 1000
+        res = self.downloader._sampleSearch('term')
+        self.assertEqual(res['Count'], '1000')
+        self.assertEqual(len(res['IdList']), 20)
+        self.assertEqual(len(set(res['IdList'])), 20)
+        self.assertEqual(len(calls), dtools.nwindows)
+        # too few matches after the first search for a whole window: all
+        #  are from the first search, as many as if all were returned
+        calls[:] = []
+        count = 23
+        res = self.downloader._sampleSearch('term')
+        self.assertEqual(len(res['IdList']), 20)
+        self.assertEqual(len(calls), 1)
+
     def test_downloader_private_filter(self):
-        # weeds out Falses from sequences, should not be any Falses
-        # self.sequences is 80 Ts and 20 Fs
-        sequences = self.sequences[:]
+        # weeds out unrelated sequences, 80 overlap and 20 do not
+        self.downloader.random = random.Random(0)
+        sequences = cluster_sequences[:]
         res_filtered, res_downloaded = self.downloader._filter(sequences)
         self.assertEqual(len(res_filtered), 80)
         self.assertEqual(len(res_downloaded), 20)
+        # too few overlapping sequences to vote
+        res_filtered, res_downloaded = self.downloader._filter(sequences[78:])
+        self.assertEqual(res_filtered, [])
+        self.assertEqual(len(res_downloaded), 22)
+
+    def test_downloader_private_filter_divergent(self):
+        # keeps sequences ~20% divergent from each other, as blastn did
+        self.downloader.random = random.Random(0)
+        self.downloader.minoverlap = 300
+        res_filtered, res_downloaded = self.downloader._filter(
+            divergent_sequences[:])
+        self.assertEqual(len(res_filtered), 60)
+        self.assertEqual(len(res_downloaded), 20)
 
     def test_downloader_private_findgeneinseq(self):
         # change gene names for test
@@ -216,15 +325,55 @@ class DownloadTestSuite(unittest.TestCase):
         self.assertIsNotNone(res)
 
     def test_downloader_private_download(self):
+        # 3 suitable sequences but download stops at nseqs
         res = self.downloader._download(self.seqids)
-        self.assertEqual(len(res), 3)
+        self.assertEqual(len(res), 2)
+
+    def test_downloader_private_prefilter(self):
+        # too short are dropped, too long are kept apart
+        summary_lengths.update({'seq1': 100, 'seq3': 3000})
+        try:
+            res = self.downloader._prefilter(self.seqids[:] + ['seq4'])
+        finally:
+            summary_lengths.clear()
+        self.assertEqual(res, (['seq2', 'seq4'], ['seq3']))
+
+    def test_downloader_private_fetchlarge(self):
+        # only the regions of the gene are fetched, and joined
+        true_eFetchFeatures = dtools.etools.eFetchFeatures
+        true_eFetchRegion = dtools.etools.eFetchRegion
+        dtools.etools.eFetchFeatures = dummy_eFetchFeatures
+        dtools.etools.eFetchRegion = dummy_eFetchRegion
+        dummy_eFetchRegion.calls = []
+        try:
+            records = []
+            self.downloader._fetchLarge(['genome1', 'genome2', 'genome3'],
+                                        records)
+        finally:
+            dtools.etools.eFetchFeatures = true_eFetchFeatures
+            dtools.etools.eFetchRegion = true_eFetchRegion
+        self.assertEqual(len(records), 2)
+        self.assertEqual(len(records[0]), 401)
+        self.assertEqual(len(dummy_eFetchRegion.calls), 4)
+
+    def test_downloader_private_download_history(self):
+        # whole searches should be fetched from the history server
+        dtools.etools.eSearch = dummy_history_eSearch
+        dtools.etools.eFetch = dummy_history_eFetch
+        dummy_history_eFetch.calls = []
+        self.downloader.thoroughness = 1
+        self.downloader.deja_vues = []
+        seqids = self.downloader._search(self.taxids)
+        res = self.downloader._download(seqids)
+        self.assertEqual(len(res), 2)
+        self.assertEqual(dummy_history_eFetch.calls, ['webenv'])
 
     def test_downloader_run(self):
         # reset thoroughness and deja_vues
         self.downloader.thoroughness = 1
         self.downloader.deja_vues = []
         res = self.downloader.run(self.taxids)
-        self.assertEqual(len(res), 3)
+        self.assertEqual(len(res), 2)
 
     def test_findbestgenes(self):
         res = dtools.findBestGenes(self.namesdict, self.genedict, 3,
@@ -232,14 +381,149 @@ class DownloadTestSuite(unittest.TestCase):
                                    minnseq=1, target=1, minnspp=0)
         self.assertEqual(res[0], 'gene1')
 
+    def test_findbestgenes_searchstore(self):
+        # downloads reuse the searches made choosing genes
+        searches = []
+
+        def counting_eSearch(term, *args, **kwargs):
+            searches.append(term)
+            return dummy_eSearch(term, *args, **kwargs)
+        dtools.etools.eSearch = counting_eSearch
+        searchstore = {}
+        dtools.findBestGenes(self.namesdict, self.genedict, 3,
+                             self.allrankids, logger=self.logger, minnseq=1,
+                             target=1, minnspp=0, searchstore=searchstore)
+        nsearches = len(searches)
+        downloader = dtools.Downloader(gene_names=gene_names, nseqs=nseqs,
+                                       thoroughness=thoroughness, maxpn=maxpn,
+                                       votesize=votesize, maxtrys=maxtrys,
+                                       minoverlap=minoverlap, maxlen=maxlen,
+                                       minlen=minlen, logger=self.logger,
+                                       wd=self.wd, searchstore=searchstore)
+        res = downloader._search(self.taxids)
+        self.assertEqual(len(res), 2)
+        self.assertEqual(len(searches), nsearches)
+
+    def test_findbestgenes_deterministic(self):
+        # searches made at once sample the same seqids in every run: all
+        #  downloaders are seeded, in order, before any search is made
+        class recording_Random(random.Random):
+            def random(self):
+                threads.append(threading.current_thread())
+                return random.Random.random(self)
+
+        def large_eSearch(term, logger, retStart=0, retMax=1,
+                          usehistory="n", db="nucleotide", client=None):
+            time.sleep(0.01)
+            ids = ['seq{0}'.format(e) for e in range(1000)]
+            return {'Count': '1000', 'IdList': ids[retStart:retStart+retMax]}
+        dtools.etools.eSearch = large_eSearch
+        names = dict([('species{0}'.format(i), {'txids': [str(i)]}) for i
+                      in range(8)])
+        names['outgroup'] = {'txids': ['8']}
+        client = dtools.etools.Client(email='study@pglt.program',
+                                      maxconnections=4)
+        searchstores = []
+        threads = []
+        for _ in range(2):
+            client.random = recording_Random(0)
+            searchstores.append({})
+            dtools.findBestGenes(names, self.genedict, 1, self.allrankids,
+                                 logger=self.logger, minnseq=1, target=1,
+                                 minnspp=0, client=client,
+                                 searchstore=searchstores[-1], maxids=20)
+        self.assertEqual(len(searchstores[0]), 9)
+        self.assertEqual(searchstores[0], searchstores[1])
+        self.assertEqual(set(threads), set([threading.current_thread()]))
+
+    def test_findbestgenes_checks(self):
+        # only genes suitable for the group are checked, each logged once
+        class recording_Logger(object):
+            def info(self, msg):
+                messages.append(msg)
+
+            def debug(self, msg):
+                pass
+        messages = []
+        genedict = dict(self.genedict)
+        genedict['gene2'] = {'taxid': '4', 'names': ['name3'],
+                             'type': 'deep'}
+        dtools.findBestGenes(self.namesdict, genedict, 3, self.allrankids,
+                             logger=recording_Logger(), minnseq=1, target=1,
+                             minnspp=0)
+        self.assertEqual([e for e in messages if 'checking' in e],
+                         ['.... checking [gene1]'])
+
+    def test_findbestgenes_error(self):
+        # searches still queued when one fails are not made
+        def failing_eSearch(*args, **kwargs):
+            searches.append(None)
+            time.sleep(0.01)
+            raise ValueError
+        dtools.etools.eSearch = failing_eSearch
+        searches = []
+        names = dict([('species{0}'.format(i), {'txids': [str(i)]}) for i
+                      in range(8)])
+        names['outgroup'] = {'txids': ['8']}
+        client = dtools.etools.Client(email='study@pglt.program',
+                                      maxconnections=1)
+        self.assertRaises(ValueError, dtools.findBestGenes, names,
+                          self.genedict, 1, self.allrankids,
+                          logger=self.logger, minnseq=1, target=1,
+                          minnspp=0, client=client)
+        nsearches = len(searches)
+        time.sleep(0.2)
+        self.assertEqual(len(searches), nsearches)
+        self.assertLess(nsearches, 9)
+
     def test_get_clusters(self):
         # make a gene_sequences: [(name, sequence), ...]
         # should return 80 sequences
         names = ['sp1', 'sp2', 'sp3', 'sp4', 'sp5', 'sp6', 'sp7', 'sp8', 'sp9',
                  'sp10']*10
-        gene_sequences = zip(names, self.sequences)
-        res = dtools.getClusters(gene_sequences, 0.5, self.logger, self.wd)
-        self.assertEqual(len(res[0]), 80)
+        gene_sequences = zip(names, cluster_sequences)
+        res = dtools.getClusters(gene_sequences, 200, self.logger, self.wd)
+        self.assertEqual(len(res), 1)
+        self.assertEqual(sorted([e[1].id for e in res[0]]),
+                         sorted(['seq{0}'.format(i) for i in range(80)]))
+        # same clusters every time
+        self.assertEqual(res, dtools.getClusters(gene_sequences, 200,
+                                                 self.logger, self.wd))
+
+    def test_get_clusters_short_overlaps(self):
+        # sequences sharing fewer than minoverlap bases with the gene,
+        #  which every cluster sequence covers, are not clustered
+        names = ['sp{0}'.format(i % 10) for i in range(110)]
+        short_rng = random.Random(1)
+        short_sequences = [SeqRecord(Seq(gene[700:800] + randomSequence(
+            900, short_rng)), id='short{0}'.format(i)) for i in range(10)]
+        gene_sequences = zip(names, cluster_sequences + short_sequences)
+        res = dtools.getClusters(gene_sequences, 200, self.logger, self.wd)
+        self.assertEqual(len(res), 1)
+        self.assertEqual(sorted([e[1].id for e in res[0]]),
+                         sorted(['seq{0}'.format(i) for i in range(80)]))
+
+    def test_get_clusters_divergent(self):
+        # sequences ~20% divergent from each other overlap by over 300
+        #  identical bases
+        names = ['sp{0}'.format(i % 10) for i in range(80)]
+        gene_sequences = zip(names, divergent_sequences)
+        res = dtools.getClusters(gene_sequences, 300, self.logger, self.wd)
+        self.assertEqual(len(res), 1)
+        self.assertEqual(sorted([e[1].id for e in res[0]]),
+                         sorted(['divergent{0}'.format(i) for i in
+                                 range(60)]))
+
+    def test_checkpoint(self):
+        path = dtools.checkpointPath(self.wd, 'gene1', 'name1')
+        self.assertNotEqual(path, dtools.checkpointPath(self.wd, 'gene1',
+                                                        'name2'))
+        dtools.writeCheckpoint(None, path)
+        try:
+            self.assertIsNone(dtools.readCheckpoint(path))
+            self.assertFalse(os.path.isfile(path + '.temp'))
+        finally:
+            os.remove(path)
 
 
 if __name__ == '__main__':
@@ -6,9 +6,23 @@ Tests for Entrez tools.
 """
 
 # PACKAGES
+import os
+import re
+import time
+import pickle
+import shutil
+import tempfile
+import threading
 import unittest
+import urlparse
+import BaseHTTPServer
+from SocketServer import ThreadingMixIn
+from cStringIO import StringIO
 import pglt.tools.entrez_tools as etools
 
+# DIRS
+working_dir = os.path.dirname(__file__)
+
 
 # GLOBALS
 etools.Entrez.email = "entrez.unittests@pglt.program"
@@ -21,7 +35,119 @@ def foo(arg1):
     return arg1
 
 
+esearch_response = '''<?xml version="1.0" ?>
+<!DOCTYPE eSearchResult PUBLIC "-//NLM//DTD eSearchResult, 11 May 2002//EN" \
+"http://www.ncbi.nlm.nih.gov/entrez/query/DTD/eSearch_020511.dtd">
+<eSearchResult><Count>2</Count><RetMax>2</RetMax><RetStart>0</RetStart>\
+<IdList><Id>1</Id><Id>2</Id></IdList><TranslationSet/>\
+<QueryTranslation>term</QueryTranslation></eSearchResult>'''
+
+
+history_response = esearch_response.replace(
+    '<IdList>', '<QueryKey>1</QueryKey><WebEnv>NCID_1</WebEnv><IdList>')
+
+
+def esearch(**kwargs):
+    '''Simple function to test caching, counts calls'''
+    esearch.ncalls += 1
+    if kwargs.get('usehistory') == 'y':
+        return StringIO(history_response)
+    return StringIO(esearch_response)
+esearch.ncalls = 0
+
+# a GenBank response of two records
+with open(os.path.join(working_dir, 'data', "test_findgeneinseq_examplesequence\
+.p"), "r") as file:
+    gb_response = pickle.load(file).format('gb') * 2
+
+
+def efetch(**kwargs):
+    '''Simple function to test streaming, counts calls'''
+    efetch.ncalls += 1
+    return StringIO(gb_response)
+efetch.ncalls = 0
+
+
+# a feature table of two records
+ft_response = '''>Feature gb|AM711897.1|
+1\t16493\tsource
+\t\t\torganism\tAilurus fulgens
+5350\t6894\tgene
+\t\t\tgene\tCOI
+8130\t7461\tgene
+\t\t\tgene\tCOII
+>Feature gb|XX000001.1|
+<1\t100\tCDS
+200\t>300
+\t\t\tproduct\tsplit protein
+'''
+
+# a taxonomy of an order, two families and four genera
+taxonomy = {'1': ('Order', 'order', ['2', '3']),
+            '2': ('FamilyA', 'family', ['10', '11']),
+            '3': ('FamilyB', 'family', ['12', '13']),
+            '10': ('GenusA', 'genus', []), '11': ('GenusB', 'genus', []),
+            '12': ('GenusC', 'genus', []), '13': ('GenusD', 'genus', [])}
+
+
+def dummy_taxonomy_eFetch(ncbi_id, logger, db):
+    dummy_taxonomy_eFetch.ncalls += 1
+    if not isinstance(ncbi_id, list):
+        ncbi_id = [ncbi_id]
+    return [{'TaxId': e, 'ScientificName': taxonomy[e][0],
+             'Rank': taxonomy[e][1], 'Division': 'Division'}
+            for e in ncbi_id]
+dummy_taxonomy_eFetch.ncalls = 0
+
+
+def dummy_taxonomy_eSearch(term, logger, db, retMax):
+    dummy_taxonomy_eSearch.ncalls += 1
+    names = re.findall('(\w+)\[Next Level\]', term)
+    res = []
+    for taxid in taxonomy.keys():
+        if taxonomy[taxid][0] in names:
+            res.extend(taxonomy[taxid][2])
+    return {'Count': len(res), 'IdList': res}
+dummy_taxonomy_eSearch.ncalls = 0
+
+
 # DUMMIES
+class dummy_EutilsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''Answer esearch and efetch with keep-alive, recording clients'''
+    protocol_version = 'HTTP/1.1'
+    clients = set()
+    params = []
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        self.clients.add(self.client_address)
+        self.params.append(urlparse.parse_qs(url.query))
+        ncbi_id = urlparse.parse_qs(url.query).get('id')
+        if url.path.endswith('esearch.fcgi'):
+            body = esearch_response
+        else:
+            body = gb_response
+        if ncbi_id == ['error']:
+            self.send_response(500)
+        else:
+            self.send_response(200)
+        if ncbi_id == ['truncated']:
+            # the connection is closed before the whole body is sent
+            self.send_header('Content-Length', str(len(body) + 100))
+            self.close_connection = True
+        else:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class dummy_EutilsServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
 class dummy_Logger(object):
 
     def __init__(self):
@@ -46,6 +172,298 @@ class EntrezTestSuite(unittest.TestCase):
         # if fails to connect, returns ()
         self.assertEqual(res, ())
 
+    def test_safeconnect_cache(self):
+        # second identical request should be read from the cache
+        etools.setUpCache(os.getcwd())
+        try:
+            esearch.ncalls = 0
+            res1 = etools.safeConnect(efunc=esearch, logger=self.logger,
+                                      term='term', db='nucleotide')
+            res2 = etools.safeConnect(efunc=esearch, logger=self.logger,
+                                      term='term', db='nucleotide')
+            etools.safeConnect(efunc=esearch, logger=self.logger,
+                               term='another term', db='nucleotide')
+        finally:
+            etools.cache = None
+            os.remove('entrez_cache.db')
+        self.assertEqual(res1['IdList'], res2['IdList'])
+        self.assertEqual(esearch.ncalls, 2)
+
+    def test_safeconnect_cache_history(self):
+        # searches posted to the history server are cached without their
+        #  session, which will have expired when read back
+        etools.setUpCache(os.getcwd())
+        try:
+            res1 = etools.safeConnect(efunc=esearch, logger=self.logger,
+                                      term='term', usehistory='y')
+            res2 = etools.safeConnect(efunc=esearch, logger=self.logger,
+                                      term='term', usehistory='y')
+        finally:
+            etools.cache = None
+            os.remove('entrez_cache.db')
+        self.assertEqual(res1['WebEnv'], 'NCID_1')
+        self.assertNotIn('WebEnv', res2.keys())
+        self.assertNotIn('QueryKey', res2.keys())
+        self.assertEqual(res1['IdList'], res2['IdList'])
+
+    def test_safeconnect_coalesce(self):
+        # identical requests at the same time are made only once, each
+        #  caller gets its own results
+        def slow_esearch(**kwargs):
+            time.sleep(0.2)
+            return esearch(**kwargs)
+        slow_esearch.__name__ = 'esearch'
+        esearch.ncalls = 0
+        res = []
+
+        def request():
+            res.append(etools.safeConnect(efunc=slow_esearch,
+                                          logger=self.logger, term='term',
+                                          db='nucleotide'))
+        threads = [threading.Thread(target=request) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(esearch.ncalls, 1)
+        self.assertEqual([e['IdList'] for e in res], [['1', '2']] * 4)
+        self.assertEqual(len(set([id(e) for e in res])), 4)
+        self.assertEqual(etools.inflight, {})
+
+    def test_safestream(self):
+        # records are yielded, complete responses are cached
+        etools.setUpCache(os.getcwd())
+        try:
+            efetch.ncalls = 0
+            stream = etools.safeStream(efunc=efetch, logger=self.logger,
+                                       rettype='gb', id='1')
+            stream.next()
+            # stopping early should not cache a partial response
+            stream.close()
+            res1 = list(etools.safeStream(efunc=efetch, logger=self.logger,
+                                          rettype='gb', id='1'))
+            res2 = list(etools.safeStream(efunc=efetch, logger=self.logger,
+                                          rettype='gb', id='1'))
+        finally:
+            etools.cache = None
+            os.remove('entrez_cache.db')
+        self.assertEqual(len(res1), 2)
+        self.assertEqual(len(res2), 2)
+        self.assertEqual(efetch.ncalls, 2)
+
+    def test_cassette(self):
+        # recorded responses are replayed without requests, including
+        #  streams stopped early
+        etools.setUpCassette(os.getcwd(), 'record')
+        try:
+            esearch.ncalls = efetch.ncalls = 0
+            res1 = etools.safeConnect(efunc=esearch, logger=self.logger,
+                                      term='term', db='nucleotide')
+            stream = etools.safeStream(efunc=efetch, logger=self.logger,
+                                       rettype='gb', id='1')
+            stream.next()
+            stream.close()
+            etools.setUpCassette(os.getcwd(), 'replay', '0.01')
+            res2 = etools.safeConnect(efunc=esearch, logger=self.logger,
+                                      term='term', db='nucleotide')
+            res3 = list(etools.safeStream(efunc=efetch, logger=self.logger,
+                                          rettype='gb', id='1'))
+            # unrecorded requests return nothing
+            res4 = etools.safeConnect(efunc=esearch, logger=self.logger,
+                                      term='another term', db='nucleotide')
+        finally:
+            etools.setUpCassette(os.getcwd())
+            os.remove('entrez_cassette.p.gz')
+        self.assertEqual(res1['IdList'], res2['IdList'])
+        self.assertEqual(len(res3), 1)
+        self.assertEqual(res4, ())
+        self.assertEqual(esearch.ncalls, 1)
+        self.assertEqual(efetch.ncalls, 1)
+
+    def test_cassette_missing(self):
+        # replaying a cassette never recorded fails, for clients too
+        directory = tempfile.mkdtemp()
+        try:
+            self.assertRaises(IOError, etools.setUpCassette, directory,
+                              'replay')
+            client = etools.Client(email='study@pglt.program')
+            self.assertRaises(IOError, client.setUpCassette, directory,
+                              'replay')
+        finally:
+            shutil.rmtree(directory)
+        self.assertIsNone(etools.cassette)
+
+    def test_readfeaturetable(self):
+        res = etools.readFeatureTable(StringIO(ft_response))
+        self.assertEqual([e['accession'] for e in res],
+                         ['AM711897.1', 'XX000001.1'])
+        self.assertEqual(res[0]['features'][2],
+                         ('gene', [(8130, 7461)], {'gene': ['COII']}))
+        self.assertEqual(res[1]['features'][0],
+                         ('CDS', [(1, 100), (200, 300)],
+                          {'product': ['split protein']}))
+
+    def test_findchildren_batched(self):
+        # records are fetched and children searched in batches:
+        #  3 fetches and 2 searches for 7 taxa
+        true_eFetch = etools.eFetch
+        true_eSearch = etools.eSearch
+        etools.eFetch = dummy_taxonomy_eFetch
+        etools.eSearch = dummy_taxonomy_eSearch
+        dummy_taxonomy_eFetch.ncalls = dummy_taxonomy_eSearch.ncalls = 0
+        try:
+            res = etools.findChildren('1', logger=self.logger)
+        finally:
+            etools.eFetch = true_eFetch
+            etools.eSearch = true_eSearch
+        self.assertEqual(sorted(res), ['10', '11', '12', '13'])
+        self.assertEqual(dummy_taxonomy_eFetch.ncalls, 3)
+        self.assertEqual(dummy_taxonomy_eSearch.ncalls, 2)
+
+    def test_ratelimiter(self):
+        # 10 requests at 20 per second, across 2 threads, take ~0.45s
+        limiter = etools.RateLimiter(20)
+
+        def request():
+            for _ in range(5):
+                limiter.wait()
+        t0 = time.time()
+        threads = [threading.Thread(target=request) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertGreater(time.time() - t0, 0.4)
+
+    def test_client(self):
+        # requests share keep-alive connections, no more than
+        #  maxconnections at once, and carry the client's configuration
+        server = dummy_EutilsServer(('localhost', 0), dummy_EutilsHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        dummy_EutilsHandler.clients.clear()
+        dummy_EutilsHandler.params[:] = []
+        try:
+            client = etools.Client(email='study@pglt.program', api_key='key',
+                                   url='http://localhost:{0}/eutils/'.
+                                   format(server.server_address[1]),
+                                   maxconnections=2)
+            self.assertIs(client.limiter, etools.getLimiter('key'))
+            client.limiter = etools.RateLimiter(1000)
+            for _ in range(3):
+                res = etools.eSearch('term', logger=self.logger,
+                                     client=client)
+                self.assertEqual(res['IdList'], ['1', '2'])
+            records = list(etools.eFetchIter('1', logger=self.logger,
+                                             client=client))
+            self.assertEqual(len(records), 2)
+            self.assertEqual(len(dummy_EutilsHandler.clients), 1)
+
+            def request(ncbi_id):
+                for _ in range(3):
+                    etools.eFetch(ncbi_id, logger=self.logger, client=client)
+            threads = [threading.Thread(target=request, args=(str(i),)) for i
+                       in range(4)]
+            for each in threads:
+                each.start()
+            for each in threads:
+                each.join()
+            self.assertLessEqual(len(dummy_EutilsHandler.clients), 2)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(len(dummy_EutilsHandler.params), 16)
+        self.assertEqual(dummy_EutilsHandler.params[0]['email'],
+                         ['study@pglt.program'])
+        self.assertEqual(dummy_EutilsHandler.params[0]['api_key'], ['key'])
+
+    def test_client_failures(self):
+        # failed requests release their connection: with one connection,
+        #  requests after truncated and erroneous responses do not hang
+        server = dummy_EutilsServer(('localhost', 0), dummy_EutilsHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        res = []
+
+        def request():
+            for ncbi_id in ['truncated', 'error', '1']:
+                res.append(etools.safeConnect(
+                    efunc=etools.Entrez.efetch, logger=self.logger,
+                    waittime=0.01, max_check=2, client=client,
+                    db='nucleotide', rettype='gb', retmode='text',
+                    id=ncbi_id))
+        try:
+            client = etools.Client(email='study@pglt.program',
+                                   url='http://localhost:{0}/eutils/'.
+                                   format(server.server_address[1]),
+                                   maxconnections=1)
+            client.limiter = etools.RateLimiter(1000)
+            requester = threading.Thread(target=request)
+            requester.daemon = True
+            requester.start()
+            requester.join(10)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertFalse(requester.isAlive())
+        self.assertEqual(res[:2], [(), ()])
+        self.assertEqual(len(res[2]), 2)
+
+    def test_client_cassette(self):
+        # a client records to, and replays from, its own cassette,
+        #  leaving requests made without a client unrecorded
+        server = dummy_EutilsServer(('localhost', 0), dummy_EutilsHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'http://localhost:{0}/eutils/'.format(server.server_address[1])
+        directory = tempfile.mkdtemp()
+        dummy_EutilsHandler.params[:] = []
+        try:
+            recorder = etools.Client(email='study@pglt.program', url=url)
+            recorder.limiter = etools.RateLimiter(1000)
+            recorder.setUpCassette(directory, 'record')
+            res1 = etools.eSearch('term', logger=self.logger,
+                                  client=recorder)
+            replayer = etools.Client(email='study@pglt.program', url=url)
+            replayer.setUpCassette(directory, 'replay')
+            res2 = etools.eSearch('term', logger=self.logger,
+                                  client=replayer)
+            res3 = etools.eSearch('another term', logger=self.logger,
+                                  client=replayer)
+        finally:
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(directory)
+        self.assertIsNone(etools.cassette)
+        self.assertEqual(res1['IdList'], res2['IdList'])
+        self.assertEqual(res3, ())
+        self.assertEqual(len(dummy_EutilsHandler.params), 1)
+        # both clients' random streams are seeded alike
+        self.assertEqual(recorder.random.random(), replayer.random.random())
+
+    def test_setapikey(self):
+        etools.setApiKey('a key')
+        self.assertEqual(etools.limiter.rate, 10)
+        # Biopython's functions are replaced by a client with the key
+        self.assertEqual(etools.key_client.api_key, 'a key')
+        self.assertIs(etools.key_client.limiter, etools.limiter)
+        self.assertIs(etools._keyClient(etools.Entrez.esearch, None),
+                      etools.key_client)
+        self.assertIsNone(etools._keyClient(dummy_taxonomy_eSearch, None))
+        # clients without a key are still limited to 3 per second
+        client = etools.Client(email='study@pglt.program')
+        self.assertIsNone(client.api_key)
+        self.assertEqual(client.limiter.rate, 3)
+        etools.setApiKey('')
+        self.assertIsNone(etools.api_key)
+        self.assertIsNone(etools.key_client)
+        self.assertIsNone(etools._keyClient(etools.Entrez.esearch, None))
+        self.assertEqual(etools.limiter.rate, 3)
+        self.assertIs(etools.limiter, client.limiter)
+
     def test_efetch_taxonomy(self):
         # 9606 is humans
         res = etools.eFetch(ncbi_id='9606', db='taxonomy', logger=self.logger)
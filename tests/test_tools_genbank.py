@@ -0,0 +1,79 @@
+#! /bin/usr/env python
+# D.J. Bennett
+# 18/10/2026
+"""
+Tests for GenBank tools.
+"""
+
+# PACKAGES
+import os
+import pickle
+import unittest
+from cStringIO import StringIO
+from Bio import SeqIO
+import pglt.tools.genbank_tools as gtools
+
+# DIRS
+working_dir = os.path.dirname(__file__)
+
+# TEST DATA
+with open(os.path.join(working_dir, 'data', "test_findgeneinseq_examplesequence\
+.p"), "r") as file:
+    gb_text = pickle.load(file).format('gb')
+
+
+class GenBankTestSuite(unittest.TestCase):
+
+    def test_countambiguous(self):
+        self.assertEqual(gtools.countAmbiguous('ACGTNNacgtRY-'), 5)
+
+    def test_parselocation(self):
+        res = gtools.parseLocation('<1..>100')
+        self.assertEqual((res.start, res.end, res.strand), (0, 100, 1))
+        res = gtools.parseLocation('complement(join(1..10,21..30))')
+        self.assertEqual([(e.start, e.end, e.strand) for e in res.parts],
+                         [(20, 30, -1), (0, 10, -1)])
+        self.assertIsNone(gtools.parseLocation('J01234.1:1..10'))
+
+    def test_parsegenbank(self):
+        # records as Biopython reads them, with only gene features
+        expected = SeqIO.read(StringIO(gb_text), 'gb')
+        res = list(gtools.parseGenBank(StringIO(gb_text * 2)))
+        self.assertEqual(len(res), 2)
+        self.assertEqual(res[0].id, expected.id)
+        self.assertEqual(res[0].description, expected.description)
+        self.assertEqual(str(res[0].seq), str(expected.seq))
+        expected = [(str(e.location), e.qualifiers.get('gene'),
+                     e.qualifiers.get('product')) for e in expected.features
+                    if set(gtools.qualifier_keys) & set(e.qualifiers.keys())]
+        self.assertEqual([(str(e.location), e.qualifiers.get('gene'),
+                           e.qualifiers.get('product')) for e in
+                          res[0].features], expected)
+
+    def test_parsegenbank_qualifiers(self):
+        # qualifiers and locations over many lines
+        text = '''LOCUS       XX000001                  30 bp    DNA
+DEFINITION  A sequence with a long
+            definition.
+VERSION     XX000001.1
+FEATURES             Location/Qualifiers
+     CDS             join(1..10,
+                     21..30)
+                     /note="a note
+                     /gene=that is not a gene"
+                     /product="a long
+                     product"
+ORIGIN
+        1 acgtacgtac gtacgtacgt acgtacgtac
+//
+'''
+        res = list(gtools.parseGenBank(StringIO(text)))[0]
+        self.assertEqual(res.id, 'XX000001.1')
+        self.assertEqual(res.description, 'A sequence with a long definition.')
+        self.assertEqual(len(res), 30)
+        self.assertEqual(res.features[0].qualifiers,
+                         {'product': ['a long product']})
+        self.assertEqual(len(res.features[0].extract(res)), 20)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,7 @@
 Tests for names tools.
 """
 
+import re
 import unittest
 import pickle
 import os
@@ -67,6 +68,21 @@ def dummy_findChildren(taxid, next, logger):
     return [60]
 
 
+# nuc record counts for outgroup candidates
+candidate_counts = {'60': 5000, '61': 10, '62': 10, '63': 10}
+
+
+def dummy_candidates_eSearch(term, logger):
+    dummy_candidates_eSearch.terms.append(term)
+    txids = re.findall('txid([0-9]+)\[PORGN\]', term)
+    return {'Count': str(sum([candidate_counts[e] for e in txids]))}
+dummy_candidates_eSearch.terms = []
+
+
+def dummy_candidates_findChildren(taxid, next, logger):
+    return [60, 61, 62, 63]
+
+
 class Dummy_GnrDataSources(object):
 
     def __init__(self, logger):
@@ -120,6 +136,16 @@ class NamesTestSuite(unittest.TestCase):
                                        logger=self.logger)
         self.assertEqual(namesdict, exp_namesdict_wo)
 
+    def test_getoutgroup_grouped_counts(self):
+        # only 60 has enough records, found with 3 searches not 4
+        ntools.etools.eSearch = dummy_candidates_eSearch
+        ntools.etools.findChildren = dummy_candidates_findChildren
+        dummy_candidates_eSearch.terms = []
+        namesdict = ntools.getOutgroup(exp_namesdict.copy(), exp_parentid,
+                                       logger=self.logger)
+        self.assertEqual(namesdict['outgroup']['txids'], [60])
+        self.assertEqual(len(dummy_candidates_eSearch.terms), 3)
+
     def test_gentaxtree(self):
         tree = ntools.genTaxTree(self.resolver, exp_namesdict,
                                  logger=self.logger, taxonomy=None, draw=False)
@@ -0,0 +1,162 @@
+#! /bin/usr/env python
+# D.J. Bennett
+# 18/10/2026
+"""
+Tests for local sequence database tools.
+"""
+
+# PACKAGES
+import os
+import shutil
+import pickle
+import unittest
+from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from Bio.SeqFeature import SeqFeature
+from Bio.SeqFeature import FeatureLocation
+from Bio.Alphabet import generic_dna
+import pglt.tools.seqdb_tools as sdbtools
+import pglt.tools.taxonomy_tools as ttools
+import pglt.tools.entrez_tools as etools
+
+# DIRS
+working_dir = os.path.dirname(__file__)
+
+# TEST DATA
+# a mitogenome of the red panda (taxid 9649) ...
+with open(os.path.join(working_dir, 'data', "test_findgeneinseq_examplesequence\
+.p"), "r") as file:
+    mitogenome = pickle.load(file)
+# ... and a predicted rbcL sequence of thale cress (taxid 3702)
+rbcl = SeqRecord(Seq('ACGT' * 100, generic_dna), id='XX000001.1',
+                 name='XX000001', description='Arabidopsis thaliana \
+predicted rbcL gene, complete cds.')
+rbcl.features = [SeqFeature(FeatureLocation(0, 400), type='source',
+                            qualifiers={'db_xref': ['taxon:3702']}),
+                 SeqFeature(FeatureLocation(0, 400), type='gene',
+                            qualifiers={'gene': ['rbcL']}),
+                 SeqFeature(FeatureLocation(0, 400), type='CDS',
+                            qualifiers={'product': ['ribulose-1,5-\
+bisphosphate carboxylase/oxygenase large subunit']})]
+# the red panda's family (9648) and thale cress's genus (3701)
+nodes = [(1, 1, 'no rank'), (9648, 1, 'family'), (9649, 9648, 'species'),
+         (3701, 1, 'genus'), (3702, 3701, 'species')]
+
+
+# DUMMIES
+class dummy_Logger(object):
+
+    def __init__(self):
+        pass
+
+    def info(self, msg):
+        pass
+
+    def debug(self, msg):
+        pass
+
+
+class SeqDBTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        os.mkdir('seqdb')
+        with open(os.path.join('seqdb', 'sequences.gb'), 'w') as file:
+            SeqIO.write([mitogenome, rbcl], file, 'gb')
+        os.mkdir(os.path.join('seqdb', 'taxdump'))
+        with open(os.path.join('seqdb', 'taxdump', 'nodes.dmp'), 'w') as\
+                file:
+            for taxid, parentid, rank in nodes:
+                file.write('{0}\t|\t{1}\t|\t{2}\t|\t\t|\t0\t|\n'.
+                           format(taxid, parentid, rank))
+        with open(os.path.join('seqdb', 'taxdump', 'names.dmp'), 'w') as\
+                file:
+            for taxid, _, _ in nodes:
+                file.write('{0}\t|\ttaxon {0}\t|\t\t|\tscientific name\t|\n'.
+                           format(taxid))
+        self.taxdump = ttools.TaxDump(os.path.join('seqdb', 'taxdump'))
+        self.seqdb = sdbtools.SeqDB('seqdb', taxdump=self.taxdump)
+
+    def tearDown(self):
+        etools.seqdb = None
+        etools.taxdump = None
+        shutil.rmtree('seqdb')
+
+    def test_search(self):
+        res = self.seqdb.search('txid9649[PORGN] AND ("COI"[GENE])',
+                                retMax=10)
+        self.assertEqual(res['IdList'], ['AM711897.1'])
+        # left to right: (both taxa) AND rbcl, NOT predicted
+        res = self.seqdb.search('(txid9649[PORGN]) OR txid3702[PORGN] AND \
+(("rbcl"[GENE]) OR "rbcla"[GENE])', retMax=10)
+        self.assertEqual(res['IdList'], ['XX000001.1'])
+        res = self.seqdb.search('(txid9649[PORGN]) OR txid3702[PORGN] AND \
+(("rbcl"[GENE]) OR "rbcla"[GENE]) NOT predicted[TI]', retMax=10)
+        self.assertEqual(res['Count'], '0')
+        # all fields searches gene names and titles
+        res = self.seqdb.search('txid9649[PORGN] AND "mitochondrial"',
+                                retMax=10)
+        self.assertEqual(res['Count'], '1')
+
+    def test_search_descendants(self):
+        # searches of higher taxa find records of all taxa below them
+        res = self.seqdb.search('txid9648[PORGN]', retMax=10)
+        self.assertEqual(res['IdList'], ['AM711897.1'])
+        res = self.seqdb.search('txid3701[PORGN]', retMax=10)
+        self.assertEqual(res['IdList'], ['XX000001.1'])
+
+    def test_search_wrapped_qualifier(self):
+        # products wrapped over lines are indexed in full
+        res = self.seqdb.search('"ribulose-1,5-bisphosphate carboxylase/\
+oxygenase large subunit"[GENE]', retMax=10)
+        self.assertEqual(res['IdList'], ['XX000001.1'])
+
+    def test_seqdb_needs_taxdump(self):
+        self.assertRaises(ValueError, sdbtools.SeqDB, 'seqdb', None)
+        etools.setUpTaxDump(None)
+        self.assertRaises(ValueError, etools.setUpSeqDB, 'seqdb')
+
+    def test_fetch(self):
+        res = self.seqdb.fetch(['XX000001.1', 'AM711897.1'])
+        self.assertEqual([e.id for e in res], ['XX000001.1', 'AM711897.1'])
+        self.assertEqual(len(res[1]), 16493)
+
+    def test_fetch_other_cwd(self):
+        # files are found from any working directory
+        cwd = os.getcwd()
+        os.chdir(os.path.join('seqdb', 'taxdump'))
+        try:
+            res = self.seqdb.fetch(['XX000001.1'])
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(len(res), 1)
+
+    def test_build_interrupted(self):
+        # an interrupted build leaves no index behind
+        os.remove(self.seqdb.path)
+        true_scanGenBank = sdbtools.scanGenBank
+
+        def dummy_scanGenBank(filepath):
+            raise KeyboardInterrupt
+        sdbtools.scanGenBank = dummy_scanGenBank
+        try:
+            self.assertRaises(KeyboardInterrupt, sdbtools.SeqDB, 'seqdb',
+                              self.taxdump)
+        finally:
+            sdbtools.scanGenBank = true_scanGenBank
+        self.assertEqual([e for e in os.listdir('seqdb') if
+                          e.endswith('.db')], [])
+        seqdb = sdbtools.SeqDB('seqdb', taxdump=self.taxdump)
+        self.assertEqual(seqdb.search('txid3702[PORGN]')['Count'], '1')
+
+    def test_entrez_backend(self):
+        etools.setUpTaxDump(os.path.join('seqdb', 'taxdump'))
+        etools.setUpSeqDB('seqdb')
+        logger = dummy_Logger()
+        res = etools.eSearch('txid3702[PORGN]', logger=logger)
+        self.assertEqual(res['IdList'], ['XX000001.1'])
+        res = etools.eFetch(res['IdList'], logger=logger)
+        self.assertEqual(str(res[0].seq), 'ACGT' * 100)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -53,7 +53,73 @@ class SpecialTestSuite(unittest.TestCase):
         self.assertFalse(os.path.isfile(log_file))
         self.assertFalse(os.path.isdir(names_folder))
 
+    def test_cache(self):
+        cache = stools.Cache('test_cache.db')
+        self.assertIsNone(cache.get('key'))
+        cache.set('key', 'value')
+        self.assertEqual(cache.get('key'), 'value')
+        # reopening the file keeps entries
+        cache = stools.Cache('test_cache.db')
+        self.assertEqual(cache.get('key'), 'value')
+
+    def test_cache_many(self):
+        cache = stools.Cache('test_cache.db')
+        cache.setMany({'key1': 'value1', 'key2': ''})
+        self.assertEqual(cache.getMany(['key1', 'key2', 'key3', 'key1']),
+                         {'key1': 'value1', 'key2': ''})
+
+    def test_cache_ttl(self):
+        cache = stools.Cache('test_cache.db', ttl=0.1)
+        cache.set('key', 'value')
+        time.sleep(0.2)
+        self.assertIsNone(cache.get('key'))
+
+    def test_cache_maxsize(self):
+        # least recently used entries are dropped first, sizes count keys
+        cache = stools.Cache('test_cache.db', maxsize=40, evict_every=1)
+        cache.set('key1', 'a' * 10)
+        time.sleep(0.01)
+        cache.set('key2', 'a' * 10)
+        time.sleep(0.01)
+        cache.get('key1')
+        cache.set('key3', 'a' * 10)
+        self.assertIsNotNone(cache.get('key1'))
+        self.assertIsNone(cache.get('key2'))
+        self.assertIsNotNone(cache.get('key3'))
+        cache.clear()
+        cache.setMany({'k' * 30: ''})
+        time.sleep(0.01)
+        cache.setMany({'j' * 30: ''})
+        self.assertIsNone(cache.get('k' * 30))
+
+    def test_cache_maxsize_file(self):
+        # large entries are evicted before evict_every sets, and the file
+        #  shrinks with them
+        maxsize = 1024 ** 2
+        cache = stools.Cache('test_cache.db', maxsize=maxsize)
+        for i in range(10):
+            cache.set('key{0}'.format(i), 'a' * (maxsize / 4))
+        self.assertIsNone(cache.get('key0'))
+        self.assertIsNotNone(cache.get('key9'))
+        self.assertLess(os.path.getsize('test_cache.db'), maxsize * 1.1)
+
+    def test_cassette(self):
+        cassette = stools.Cassette('test_cassette.p.gz')
+        self.assertIsNone(cassette.get('key'))
+        cassette.set('key', 'value', 1.)
+        # values are never overwritten
+        cassette.set('key', 'another value', 2.)
+        cassette.set('another key', 'value')
+        # reopening the file keeps entries
+        cassette = stools.Cassette('test_cassette.p.gz')
+        self.assertEqual(len(cassette), 2)
+        self.assertEqual(cassette.get('key'), ('value', 1.))
+
     def tearDown(self):
+        if os.path.isfile('test_cache.db'):
+            os.remove('test_cache.db')
+        if os.path.isfile('test_cassette.p.gz'):
+            os.remove('test_cassette.p.gz')
         if os.path.isdir('afolder'):
             shutil.rmtree('afolder')
 
@@ -0,0 +1,65 @@
+#! /bin/usr/env python
+# D.J. Bennett
+# 18/10/2026
+"""
+Tests for store tools.
+"""
+
+# PACKAGES
+import os
+import shutil
+import tempfile
+import unittest
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+import pglt.tools.store_tools as stools
+
+
+# FUNCTIONS
+def genSequences(names, length):
+    return [(name, SeqRecord(Seq('A' * length), id='{0}_{1}'.format(name, i)))
+            for i, name in enumerate(names)]
+
+
+class StoreTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def test_store(self):
+        self.assertFalse(stools.isStore(self.wd))
+        res = stools.writeCluster(self.wd, 'COI_cluster0',
+                                  genSequences(['sp1', 'sp2', 'sp1'], 100))
+        self.assertEqual(res, {'sp1': (2, 200), 'sp2': (1, 100)})
+        stools.writeCluster(self.wd, 'COI_cluster1',
+                            genSequences(['sp2'], 50))
+        self.assertTrue(stools.isStore(self.wd))
+        index = stools.readIndex(self.wd)
+        self.assertEqual(sorted(index.keys()), ['COI_cluster0',
+                                                'COI_cluster1'])
+        res = list(stools.readCluster(self.wd, index['COI_cluster0']))
+        self.assertEqual([e[0] for e in res], ['sp1', 'sp2'])
+        self.assertEqual([e.id for e in res[0][1]], ['sp1_0', 'sp1_2'])
+        self.assertEqual(len(res[1][1][0]), 100)
+        # a cluster written again replaces the earlier
+        stools.writeCluster(self.wd, 'COI_cluster1',
+                            genSequences(['sp2'], 60))
+        index = stools.readIndex(self.wd)
+        res = list(stools.readCluster(self.wd, index['COI_cluster1']))
+        self.assertEqual(len(res[0][1][0]), 60)
+        # ... even with fewer names
+        stools.writeCluster(self.wd, 'COI_cluster0',
+                            genSequences(['sp2'], 70))
+        index = stools.readIndex(self.wd)
+        res = list(stools.readCluster(self.wd, index['COI_cluster0']))
+        self.assertEqual([e[0] for e in res], ['sp2'])
+        self.assertEqual(len(res[0][1][0]), 70)
+        self.assertEqual(len(index['COI_cluster1']), 1)
+        stools.removeStore(self.wd)
+        self.assertEqual(os.listdir(self.wd), [])
+
+if __name__ == '__main__':
+    unittest.main()
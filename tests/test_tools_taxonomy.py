@@ -0,0 +1,119 @@
+#! /bin/usr/env python
+# D.J. Bennett
+# 18/10/2026
+"""
+Tests for taxonomy tools.
+"""
+
+# PACKAGES
+import os
+import shutil
+import unittest
+import pglt.tools.taxonomy_tools as ttools
+import pglt.tools.entrez_tools as etools
+
+# TEST DATA
+# root > cellular organisms > Order > FamilyA (GenusA, GenusB) and
+#  FamilyB (no genera)
+nodes = [(1, 1, 'no rank', 8), (131567, 1, 'no rank', 8),
+         (5, 131567, 'order', 1), (20, 5, 'family', 1), (21, 5, 'family', 1),
+         (300, 20, 'genus', 1), (301, 20, 'genus', 1)]
+names = [(1, 'root'), (131567, 'cellular organisms'), (5, 'Order'),
+         (20, 'FamilyA'), (21, 'FamilyB'), (300, 'GenusA'), (301, 'GenusB')]
+
+
+# DUMMIES
+class dummy_Logger(object):
+
+    def __init__(self):
+        pass
+
+    def info(self, msg):
+        pass
+
+    def debug(self, msg):
+        pass
+
+
+class TaxonomyTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        os.mkdir('taxdump')
+        with open(os.path.join('taxdump', 'nodes.dmp'), 'w') as file:
+            for taxid, parentid, rank, division in nodes:
+                file.write('{0}\t|\t{1}\t|\t{2}\t|\t\t|\t{3}\t|\n'.
+                           format(taxid, parentid, rank, division))
+        with open(os.path.join('taxdump', 'names.dmp'), 'w') as file:
+            for taxid, name in names:
+                file.write('{0}\t|\t{1}\t|\t\t|\tscientific name\t|\n'.
+                           format(taxid, name))
+                file.write('{0}\t|\tsynonym of {1}\t|\t\t|\tsynonym\t|\n'.
+                           format(taxid, name))
+        self.taxdump = ttools.TaxDump('taxdump')
+
+    def tearDown(self):
+        etools.taxdump = None
+        shutil.rmtree('taxdump')
+
+    def test_taxdump_queries(self):
+        self.assertEqual(self.taxdump.parent(300), 20)
+        self.assertEqual(self.taxdump.children(20), [300, 301])
+        self.assertEqual(self.taxdump.children(300), [])
+        self.assertEqual(self.taxdump.rank(21), 'family')
+        self.assertEqual(self.taxdump.name(301), 'GenusB')
+        self.assertEqual(self.taxdump.lineage(301), [1, 131567, 5, 20, 301])
+        self.assertTrue(300 in self.taxdump)
+        self.assertFalse(299 in self.taxdump)
+
+    def test_taxdump_unknown(self):
+        # taxids missing from the dump, within or beyond its range
+        self.assertEqual(self.taxdump.lineage(299), [])
+        self.assertEqual(self.taxdump.lineage(999999), [])
+        self.assertEqual(self.taxdump.children(299), [])
+        self.assertEqual(self.taxdump.children(999999), [])
+
+    def test_taxdump_reload(self):
+        # index files are reused
+        taxdump = ttools.TaxDump('taxdump')
+        self.assertEqual(taxdump.record(300)['ScientificName'], 'GenusA')
+
+    def test_taxdump_updated(self):
+        # names.dmp updated in place after indexing
+        with open(os.path.join('taxdump', 'names.dmp'), 'a') as file:
+            file.write('300\t|\tGenusZ\t|\t\t|\tscientific name\t|\n')
+        later = os.path.getmtime(self.taxdump._path('names')) + 10
+        os.utime(os.path.join('taxdump', 'names.dmp'), (later, later))
+        taxdump = ttools.TaxDump('taxdump')
+        self.assertEqual(taxdump.name(300), 'GenusZ')
+
+    def test_findchildren_offline(self):
+        etools.setUpTaxDump('taxdump')
+        logger = dummy_Logger()
+        res = etools.findChildren(5, logger=logger)
+        self.assertEqual(sorted(res), ['300', '301'])
+        res = etools.findChildren(5, logger=logger, next=True)
+        self.assertEqual(sorted(res), ['20', '21'])
+        res = etools.eFetch('300', logger=logger, db='taxonomy')
+        self.assertEqual(res[0]['ParentTaxId'], '20')
+
+    def test_findchildren_newer_than_taxdump(self):
+        # FamilyC (22) is missing from the taxdump, so its children are
+        #  searched online
+        etools.setUpTaxDump('taxdump')
+        logger = dummy_Logger()
+        true_eFetch = etools.eFetch
+        true_eSearch = etools.eSearch
+        etools.eFetch = lambda ncbi_id, logger, db: [
+            {'TaxId': '22', 'ScientificName': 'FamilyC', 'Rank': 'family',
+             'Division': 'Division'}]
+        etools.eSearch = lambda term, logger, db, retMax: {
+            'Count': 1, 'IdList': ['302']}
+        try:
+            res = etools.findChildren(22, logger=logger, next=True)
+        finally:
+            etools.eFetch = true_eFetch
+            etools.eSearch = true_eSearch
+        self.assertEqual(res, ['302'])
+
+if __name__ == '__main__':
+    unittest.main()